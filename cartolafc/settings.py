@@ -119,3 +119,8 @@ USE_TZ = False
 # https://docs.djangoproject.com/en/1.10/howto/static-files/
 
 STATIC_URL = '/static/'
+
+
+# Gzipped JSON aggregates of every rodada, written by every sync
+
+SNAPSHOT_DIR = os.path.join(BASE_DIR, 'data', 'cache', 'snapshots')
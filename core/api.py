@@ -0,0 +1,108 @@
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F, Q
+from django.http import JsonResponse
+
+from core.deltas import SCOUT_COLUMNS
+from core.models import Atleta, Partida, Scout
+from core.views import cached_view
+
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+class Listagem():
+    """JSON list of the rows of a model, filtered by query parameters and
+    paginated by id.
+
+    'filtros' maps every query parameter to the lookup it filters, or to a
+    function of its value returning a Q. Rows are read with values(), so
+    no model instance is built, and pages are keyset paginated: the page
+    after 'cursor' starts at the first id greater than it, which the
+    primary key index finds without scanning the rows before it like an
+    OFFSET. Every page costs a single query."""
+
+    def __init__(self, queryset, fields, filtros, expressions=None,
+                 distinct=False):
+        self.queryset = queryset
+        self.fields = fields
+        self.filtros = filtros
+        self.expressions = expressions or {}
+        self.distinct = distinct
+
+    def params(self, query):
+        """(filters Q, cursor, limit) of the QueryDict 'query'. Raises
+        ValueError if a parameter is not an integer"""
+        filtro = Q()
+        for name, lookup in self.filtros.items():
+            if name not in query:
+                continue
+            try:
+                value = int(query[name])
+            except ValueError:
+                raise ValueError('{} must be an integer'.format(name))
+            filtro &= (lookup(value) if callable(lookup)
+                       else Q(**{lookup: value}))
+        try:
+            cursor = int(query.get('cursor', 0))
+            limit = min(max(int(query.get('limit', PAGE_SIZE)), 1),
+                        MAX_PAGE_SIZE)
+        except ValueError:
+            raise ValueError('cursor and limit must be integers')
+        return filtro, cursor, limit
+
+    def page(self, request):
+        """The JSON text of the page of 'request', with its 'results' and
+        the URL of the 'next' page, null on the last one"""
+        filtro, cursor, limit = self.params(request.GET)
+        queryset = self.queryset.filter(filtro, id__gt=cursor)
+        if self.distinct:
+            queryset = queryset.distinct()
+        rows = list(queryset.order_by('id').values(
+            *self.fields, **self.expressions)[:limit + 1])
+        next_url = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            query = request.GET.copy()
+            query['cursor'] = rows[-1]['id']
+            next_url = '{}?{}'.format(request.path, query.urlencode())
+        return json.dumps({'results': rows, 'next': next_url},
+                          cls=DjangoJSONEncoder, separators=(',', ':'))
+
+    def as_view(self):
+        page = cached_view(self.page, content_type='application/json')
+
+        def view(request):
+            try:
+                self.params(request.GET)
+            except ValueError as e:
+                return JsonResponse({'error': str(e)}, status=400)
+            return page(request)
+        return view
+
+
+scouts = Listagem(
+    Scout.objects.all(),
+    ('id', 'temporada', 'rodada', 'atleta_id', 'clube_id', 'posicao_id',
+     'status_id', 'partida_id', 'pontos_num', 'preco_num', 'variacao_num',
+     'media_num', 'jogos_num') + SCOUT_COLUMNS,
+    {'temporada': 'temporada', 'rodada': 'rodada', 'clube': 'clube_id',
+     'posicao': 'posicao_id'},
+    {'apelido': F('atleta__apelido')}).as_view()
+
+partidas = Listagem(
+    Partida.objects.all(),
+    ('id', 'temporada', 'rodada', 'clube_casa_id', 'clube_visitante_id',
+     'placar_oficial_mandante', 'placar_oficial_visitante', 'partida_data',
+     'local', 'valida'),
+    {'temporada': 'temporada', 'rodada': 'rodada',
+     'clube': lambda clube_id: (Q(clube_casa_id=clube_id) |
+                                Q(clube_visitante_id=clube_id))}).as_view()
+
+# athletes are filtered by their Scout rows, all on the same row
+atletas = Listagem(
+    Atleta.objects.all(), ('id', 'nome', 'apelido', 'foto'),
+    {'temporada': 'scout__temporada', 'rodada': 'scout__rodada',
+     'clube': 'scout__clube_id', 'posicao': 'scout__posicao_id'},
+    distinct=True).as_view()
@@ -3,3 +3,8 @@ from django.apps import AppConfig
 
 class CoreConfig(AppConfig):
     name = 'core'
+
+    def ready(self):
+        from core import signals, views
+        signals.synced.connect(views.invalidar,
+                               dispatch_uid='core.views.invalidar')
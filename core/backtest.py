@@ -0,0 +1,154 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from core.datasets import CACHE_DIR, DATA_DIR, Table, load_seasons, load_table
+from core.deltas import scout_deltas
+from core.escalacao import FORMACOES, escalar
+from core.projecao import (
+    DISPONIBILIDADE, DUVIDA, PROVAVEL, ProjecaoState, _lookup)
+
+# seasons whose scouts csv has no status_id, which CartolaCsvReader makes
+# up from whether the athlete played the rodada
+SEM_STATUS = (2014, 2015, 2016)
+
+
+class EstrategiaProjecao():
+    """Picks the best squad within 'cartoletas' by ProjecaoState.project"""
+
+    nome = 'projecao'
+
+    def __init__(self, cartoletas=100, formacoes=FORMACOES):
+        self.cartoletas = cartoletas
+        self.formacoes = formacoes
+
+    def pontos(self, state, mercado, partidas):
+        """Expected points of every athlete of 'mercado'"""
+        return state.project(mercado['atleta_id'], mercado['clube_id'],
+                             mercado['status_id'], partidas)
+
+    def escalar(self, state, mercado, partidas):
+        """Atleta ids of the squad picked for the rodada, or None.
+
+        'state' holds every rodada before this one, 'mercado' is a Table
+        of the athletes of the rodada, with the 'preco' they could be
+        bought for, and 'partidas' a Table of the rodada's partidas"""
+        escalacao = escalar(mercado['atleta_id'], mercado['posicao_id'],
+                            mercado['preco'],
+                            self.pontos(state, mercado, partidas),
+                            self.cartoletas, self.formacoes)
+        return None if escalacao is None else escalacao.atleta_ids
+
+
+class EstrategiaMedia(EstrategiaProjecao):
+    """Picks the best squad by the average points of the available
+    athletes in every game before the rodada"""
+
+    nome = 'media'
+
+    def pontos(self, state, mercado, partidas):
+        features = state.features(mercado['atleta_id'], mercado['clube_id'],
+                                  partidas)
+        disponivel = np.in1d(mercado['status_id'], list(DISPONIBILIDADE))
+        return np.nan_to_num(features['media_geral']) * disponivel
+
+
+def _rodadas(table):
+    """Positions of the rows of each rodada of 'table', in rodada order"""
+    rodadas = np.asarray(table['rodada'])
+    order = np.argsort(rodadas, kind='mergesort')
+    bounds = np.flatnonzero(np.diff(rodadas[order])) + 1
+    return [(int(rodadas[rows[0]]), rows)
+            for rows in np.split(order, bounds) if len(rows)]
+
+
+def run_season(ano, estrategia, data_dir=DATA_DIR, cache_dir=CACHE_DIR,
+               n=5):
+    """Replays the rodadas of season 'ano' in order with 'estrategia'.
+
+    A ProjecaoState of the last 'n' games is fitted to the seasons before
+    'ano' and then updated with each rodada right after it is scored, so
+    the strategy only sees what was known before the rodada. Athletes are
+    bought for their price before the rodada and the squad scores the
+    actual pontos_num of its athletes who played. A rodada's status_id is
+    published after it is played, so every athlete is picked by its
+    status of the rodada before, Provável for everyone in the first one
+    and Dúvida for athletes not in the rodada before. SEM_STATUS seasons
+    only tell who played, so an athlete who played the rodada before is
+    Provável and any other Dúvida.
+
+    Returns a Table with the 'pontos' scored by the strategy in every
+    'rodada' and the 'preco' of its squad, NaN when it picked none"""
+    anos = [season for season in load_seasons(None, data_dir, cache_dir)
+            if season <= ano]
+    scouts = load_table('scouts', anos, data_dir, cache_dir)
+    partidas = load_table('partidas', anos, data_dir, cache_dir)
+    state = ProjecaoState(n).fit(scouts.take(scouts['temporada'] < ano),
+                                 partidas.take(partidas['temporada'] < ano))
+    season = scout_deltas(scouts.take(scouts['temporada'] == ano))
+    season['preco'] = season['preco_num'] - season['variacao_num']
+    season_partidas = partidas.take(partidas['temporada'] == ano)
+    partidas_by_rodada = dict(_rodadas(season_partidas))
+
+    rodadas = _rodadas(season)
+    result = Table((
+        ('estrategia', np.array([estrategia.nome] * len(rodadas),
+                                dtype=np.unicode_)),
+        ('temporada', np.full(len(rodadas), ano, dtype='i4')),
+        ('rodada', np.array([rodada for rodada, rows in rodadas],
+                            dtype='i4')),
+        ('pontos', np.full(len(rodadas), np.nan)),
+        ('preco', np.full(len(rodadas), np.nan)),
+    ))
+    # atleta ids, sorted, and status ids of the rodada before
+    anteriores = None
+    for i, (rodada, rows) in enumerate(rodadas):
+        mercado = season.take(rows)
+        status_ids = np.asarray(mercado['status_id'])
+        if ano in SEM_STATUS:
+            status_ids = np.where(mercado['jogou'], PROVAVEL, DUVIDA)
+        order = np.argsort(mercado['atleta_id'], kind='mergesort')
+        atuais = (np.asarray(mercado['atleta_id'])[order], status_ids[order])
+        if anteriores is None:
+            mercado['status_id'] = np.full(len(rows), PROVAVEL,
+                                           dtype=status_ids.dtype)
+        else:
+            index, found = _lookup(anteriores[0], mercado['atleta_id'])
+            mercado['status_id'] = np.where(found, anteriores[1][index],
+                                            DUVIDA)
+        anteriores = atuais
+        rodada_partidas = season_partidas.take(
+            partidas_by_rodada.get(rodada, np.zeros(0, dtype=np.intp)))
+        atleta_ids = estrategia.escalar(state, mercado, rodada_partidas)
+        if atleta_ids is not None:
+            picked = np.in1d(mercado['atleta_id'], atleta_ids)
+            result['pontos'][i] = mercado['pontos_num'][
+                picked & mercado['jogou']].sum()
+            result['preco'][i] = mercado['preco'][picked].sum()
+        state.update(ano, rodada, mercado, rodada_partidas)
+    return result
+
+
+def _run_season(task):
+    return run_season(*task)
+
+
+def backtest(estrategias, anos=None, data_dir=DATA_DIR, cache_dir=CACHE_DIR,
+             n=5, jobs=1):
+    """Backtests every strategy in 'estrategias' over every season in
+    'anos' (all by default), see run_season.
+
+    Every (season, strategy) pair is independent, so with 'jobs' > 1 they
+    are spread over that many worker processes, which share the column
+    cache of the seasons. Returns the Tables of all pairs concatenated"""
+    anos = list(load_seasons(anos, data_dir, cache_dir))
+    tasks = [(ano, estrategia, data_dir, cache_dir, n)
+             for estrategia in estrategias for ano in anos]
+    if jobs > 1 and len(tasks) > 1:
+        # build stale caches once here, rather than racing in the workers
+        for dataset in load_seasons(None, data_dir, cache_dir).values():
+            if dataset.is_stale():
+                dataset.build()
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            return Table.concat(executor.map(_run_season, tasks))
+    return Table.concat(_run_season(task) for task in tasks)
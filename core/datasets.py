@@ -0,0 +1,228 @@
+import hashlib
+import json
+import os
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+
+from core.importers import find_season_files, read_season
+from core.models import SCOUTS
+
+DATA_DIR = os.path.join(settings.BASE_DIR, 'data')
+CACHE_DIR = os.path.join(DATA_DIR, 'cache')
+
+# columns of every table, in order, with the dtype they are stored with;
+# text columns are stored as fixed width unicode, so they can be mmapped
+COLUMNS = {
+    'clubes': (('id', 'i4'), ('nome', 'U'), ('abreviacao', 'U')),
+    'atletas': (('id', 'i4'), ('nome', 'U'), ('apelido', 'U')),
+    'partidas': (
+        ('id', 'i4'), ('rodada', 'i4'), ('clube_casa_id', 'i4'),
+        ('clube_visitante_id', 'i4'), ('clube_casa_posicao', 'i4'),
+        ('clube_visitante_posicao', 'i4'), ('placar_oficial_mandante', 'i4'),
+        ('placar_oficial_visitante', 'i4'), ('partida_data', 'M8[s]'),
+        ('valida', '?')),
+    'scouts': (
+        ('rodada', 'i4'), ('atleta_id', 'i4'), ('clube_id', 'i4'),
+        ('posicao_id', 'i4'), ('status_id', 'i4'), ('pontos_num', 'f8'),
+        ('preco_num', 'f8'), ('variacao_num', 'f8'), ('media_num', 'f8'),
+        ('jogos_num', 'i4')) + tuple(
+            ('scouts_{}'.format(key), 'i4') for key in SCOUTS),
+}
+# bump to invalidate every cache built by an older layout
+CACHE_VERSION = 1
+
+
+class Table(OrderedDict):
+    """Columns of a table as equally long NumPy arrays, by name"""
+
+    @property
+    def num_rows(self):
+        for column in self.values():
+            return len(column)
+        return 0
+
+    @property
+    def columns(self):
+        return list(self.keys())
+
+    def take(self, index):
+        """Rows selected by a boolean mask or an array of positions"""
+        return Table((name, column[index]) for name, column in self.items())
+
+    def to_frame(self):
+        """The table as a pandas DataFrame"""
+        import pandas as pd
+        return pd.DataFrame(OrderedDict(self.items()))
+
+    @classmethod
+    def concat(cls, tables):
+        tables = [table for table in tables if table]
+        if not tables:
+            return cls()
+        return cls((name, np.concatenate([table[name] for table in tables]))
+                   for name in tables[0])
+
+
+def _file_hash(path):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def _to_array(values, dtype):
+    if dtype == 'U':
+        return np.array(values, dtype=np.unicode_) if values else \
+            np.zeros(0, dtype='U1')
+    if dtype == 'M8[s]':
+        return np.array(values, dtype='M8[s]')
+    return np.array(values, dtype=dtype)
+
+
+class SeasonDataset():
+    """The clubes, atletas, partidas and scouts of one season as columnar
+    tables, cached on disk as one .npy file per column.
+
+    The cache is rebuilt from the season's csv files whenever their size,
+    mtime and content hash no longer match the ones it was built from.
+    Columns are memory-mapped read-only, so worker processes loading the
+    same season share the pages of the OS file cache."""
+
+    def __init__(self, ano, files, cache_dir=CACHE_DIR):
+        self.ano = ano
+        self.files = files
+        self.cache_dir = os.path.join(cache_dir, str(ano))
+        self._tables = {}
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.cache_dir, 'manifest.json')
+
+    def _read_manifest(self):
+        try:
+            with open(self.manifest_path) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return None
+
+    def _sources(self, manifest=None):
+        """Fingerprint of the source files. The content hash is only
+        recomputed when size or mtime differ from 'manifest'"""
+        old_sources = (manifest or {}).get('sources', {})
+        sources = {}
+        for table, path in sorted(self.files.items()):
+            stat = os.stat(path)
+            source = {'path': os.path.abspath(path), 'size': stat.st_size,
+                      'mtime': stat.st_mtime}
+            old = old_sources.get(table)
+            if (old and old['path'] == source['path'] and
+                    old['size'] == source['size'] and
+                    old['mtime'] == source['mtime']):
+                source['sha1'] = old['sha1']
+            else:
+                source['sha1'] = _file_hash(path)
+            sources[table] = source
+        return sources
+
+    def is_stale(self):
+        manifest = self._read_manifest()
+        if manifest is None or manifest.get('version') != CACHE_VERSION:
+            return True
+        sources = self._sources(manifest)
+        if sources == manifest['sources']:
+            return False
+        same_content = (
+            {table: source['sha1'] for table, source in sources.items()} ==
+            {table: source['sha1']
+             for table, source in manifest['sources'].items()})
+        if same_content:
+            # only touched, record the new mtimes and keep the cache
+            self._write_manifest(sources)
+            return False
+        return True
+
+    def _write_manifest(self, sources):
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': CACHE_VERSION, 'ano': self.ano,
+                       'sources': sources}, f)
+        os.replace(tmp_path, self.manifest_path)
+
+    def build(self):
+        """Converts the season's csv files into the column cache"""
+        sources = self._sources()
+        if os.path.exists(self.manifest_path):
+            os.remove(self.manifest_path)
+        season = read_season(self.ano, self.files)
+        for table, columns in COLUMNS.items():
+            values = OrderedDict((name, []) for name, dtype in columns)
+            for obj in season.get(table, ()):
+                for name, column in values.items():
+                    column.append(getattr(obj, name))
+            table_dir = os.path.join(self.cache_dir, table)
+            os.makedirs(table_dir, exist_ok=True)
+            for name, dtype in columns:
+                column = values[name]
+                if name == 'id' and table == 'partidas':
+                    # partidas of 2017 have no id
+                    column = [-1 if value is None else value
+                              for value in column]
+                path = os.path.join(table_dir, '{}.npy'.format(name))
+                tmp_path = path + '.tmp.npy'
+                np.save(tmp_path, _to_array(column, dtype))
+                os.replace(tmp_path, path)
+        # written last, so an interrupted build is rebuilt next time
+        self._write_manifest(sources)
+        self._tables = {}
+
+    def load(self, table):
+        """The Table named 'table', rebuilding the cache first if stale"""
+        if table not in self._tables:
+            if self.is_stale():
+                self.build()
+            table_dir = os.path.join(self.cache_dir, table)
+            self._tables[table] = Table(
+                (name, np.load(os.path.join(table_dir, '{}.npy'.format(name)),
+                               mmap_mode='r'))
+                for name, dtype in COLUMNS[table])
+        return self._tables[table]
+
+    @property
+    def clubes(self):
+        return self.load('clubes')
+
+    @property
+    def atletas(self):
+        return self.load('atletas')
+
+    @property
+    def partidas(self):
+        return self.load('partidas')
+
+    @property
+    def scouts(self):
+        return self.load('scouts')
+
+
+def load_seasons(anos=None, data_dir=DATA_DIR, cache_dir=CACHE_DIR):
+    """SeasonDataset of every season in 'anos' (all by default) under
+    'data_dir', by ano"""
+    return OrderedDict(
+        (ano, SeasonDataset(ano, files, cache_dir))
+        for ano, files in find_season_files(data_dir).items()
+        if anos is None or ano in anos)
+
+
+def load_table(table, anos=None, data_dir=DATA_DIR, cache_dir=CACHE_DIR):
+    """Table 'table' of several seasons concatenated, with an extra
+    'temporada' column telling the season of each row"""
+    tables = []
+    for ano, dataset in load_seasons(anos, data_dir, cache_dir).items():
+        season_table = Table(dataset.load(table))
+        season_table['temporada'] = np.full(season_table.num_rows, ano,
+                                            dtype='i4')
+        tables.append(season_table)
+    return Table.concat(tables)
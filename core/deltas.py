@@ -0,0 +1,69 @@
+import numpy as np
+
+from core.datasets import Table
+from core.models import SCOUTS
+
+SCOUT_COLUMNS = tuple('scouts_{}'.format(key) for key in SCOUTS)
+# seasons whose scouts csv holds per round counts; every other season,
+# like 2015 and the mercado endpoint, holds season cumulative counts
+PER_ROUND_SEASONS = (2014, 2016)
+
+
+def is_cumulative(temporada):
+    """Boolean mask of the rows of 'temporada' holding cumulative scouts"""
+    return ~np.in1d(temporada, PER_ROUND_SEASONS)
+
+
+def scout_deltas(scouts):
+    """Turns the season cumulative scouts of a Table into per round counts.
+
+    'scouts' is a Table of Scout rows with a 'temporada' column, such as
+    load_table('scouts'). Rows are grouped by (temporada, atleta_id) and
+    each row is differenced against the previous rodada the athlete
+    appears in, so a skipped rodada is counted in the next one and a club
+    change does not reset the counts. Rows of PER_ROUND_SEASONS are kept
+    as they are.
+
+    Returns a new Table, in the same row order, with the scouts_* columns
+    replaced by per round counts (negative corrections clipped to 0) and a
+    boolean 'jogou' column telling whether the athlete played the round."""
+    n = scouts.num_rows
+    result = Table(scouts)
+    if not n:
+        result['jogou'] = np.zeros(0, dtype=bool)
+        return result
+
+    order = np.lexsort((scouts['rodada'], scouts['atleta_id'],
+                        scouts['temporada']))
+    temporada = np.asarray(scouts['temporada'])[order]
+    atleta_id = np.asarray(scouts['atleta_id'])[order]
+    first = np.ones(n, dtype=bool)
+    first[1:] = ((temporada[1:] != temporada[:-1]) |
+                 (atleta_id[1:] != atleta_id[:-1]))
+    cumulative = is_cumulative(temporada)
+    # positions, in sorted order, of the rows to difference
+    diff = cumulative & ~first
+
+    values = np.column_stack(
+        [np.asarray(scouts[name])[order] for name in SCOUT_COLUMNS +
+         ('jogos_num',)]).astype('i4')
+    deltas = values.copy()
+    deltas[1:][diff[1:]] -= values[:-1][diff[1:]]
+    np.maximum(deltas, 0, out=deltas)
+
+    jogou = np.empty(n, dtype=bool)
+    jogou[cumulative] = deltas[cumulative, -1] > 0
+    per_round = ~cumulative
+    # seasons stored per round do not count games, a scout or a non zero
+    # score means the athlete played
+    jogou[per_round] = ((deltas[per_round, :-1] != 0).any(axis=1) |
+                        (np.asarray(scouts['pontos_num'])[order][per_round]
+                         != 0))
+
+    # back to the original row order
+    inverse = np.empty(n, dtype=np.intp)
+    inverse[order] = np.arange(n)
+    for i, name in enumerate(SCOUT_COLUMNS):
+        result[name] = deltas[inverse, i]
+    result['jogou'] = jogou[inverse]
+    return result
@@ -0,0 +1,255 @@
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from core.datasets import Table
+
+GOL, LAT, ZAG, MEI, ATA, TEC = 1, 2, 3, 4, 5, 6
+
+# number of athletes of each Posicao id per formation; 3 defenders are
+# all zagueiros, 4 or 5 defenders include 2 laterais
+FORMACOES = OrderedDict((
+    ('3-4-3', {GOL: 1, ZAG: 3, MEI: 4, ATA: 3, TEC: 1}),
+    ('3-5-2', {GOL: 1, ZAG: 3, MEI: 5, ATA: 2, TEC: 1}),
+    ('4-3-3', {GOL: 1, LAT: 2, ZAG: 2, MEI: 3, ATA: 3, TEC: 1}),
+    ('4-4-2', {GOL: 1, LAT: 2, ZAG: 2, MEI: 4, ATA: 2, TEC: 1}),
+    ('4-5-1', {GOL: 1, LAT: 2, ZAG: 2, MEI: 5, ATA: 1, TEC: 1}),
+    ('5-3-2', {GOL: 1, LAT: 2, ZAG: 3, MEI: 3, ATA: 2, TEC: 1}),
+    ('5-4-1', {GOL: 1, LAT: 2, ZAG: 3, MEI: 4, ATA: 1, TEC: 1}),
+))
+
+Escalacao = namedtuple('Escalacao', 'formacao atleta_ids pontos preco')
+
+
+def to_cents(precos):
+    return np.round(np.asarray(precos, dtype='f8') * 100).astype(np.intp)
+
+
+def non_dominated(precos, pontos, k):
+    """Positions of the athletes that may be part of a best pick of 'k'.
+
+    An athlete is dominated when 'k' others cost no more and score no
+    less, since any pick including it can swap it for one of them."""
+    n = len(precos)
+    if n <= k:
+        return np.arange(n)
+    # cheapest first, best first among equal prices, so an athlete is only
+    # dominated by the ones sorted before it
+    order = np.lexsort((-pontos, precos))
+    sorted_pontos = pontos[order]
+    before = np.tri(n, k=-1, dtype=bool)
+    dominators = before & (sorted_pontos[np.newaxis, :] >=
+                           sorted_pontos[:, np.newaxis])
+    return np.sort(order[dominators.sum(axis=1) < k])
+
+
+class PosicaoKnapsack():
+    """Best picks of 0 to 'k' athletes of a single Posicao for every budget
+    from 0 to 'budget' cents.
+
+    'best[j, c]' is the best sum of points of exactly j athletes costing at
+    most c cents (-inf if there is none), and 'take' records which athlete
+    improved which state, to recover the picks."""
+
+    def __init__(self, precos, pontos, k, budget):
+        self.k = k
+        candidates = non_dominated(precos, pontos, k)
+        candidates = candidates[precos[candidates] <= budget]
+        self.candidates = candidates
+        self.precos = precos[candidates]
+        best = np.full((k + 1, budget + 1), -np.inf)
+        best[0] = 0
+        take = np.zeros((len(candidates), k + 1, budget + 1), dtype=bool)
+        for i, (preco, pontos_) in enumerate(zip(self.precos,
+                                                 pontos[candidates])):
+            candidate = best[:-1, :budget + 1 - preco] + pontos_
+            improved = candidate > best[1:, preco:]
+            take[i, 1:, preco:] = improved
+            best[1:, preco:][improved] = candidate[improved]
+        self.best = best
+        self.take = take
+
+    def breakpoints(self, j):
+        """Budgets at which the best pick of 'j' athletes improves, with
+        the points of that pick"""
+        best = self.best[j]
+        steps = np.flatnonzero(np.isfinite(best) &
+                               (best > np.concatenate(([-np.inf], best[:-1]))))
+        return steps, best[steps]
+
+    def pick(self, j, budget):
+        """Positions, in the arrays given to the optimizer, of the best
+        'j' athletes costing at most 'budget' cents"""
+        picked = []
+        for i in range(len(self.candidates) - 1, -1, -1):
+            if j == 0:
+                break
+            if self.take[i, j, budget]:
+                picked.append(self.candidates[i])
+                j -= 1
+                budget -= self.precos[i]
+        return picked
+
+
+class EscalacaoOptimizer():
+    """Finds the squad with the most projected points within a budget.
+
+    'atleta_ids', 'posicao_ids', 'precos' and 'pontos' are equally long
+    sequences, one item per athlete available in the mercado, and
+    'cartoletas' is the budget. Prices are handled in cents.
+
+    Each Posicao is solved once, as an exact knapsack over every budget up
+    to 'cartoletas' after pruning dominated athletes, and shared by all
+    the formations. A formation then combines its positions by folding the
+    budgets at which each of them improves."""
+
+    def __init__(self, atleta_ids, posicao_ids, precos, pontos, cartoletas,
+                 formacoes=FORMACOES):
+        self.atleta_ids = np.asarray(atleta_ids)
+        self.posicao_ids = np.asarray(posicao_ids)
+        self.precos = to_cents(precos)
+        self.pontos = np.asarray(pontos, dtype='f8')
+        self.budget = int(to_cents(cartoletas))
+        self.formacoes = formacoes
+        self.knapsacks = {}
+        for formacao in formacoes.values():
+            for posicao_id, k in formacao.items():
+                self.knapsacks[posicao_id] = max(
+                    k, self.knapsacks.get(posicao_id, 0))
+        for posicao_id, k in self.knapsacks.items():
+            index = np.flatnonzero(self.posicao_ids == posicao_id)
+            knapsack = PosicaoKnapsack(self.precos[index], self.pontos[index],
+                                       k, self.budget)
+            knapsack.candidates = index[knapsack.candidates]
+            self.knapsacks[posicao_id] = knapsack
+        self._folds = {}
+
+    def fold(self, nome):
+        """Best points of the formation 'nome' for every budget, with what
+        each of its positions spends, as (total, [(posicao_id, k, spent)]).
+        Computed once per formation and kept for every later budget"""
+        if nome not in self._folds:
+            self._folds[nome] = self._fold(self.formacoes[nome])
+        return self._folds[nome]
+
+    def _fold(self, formacao):
+        positions = [(posicao_id, k) + self.knapsacks[posicao_id]
+                     .breakpoints(k)
+                     for posicao_id, k in formacao.items()]
+        # the position with the most breakpoints starts the fold, the
+        # others are added one breakpoint at a time
+        positions.sort(key=lambda position: len(position[2]))
+        posicao_id, k, steps, values = positions.pop()
+        total = self.knapsacks[posicao_id].best[k].copy()
+        first = (posicao_id, k, None)
+        folded = []
+        for posicao_id, k, steps, values in positions:
+            new_total = np.full_like(total, -np.inf)
+            spent = np.full(len(total), -1, dtype=np.intp)
+            for step, value in zip(steps, values):
+                candidate = total[:len(total) - step] + value
+                improved = candidate > new_total[step:]
+                new_total[step:][improved] = candidate[improved]
+                spent[step:][improved] = step
+            total = new_total
+            folded.append((posicao_id, k, spent))
+        return total, [first] + folded
+
+    def solve_formacao(self, nome, budget=None):
+        """Best Escalacao of the formation 'nome' costing at most 'budget'
+        cents (all the cartoletas by default), or None if none fits"""
+        budget = self.budget if budget is None else budget
+        total, positions = self.fold(nome)
+        if not np.isfinite(total[budget]):
+            return None
+        # cheapest budget reaching the best points
+        budget = int(np.argmax(total[:budget + 1] == total[budget]))
+        picked = []
+        for posicao_id, k, spent in reversed(positions[1:]):
+            step = spent[budget]
+            picked.extend(self.knapsacks[posicao_id].pick(k, step))
+            budget -= step
+        posicao_id, k, _ = positions[0]
+        picked.extend(self.knapsacks[posicao_id].pick(k, budget))
+        picked = np.sort(picked)
+        return Escalacao(nome, self.atleta_ids[picked],
+                         float(self.pontos[picked].sum()),
+                         self.precos[picked].sum() / 100.0)
+
+    def solve(self):
+        """Best Escalacao among all the formations, or None if no formation
+        fits the budget"""
+        best = None
+        for nome in self.formacoes:
+            escalacao = self.solve_formacao(nome)
+            if escalacao is not None and (
+                    best is None or escalacao.pontos > best.pontos):
+                best = escalacao
+        return best
+
+    def solve_grid(self, orcamentos, formacoes=None):
+        """Best Escalacao of every formation in 'formacoes' (all by
+        default) for every budget in 'orcamentos', in cartoletas.
+
+        Returns a Table with one row per (formacao, cartoletas) scenario,
+        formations first, and the 'pontos', 'preco' and 'atleta_ids' of its
+        best squad. 'atleta_ids' is a 2-d column padded with -1, and a
+        scenario no squad fits has NaN pontos and preco"""
+        nomes = list(self.formacoes if formacoes is None else formacoes)
+        orcamentos = np.asarray(orcamentos, dtype='f8')
+        size = max(sum(self.formacoes[nome].values()) for nome in nomes)
+        rows = len(nomes) * len(orcamentos)
+        table = Table((
+            ('formacao', np.repeat(np.array(nomes, dtype=np.unicode_),
+                                   len(orcamentos))),
+            ('cartoletas', np.tile(orcamentos, len(nomes))),
+            ('pontos', np.full(rows, np.nan)),
+            ('preco', np.full(rows, np.nan)),
+            ('atleta_ids', np.full((rows, size), -1,
+                                   dtype=self.atleta_ids.dtype)),
+        ))
+        for row, (nome, budget) in enumerate(zip(
+                table['formacao'], to_cents(table['cartoletas']))):
+            escalacao = self.solve_formacao(nome, min(budget, self.budget))
+            if escalacao is not None:
+                table['pontos'][row] = escalacao.pontos
+                table['preco'][row] = escalacao.preco
+                table['atleta_ids'][row, :len(escalacao.atleta_ids)] = \
+                    escalacao.atleta_ids
+        return table
+
+
+def _solve_grid(task):
+    """Solves the grid of a single formation, in a worker process"""
+    atleta_ids, posicao_ids, precos, pontos, orcamentos, formacoes = task
+    return EscalacaoOptimizer(atleta_ids, posicao_ids, precos, pontos,
+                              max(orcamentos), formacoes
+                              ).solve_grid(orcamentos)
+
+
+def escalar(atleta_ids, posicao_ids, precos, pontos, cartoletas,
+            formacoes=FORMACOES):
+    """Best Escalacao of the mercado within 'cartoletas', see
+    EscalacaoOptimizer"""
+    return EscalacaoOptimizer(atleta_ids, posicao_ids, precos, pontos,
+                              cartoletas, formacoes).solve()
+
+
+def escalar_grid(atleta_ids, posicao_ids, precos, pontos, orcamentos,
+                 formacoes=FORMACOES, jobs=1):
+    """Best squads of the mercado for every formation in 'formacoes' and
+    every budget in 'orcamentos', see EscalacaoOptimizer.solve_grid.
+
+    The positions are solved once for the largest budget and shared by
+    the whole grid. With 'jobs' > 1 the formations are spread over that
+    many worker processes instead, each solving the positions it needs"""
+    if jobs > 1 and len(formacoes) > 1:
+        tasks = [(atleta_ids, posicao_ids, precos, pontos, orcamentos,
+                  {nome: formacao})
+                 for nome, formacao in formacoes.items()]
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            return Table.concat(executor.map(_solve_grid, tasks))
+    return EscalacaoOptimizer(atleta_ids, posicao_ids, precos, pontos,
+                              max(orcamentos), formacoes
+                              ).solve_grid(orcamentos)
@@ -0,0 +1,66 @@
+import csv
+import io
+import json
+
+from core.deltas import SCOUT_COLUMNS
+from core.models import SCOUTS, Scout
+
+# the columns of the scouts csv of the 2017 season, so an export can be
+# imported again with import_csv
+COLUMNS = ('atleta_id', 'rodada_id', 'clube_id', 'posicao_id', 'status_id',
+           'pontos_num', 'preco_num', 'variacao_num', 'media_num',
+           'jogos_num') + SCOUTS
+FIELDS = ('atleta_id', 'rodada', 'clube_id', 'posicao_id', 'status_id',
+          'pontos_num', 'preco_num', 'variacao_num', 'media_num',
+          'jogos_num') + SCOUT_COLUMNS
+FORMATOS = ('csv', 'jsonl')
+CHUNK_SIZE = 2000
+
+
+def scout_rows(temporada, chunk_size=CHUNK_SIZE):
+    """Values of the Scout rows of 'temporada' in FIELDS order, by id.
+
+    Rows are read 'chunk_size' at a time, each chunk a query starting
+    after the last id of the previous one, so at most a chunk is held in
+    memory even on backends whose iterator() fetches every row at once"""
+    queryset = Scout.objects.filter(temporada=temporada).order_by('id')
+    last_id = 0
+    while True:
+        rows = list(queryset.filter(id__gt=last_id).values_list(
+            'id', *FIELDS)[:chunk_size].iterator())
+        for row in rows:
+            yield row[1:]
+        if len(rows) < chunk_size:
+            return
+        last_id = rows[-1][0]
+
+
+def export_season(temporada, formato='csv', chunk_size=CHUNK_SIZE):
+    """Text of the scouts of 'temporada' as csv, with a header of COLUMNS,
+    or as JSON Lines, one object per row.
+
+    A generator of one chunk of text per 'chunk_size' rows. The csv header
+    is yielded before any query, so a response streaming it starts at
+    once"""
+    if formato not in FORMATOS:
+        raise ValueError('Unknown format {}'.format(formato))
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    if formato == 'csv':
+        writer.writerow(COLUMNS)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    for i, row in enumerate(scout_rows(temporada, chunk_size), 1):
+        if formato == 'csv':
+            writer.writerow(row)
+        else:
+            buffer.write(json.dumps(dict(zip(COLUMNS, row)),
+                                    separators=(',', ':')))
+            buffer.write('\n')
+        if not i % chunk_size:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
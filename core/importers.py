@@ -0,0 +1,219 @@
+import os
+import re
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from core.models import (
+    Clube, Partida, Atleta, Posicao, Status, Pontuacao, Scout)
+from core.persistence import bulk_upsert
+from core.ratings import atualizar_ratings
+from core.services import CartolaCsvReader
+from core.signals import synced
+from core.snapshots import materializar
+
+SEASON_DIR_RE = re.compile(r'^(\d{4})$')
+SEASON_FILE_RE = re.compile(r'^(\d{4})_(\w+)\.csv$')
+TABLES = ('clubes', 'partidas', 'atletas', 'scouts')
+
+
+def chunked(iterable, chunk_size):
+    """Yields lists of at most 'chunk_size' items of 'iterable'"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def find_common_files(data_dir):
+    """Maps 'posicoes', 'status' and 'pontuacao' to their csv under
+    'data_dir', either in a common/ subdirectory (data/) or next to the
+    seasons (data/kaggle/)"""
+    files = {}
+    for directory in (os.path.join(data_dir, 'common'), data_dir):
+        for table in ('posicoes', 'status', 'pontuacao'):
+            path = os.path.join(directory, '{}.csv'.format(table))
+            if table not in files and os.path.isfile(path):
+                files[table] = path
+    return files
+
+
+def find_season_files(data_dir):
+    """Maps each season under 'data_dir' to a dict of its csv paths by
+    table, for both the data/<ano>/Scouts.csv and the
+    data/kaggle/<ano>_scouts.csv layouts"""
+    seasons = {}
+    for name in os.listdir(data_dir):
+        path = os.path.join(data_dir, name)
+        match = SEASON_DIR_RE.match(name)
+        if match and os.path.isdir(path):
+            files = seasons.setdefault(int(match.group(1)), {})
+            for file_name in os.listdir(path):
+                table, ext = os.path.splitext(file_name.lower())
+                if table in TABLES and ext == '.csv':
+                    files[table] = os.path.join(path, file_name)
+            continue
+        match = SEASON_FILE_RE.match(name.lower())
+        if match and match.group(2) in TABLES:
+            files = seasons.setdefault(int(match.group(1)), {})
+            files[match.group(2)] = path
+    return OrderedDict(sorted(seasons.items()))
+
+
+def read_season(ano, files):
+    """Maps each table of a season to a lazy iterable of its unsaved
+    model instances, read from the csv paths in 'files'"""
+    reader = CartolaCsvReader()
+    season = {}
+    atleta_posicoes = {}
+    if 'clubes' in files:
+        season['clubes'] = reader.clubes(files['clubes'])
+    if 'atletas' in files:
+        season['atletas'] = reader.atletas(files['atletas'])
+        atleta_posicoes = reader.atleta_posicoes(files['atletas'])
+    if 'partidas' in files:
+        season['partidas'] = reader.partidas(files['partidas'], ano)
+    if 'scouts' in files:
+        season['scouts'] = reader.scouts(files['scouts'], ano,
+                                         atleta_posicoes)
+    return season
+
+
+def parse_season(season_files):
+    """Reads a whole season into lists, to be run in a worker process.
+
+    'season_files' is an (ano, files) tuple. Nothing is read from the
+    database, so the result can be pickled back to a single writer."""
+    ano, files = season_files
+    return {table: list(objs)
+            for table, objs in read_season(ano, files).items()}
+
+
+class CartolaCsvImporter():
+    """Streams the historical csv files under a data directory into the
+    database.
+
+    Files are read 'chunk_size' rows at a time and every chunk is upserted
+    in its own transaction, so peak memory is bounded by the chunk size and
+    importing the same files again does not duplicate rows."""
+
+    def __init__(self, data_dir, chunk_size=5000):
+        self.data_dir = data_dir
+        self.chunk_size = chunk_size
+        self.reader = CartolaCsvReader()
+        self.result = OrderedDict()
+
+    def _upsert(self, model, objs, key_fields=('id',), queryset=None,
+                update_fields=None):
+        created, updated = bulk_upsert(
+            model, objs, key_fields, queryset=queryset,
+            update_fields=update_fields, batch_size=self.chunk_size)
+        total_created, total_updated = self.result.get(model.__name__, (0, 0))
+        self.result[model.__name__] = (total_created + created,
+                                       total_updated + updated)
+
+    def _skipped(self, model, count):
+        key = '{} skipped'.format(model.__name__)
+        self.result[key] = self.result.get(key, 0) + count
+
+    def import_common(self):
+        files = find_common_files(self.data_dir)
+        if 'posicoes' in files:
+            self._upsert(Posicao,
+                         list(self.reader.posicoes(files['posicoes'])))
+        if 'status' in files:
+            self._upsert(Status, list(self.reader.status(files['status'])))
+        if 'pontuacao' in files:
+            self._upsert(Pontuacao,
+                         list(self.reader.pontuacoes(files['pontuacao'])),
+                         ('abreviacao',))
+
+    def import_scouts(self, ano, scout_iter):
+        """Upserts the Scout instances of 'scout_iter', resolving their
+        partida from the season's Partida rows"""
+        partidas = {}
+        for partida in Partida.objects.filter(temporada=ano):
+            partidas[(partida.rodada, partida.clube_casa_id)] = partida.id
+            partidas[(partida.rodada, partida.clube_visitante_id)] = partida.id
+
+        for chunk in chunked(scout_iter, self.chunk_size):
+            scout_list = []
+            for scout in chunk:
+                scout.partida_id = partidas.get((scout.rodada, scout.clube_id))
+                if scout.partida_id is not None:
+                    scout_list.append(scout)
+            self._skipped(Scout, len(chunk) - len(scout_list))
+            rodadas = {scout.rodada for scout in scout_list}
+            self._upsert(Scout, scout_list,
+                         ('temporada', 'rodada', 'atleta_id'),
+                         Scout.objects.filter(temporada=ano,
+                                              rodada__in=rodadas))
+
+    def write_season(self, ano, season):
+        """Upserts a season as returned by read_season or parse_season"""
+        if 'clubes' in season:
+            # escudos are only known from the API, keep them
+            self._upsert(Clube, list(season['clubes']),
+                         update_fields=['nome', 'abreviacao'])
+        for chunk in chunked(season.get('atletas', ()), self.chunk_size):
+            # without a nome only the apelido is updated, and it stands in
+            # for the nome of new athletes
+            com_nome = [atleta for atleta in chunk if atleta.nome]
+            sem_nome = [atleta for atleta in chunk if not atleta.nome]
+            for atleta in sem_nome:
+                atleta.nome = atleta.apelido
+            for atletas, fields in ((com_nome, ['nome', 'apelido']),
+                                    (sem_nome, ['apelido'])):
+                if atletas:
+                    self._upsert(Atleta, atletas, update_fields=fields)
+        for chunk in chunked(season.get('partidas', ()), self.chunk_size):
+            self._upsert(Partida, chunk,
+                         ('temporada', 'rodada', 'clube_casa_id'),
+                         Partida.objects.filter(temporada=ano))
+        if 'scouts' in season:
+            self.import_scouts(ano, season['scouts'])
+
+    def import_season(self, ano, files):
+        self.write_season(ano, read_season(ano, files))
+
+    def run(self, anos=None, jobs=1):
+        """Imports the common tables and then every season in 'anos' (all
+        seasons by default), oldest first.
+
+        With 'jobs' > 1 the seasons are read and parsed by that many
+        worker processes, and this process only writes the parsed rows.
+        Each season is then held in memory at once, instead of
+        'chunk_size' rows at a time. The ClubeRating and Ranking rows and
+        the snapshots are then built again from the oldest imported season
+        on, and core.signals.synced is sent.
+
+        Returns an OrderedDict mapping each model name to a (created,
+        updated) tuple, plus the number of scouts skipped for lack of a
+        matching Partida"""
+        # core.rankings imports core.datasets, which imports this module
+        from core.rankings import atualizar_rankings
+
+        self.import_common()
+        seasons = [(ano, files)
+                   for ano, files in find_season_files(self.data_dir).items()
+                   if anos is None or ano in anos]
+        if jobs > 1 and len(seasons) > 1:
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                # map yields in submission order, so newer seasons are
+                # still written last
+                for (ano, files), season in zip(
+                        seasons, executor.map(parse_season, seasons)):
+                    self.write_season(ano, season)
+        else:
+            for ano, files in seasons:
+                self.import_season(ano, files)
+        if seasons:
+            self.result['ClubeRating'] = atualizar_ratings(
+                desde=(seasons[0][0], 0), batch_size=self.chunk_size)
+            self.result['Ranking'] = atualizar_rankings(
+                desde=(seasons[0][0], 0), batch_size=self.chunk_size)
+            materializar(desde=(seasons[0][0], 0))
+        synced.send(sender=self.__class__, result=self.result)
+        return self.result
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from core.exports import CHUNK_SIZE, FORMATOS, export_season
+
+
+class Command(BaseCommand):
+    help = 'Exports the scouts of a season as csv or JSON Lines'
+
+    def add_arguments(self, parser):
+        parser.add_argument('temporada', type=int, help='Season to export')
+        parser.add_argument(
+            '--format', choices=FORMATOS, default='csv', dest='formato',
+            help='Output format')
+        parser.add_argument(
+            '--output',
+            help='File to write to. Defaults to the standard output')
+        parser.add_argument(
+            '--chunk-size', type=int, default=CHUNK_SIZE,
+            help='Number of rows read and written at a time')
+
+    def handle(self, *args, **options):
+        chunks = export_season(options['temporada'], options['formato'],
+                               options['chunk_size'])
+        if options['output'] is None:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
+            return
+        with open(options['output'], 'w', encoding='utf-8') as f:
+            for chunk in chunks:
+                f.write(chunk)
@@ -0,0 +1,35 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.importers import CartolaCsvImporter
+
+
+class Command(BaseCommand):
+    help = 'Imports the historical Cartola csv files into the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--data-dir', default=os.path.join(settings.BASE_DIR, 'data'),
+            help='Directory with one subdirectory or file prefix per season')
+        parser.add_argument(
+            '--season', type=int, action='append', dest='anos',
+            help='Season to import (repeatable). Defaults to every season')
+        parser.add_argument(
+            '--chunk-size', type=int, default=5000,
+            help='Number of rows read and written per transaction')
+        parser.add_argument(
+            '--jobs', type=int, default=1,
+            help='Number of processes reading seasons in parallel')
+
+    def handle(self, *args, **options):
+        importer = CartolaCsvImporter(options['data_dir'],
+                                      chunk_size=options['chunk_size'])
+        result = importer.run(anos=options['anos'], jobs=options['jobs'])
+        for model_name, counts in result.items():
+            if isinstance(counts, tuple):
+                self.stdout.write('{}: {} created, {} updated'.format(
+                    model_name, *counts))
+            else:
+                self.stdout.write('{}: {}'.format(model_name, counts))
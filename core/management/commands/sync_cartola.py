@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+
+from core.services import AsyncCartolafcAPIClient
+from core.sync import sync_cartola
+
+
+class Command(BaseCommand):
+    help = ('Fetches the CartolaFC API and upserts what changed since the '
+            'last sync into the database')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rodada', type=int, action='append', dest='rodadas',
+            help=('Rodada to sync (repeatable). Defaults to every rodada '
+                  'since the last sync'))
+        parser.add_argument(
+            '--temporada', type=int,
+            help='Season the mercado belongs to. Defaults to the current year')
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Number of rows written per batch')
+        parser.add_argument(
+            '--concurrency', type=int, default=10,
+            help='Maximum number of concurrent API requests')
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Write every response, even if it did not change')
+
+    def handle(self, *args, **options):
+        client = AsyncCartolafcAPIClient(concurrency=options['concurrency'])
+        result = sync_cartola(client, rodadas=options['rodadas'],
+                              batch_size=options['batch_size'],
+                              force=options['force'],
+                              temporada=options['temporada'])
+        if not result:
+            self.stdout.write('Mercado unchanged, nothing to sync')
+        for model_name, counts in result.items():
+            if isinstance(counts, tuple):
+                self.stdout.write('{}: {} created, {} updated'.format(
+                    model_name, *counts))
+            else:
+                self.stdout.write('{}: {}'.format(model_name, counts))
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.3 on 2026-10-18 07:14
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+from django.db.models.functions import ExtractYear
+
+
+def set_temporada(apps, schema_editor):
+    """Fills in the season from the year of each Partida"""
+    Partida = apps.get_model('core', 'Partida')
+    Scout = apps.get_model('core', 'Scout')
+    Partida.objects.update(temporada=ExtractYear('partida_data'))
+    Scout.objects.update(temporada=Subquery(
+        Partida.objects.filter(pk=OuterRef('partida_id'))
+        .values('temporada')[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_syncstate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='partida',
+            name='temporada',
+            field=models.IntegerField(default=0),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='scout',
+            name='temporada',
+            field=models.IntegerField(default=0),
+            preserve_default=False,
+        ),
+        migrations.RunPython(set_temporada, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='partida',
+            unique_together=set([('temporada', 'rodada', 'clube_visitante'), ('temporada', 'rodada', 'clube_casa')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='scout',
+            unique_together=set([('temporada', 'rodada', 'atleta')]),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.3 on 2026-10-18 07:15
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_temporada'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='pontuacao',
+            name='pontuacao',
+            field=models.FloatField(default=0),
+        ),
+    ]
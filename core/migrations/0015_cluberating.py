@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.3 on 2026-10-18 07:26
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_pontuacao_float'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClubeRating',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('temporada', models.IntegerField()),
+                ('rodada', models.IntegerField()),
+                ('elo', models.FloatField()),
+                ('ataque', models.FloatField()),
+                ('defesa', models.FloatField()),
+                ('jogos', models.IntegerField(default=0)),
+                ('clube', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.Clube')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='cluberating',
+            unique_together=set([('temporada', 'rodada', 'clube')]),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.3 on 2026-10-18 07:39
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_cluberating'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Ranking',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('temporada', models.IntegerField()),
+                ('rodada', models.IntegerField()),
+                ('criterio', models.CharField(choices=[('pontos', 'Pontos na rodada'), ('media', 'Média na temporada'), ('pontos_por_cartoleta', 'Média por cartoleta')], max_length=20)),
+                ('colocacao', models.IntegerField()),
+                ('valor', models.FloatField()),
+                ('atleta', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.Atleta')),
+                ('posicao', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.Posicao')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='ranking',
+            unique_together=set([('temporada', 'rodada', 'posicao', 'criterio', 'colocacao')]),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.3 on 2026-10-18 07:53
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_ranking'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RankingTotal',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('temporada', models.IntegerField()),
+                ('rodada', models.IntegerField()),
+                ('rodadas', models.IntegerField()),
+                ('soma', models.FloatField()),
+                ('jogos', models.IntegerField()),
+                ('jogos_num', models.IntegerField()),
+                ('atleta', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.Atleta')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='rankingtotal',
+            unique_together=set([('temporada', 'atleta')]),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.3 on 2026-10-18 08:11
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_rankingtotal'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='partida',
+            name='placar_oficial_mandante',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='partida',
+            name='placar_oficial_visitante',
+            field=models.IntegerField(null=True),
+        ),
+    ]
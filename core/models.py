@@ -24,14 +24,20 @@ class Partida(models.Model):
     clube_visitante_posicao = models.IntegerField()
     aproveitamento_mandante = models.CharField(max_length=5)
     aproveitamento_visitante = models.CharField(max_length=5)
-    placar_oficial_mandante = models.IntegerField()
-    placar_oficial_visitante = models.IntegerField()
+    # null until the partida is played
+    placar_oficial_mandante = models.IntegerField(null=True)
+    placar_oficial_visitante = models.IntegerField(null=True)
     partida_data = models.DateTimeField()
     local = models.CharField(max_length=200)
     valida = models.BooleanField()
     url_confronto = models.URLField()
+    temporada = models.IntegerField()
     rodada = models.IntegerField()
 
+    class Meta:
+        unique_together = (('temporada', 'rodada', 'clube_casa'),
+                           ('temporada', 'rodada', 'clube_visitante'))
+
     def __str__(self):
         return '{} x {}, {}'.format(self.clube_casa,
                                     self.clube_visitante,
@@ -72,14 +78,20 @@ class Pontuacao(models.Model):
     """Points earned for each scout"""
     abreviacao = models.CharField(max_length=3)
     nome = models.CharField(max_length=200)
-    pontuacao = models.IntegerField(default=0)
+    pontuacao = models.FloatField(default=0)
 
     def __str__(self):
         return '{}: {}'.format(self.abreviacao, self.pontuacao)
 
 
+# abbreviations of the scouts, in the order of the Scout.scouts_* fields
+SCOUTS = ('FS', 'PE', 'A', 'FT', 'FD', 'FF', 'G', 'I', 'PP', 'RB', 'FC', 'GC',
+          'CA', 'CV', 'SG', 'DD', 'DP', 'GS')
+
+
 class Scout(models.Model):
     """Set of scouts of an Athete in one match"""
+    temporada = models.IntegerField()
     rodada = models.IntegerField()
     atleta = models.ForeignKey(Atleta, on_delete=models.CASCADE)
     clube = models.ForeignKey(Clube, on_delete=models.CASCADE)
@@ -110,8 +122,88 @@ class Scout(models.Model):
     scouts_DP = models.IntegerField(default=0)
     scouts_GS = models.IntegerField(default=0)
 
+    class Meta:
+        unique_together = (('temporada', 'rodada', 'atleta'),)
+
     def __str__(self):
-        return '{}-{}: {} ({})'.format(self.partida.partida_data.year,
+        return '{}-{}: {} ({})'.format(self.temporada,
                                        self.rodada,
                                        self.atleta.apelido,
                                        self.clube.abreviacao)
+
+
+class SyncState(models.Model):
+    """Watermark of the last ingested response of an API endpoint"""
+    endpoint = models.CharField(max_length=200, unique=True)
+    rodada = models.IntegerField(default=0)
+    content_hash = models.CharField(max_length=40)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return '{} ({})'.format(self.endpoint, self.rodada)
+
+
+class ClubeRating(models.Model):
+    """Strength of a Clube after a rodada, rodada 0 being the start of the
+    temporada"""
+    temporada = models.IntegerField()
+    rodada = models.IntegerField()
+    clube = models.ForeignKey(Clube, on_delete=models.CASCADE)
+    elo = models.FloatField()
+    ataque = models.FloatField()
+    defesa = models.FloatField()
+    jogos = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = (('temporada', 'rodada', 'clube'),)
+
+    def __str__(self):
+        return '{}-{}: {} ({:.0f})'.format(self.temporada, self.rodada,
+                                           self.clube.abreviacao, self.elo)
+
+
+class Ranking(models.Model):
+    """Place of an Atleta in the top of its Posicao after a rodada, by
+    one of the CRITERIOS"""
+    CRITERIOS = (
+        ('pontos', 'Pontos na rodada'),
+        ('media', 'Média na temporada'),
+        ('pontos_por_cartoleta', 'Média por cartoleta'),
+    )
+    temporada = models.IntegerField()
+    rodada = models.IntegerField()
+    posicao = models.ForeignKey(Posicao, on_delete=models.CASCADE)
+    criterio = models.CharField(max_length=20, choices=CRITERIOS)
+    colocacao = models.IntegerField()
+    atleta = models.ForeignKey(Atleta, on_delete=models.CASCADE)
+    valor = models.FloatField()
+
+    class Meta:
+        unique_together = (('temporada', 'rodada', 'posicao', 'criterio',
+                            'colocacao'),)
+
+    def __str__(self):
+        return '{}-{} {} {}: {} ({:.2f})'.format(
+            self.temporada, self.rodada, self.criterio, self.colocacao,
+            self.atleta, self.valor)
+
+
+class RankingTotal(models.Model):
+    """Points and games of an Atleta in a temporada up to a rodada, from
+    which the Ranking rows of the next rodadas are computed"""
+    temporada = models.IntegerField()
+    rodada = models.IntegerField()
+    # rodadas of the temporada up to 'rodada'
+    rodadas = models.IntegerField()
+    atleta = models.ForeignKey(Atleta, on_delete=models.CASCADE)
+    soma = models.FloatField()
+    jogos = models.IntegerField()
+    # last cumulative jogos_num, to tell whether the next rodada was played
+    jogos_num = models.IntegerField()
+
+    class Meta:
+        unique_together = (('temporada', 'atleta'),)
+
+    def __str__(self):
+        return '{}-{}: {} ({:.2f} in {})'.format(
+            self.temporada, self.rodada, self.atleta, self.soma, self.jogos)
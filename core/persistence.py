@@ -0,0 +1,116 @@
+from collections import OrderedDict
+
+from django.db import connections, router, transaction
+
+
+def _key(obj, key_fields):
+    return tuple(getattr(obj, field) for field in key_fields)
+
+
+def _executemany(model, sql, params, batch_size):
+    """Runs 'sql' once per row of 'params', 'batch_size' rows per
+    executemany call, inside a transaction"""
+    db = router.db_for_write(model)
+    connection = connections[db]
+    with transaction.atomic(using=db, savepoint=False), \
+            connection.cursor() as cursor:
+        for start in range(0, len(params), batch_size):
+            cursor.executemany(sql, params[start:start + batch_size])
+
+
+def _db_values(obj, fields, connection, add=False):
+    return [field.get_db_prep_save(field.pre_save(obj, add), connection)
+            for field in fields]
+
+
+def bulk_insert(model, objs, batch_size=500):
+    """Inserts the unsaved instances in 'objs' with one executemany per
+    batch. Unlike QuerySet.bulk_create, a batch is not compiled into one
+    multi-row statement, which on SQLite is limited to a few dozen rows
+    of a wide model such as Scout. Primary keys are not set on 'objs'"""
+    if not objs:
+        return
+    connection = connections[router.db_for_write(model)]
+    quote_name = connection.ops.quote_name
+    opts = model._meta
+    for with_pk in (True, False):
+        group = [obj for obj in objs if (obj.pk is not None) == with_pk]
+        if not group:
+            continue
+        fields = [field for field in opts.concrete_fields
+                  if with_pk or not field.primary_key]
+        sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+            quote_name(opts.db_table),
+            ', '.join(quote_name(field.column) for field in fields),
+            ', '.join(['%s'] * len(fields)))
+        params = [_db_values(obj, fields, connection, add=True)
+                  for obj in group]
+        _executemany(model, sql, params, batch_size)
+
+
+def bulk_update(model, objs, fields, batch_size=500):
+    """Updates 'fields' of the already saved instances in 'objs' with one
+    executemany per batch, instead of one save() per instance"""
+    if not objs:
+        return
+    connection = connections[router.db_for_write(model)]
+    quote_name = connection.ops.quote_name
+    opts = model._meta
+    fields = [opts.get_field(name) for name in fields]
+    sql = 'UPDATE {} SET {} WHERE {} = %s'.format(
+        quote_name(opts.db_table),
+        ', '.join('{} = %s'.format(quote_name(field.column))
+                  for field in fields),
+        quote_name(opts.pk.column))
+    params = [_db_values(obj, fields, connection) + [obj.pk] for obj in objs]
+    _executemany(model, sql, params, batch_size)
+
+
+def bulk_upsert(model, objs, key_fields, queryset=None, update_fields=None,
+                batch_size=500):
+    """Inserts or updates the unsaved instances in 'objs', matching them
+    to existing rows by the attributes named in 'key_fields'.
+
+    New rows are inserted with bulk_insert and changed rows rewritten with
+    bulk_update. Existing rows are read with a single query over
+    'queryset' (all rows of 'model' by default), so it should be narrowed
+    down to the rows 'objs' can match. Only 'update_fields' (every field
+    but the keys by default) of existing rows are updated, and rows whose
+    values did not change are left untouched. Instances sharing a key are
+    written once, using the last of them.
+
+    Returns a (created, updated) tuple of counts."""
+    key_fields = tuple(key_fields)
+    if queryset is None:
+        queryset = model._default_manager.all()
+    opts = model._meta
+    if update_fields is None:
+        update_fields = [field.attname for field in opts.concrete_fields
+                         if not field.primary_key and
+                         field.attname not in key_fields]
+
+    existing = {}
+    rows = queryset.values_list(opts.pk.attname, *(key_fields +
+                                                   tuple(update_fields)))
+    for row in rows:
+        key = row[1:len(key_fields) + 1]
+        existing[key] = (row[0], row[len(key_fields) + 1:])
+
+    # when several instances share a key, the last one wins
+    unique_objs = OrderedDict((_key(obj, key_fields), obj) for obj in objs)
+    to_create = []
+    to_update = []
+    for key, obj in unique_objs.items():
+        match = existing.get(key)
+        if match is None:
+            to_create.append(obj)
+            continue
+        pk, values = match
+        if values != _key(obj, update_fields):
+            obj.pk = pk
+            to_update.append(obj)
+
+    with transaction.atomic(using=router.db_for_write(model)):
+        bulk_insert(model, to_create, batch_size=batch_size)
+        bulk_update(model, to_update, update_fields, batch_size=batch_size)
+    return len(to_create), len(to_update)
@@ -0,0 +1,255 @@
+import numpy as np
+
+from core.datasets import Table
+from core.deltas import scout_deltas
+
+PROVAVEL, DUVIDA = 7, 2
+# chance of playing of an athlete by Status id, any other status is out
+DISPONIBILIDADE = {PROVAVEL: 1.0, DUVIDA: 0.5}
+CASA, FORA = 0, 1
+# weight of the last games against the average at the coming mando
+PESO_ULTIMOS = 0.3
+# games of an average opponent added to every club, so a club's strength
+# only departs from the average as it concedes games in the temporada
+JOGOS_PRIOR = 100
+
+
+def _grow(ids, new_ids, arrays, fill=0):
+    """Adds 'new_ids' to the sorted 'ids', moving the rows of every array
+    in the dict 'arrays' to the new positions of their ids"""
+    all_ids = np.union1d(ids, new_ids)
+    if len(all_ids) == len(ids):
+        return ids
+    index = np.searchsorted(all_ids, ids)
+    for name, array in arrays.items():
+        grown = np.full((len(all_ids),) + array.shape[1:], fill,
+                        dtype=array.dtype)
+        grown[index] = array
+        arrays[name] = grown
+    return all_ids
+
+
+def confrontos(partidas):
+    """Opponent and home/away of every club in a Table of partidas, as
+    (clube_ids, adversario_ids, mandos) arrays sorted by club"""
+    clube_ids = np.concatenate((partidas['clube_casa_id'],
+                                partidas['clube_visitante_id']))
+    adversario_ids = np.concatenate((partidas['clube_visitante_id'],
+                                     partidas['clube_casa_id']))
+    mandos = np.repeat([CASA, FORA], len(partidas['clube_casa_id']))
+    order = np.argsort(clube_ids, kind='mergesort')
+    return clube_ids[order], adversario_ids[order], mandos[order]
+
+
+def _lookup(sorted_ids, ids):
+    """Positions of 'ids' in 'sorted_ids' and whether they were found"""
+    if not len(sorted_ids):
+        return (np.zeros(len(ids), dtype=np.intp),
+                np.zeros(len(ids), dtype=bool))
+    index = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+    return index, sorted_ids[index] == ids
+
+
+class ProjecaoState():
+    """Rolling features of every athlete and club, to project the points
+    of the next rodada.
+
+    Rodadas are added one at a time with update(), so the features of a
+    new rodada only cost the rows of that rodada. Per athlete it keeps the
+    points of the last 'n' games played and the points and games at home
+    and away; per club, the points conceded to the athletes facing it in
+    the current temporada, which measure the opponent strength."""
+
+    def __init__(self, n=5):
+        self.n = n
+        self.temporada = None
+        self.rodada = None
+        self.atleta_ids = np.zeros(0, dtype='i4')
+        self.atletas = {
+            'ultimos': np.zeros((0, n)),
+            'num_ultimos': np.zeros(0, dtype='i4'),
+            'proximo': np.zeros(0, dtype='i4'),
+            'soma_mando': np.zeros((0, 2)),
+            'jogos_mando': np.zeros((0, 2), dtype='i4'),
+        }
+        self.clube_ids = np.zeros(0, dtype='i4')
+        self.clubes = {
+            'soma_cedida': np.zeros(0),
+            'jogos_cedidos': np.zeros(0, dtype='i4'),
+        }
+
+    def update(self, temporada, rodada, scouts, partidas):
+        """Adds the scouts of one rodada.
+
+        'scouts' is a Table of the rodada's Scout rows and 'partidas' a
+        Table of its partidas. Only rows of athletes who played count: the
+        'jogou' column of scout_deltas if present, otherwise a non zero
+        pontos_num. Rodadas must be added in order."""
+        if self.temporada is not None and (
+                (temporada, rodada) <= (self.temporada, self.rodada)):
+            raise ValueError('Rodada {} of {} is not after rodada {} of '
+                             '{}'.format(rodada, temporada, self.rodada,
+                                         self.temporada))
+        if temporada != self.temporada:
+            self.clubes['soma_cedida'][:] = 0
+            self.clubes['jogos_cedidos'][:] = 0
+        self.temporada, self.rodada = temporada, rodada
+
+        pontos = np.asarray(scouts['pontos_num'], dtype='f8')
+        jogou = (np.asarray(scouts['jogou']) if 'jogou' in scouts
+                 else pontos != 0)
+        clube_ids, adversario_ids, mandos = confrontos(partidas)
+        index, found = _lookup(clube_ids, np.asarray(scouts['clube_id']))
+        jogou = jogou & found
+        atleta_ids, last = np.unique(
+            np.asarray(scouts['atleta_id'])[jogou][::-1], return_index=True)
+        # an athlete listed twice counts once, with its last row
+        rows = np.flatnonzero(jogou)[::-1][last]
+        pontos = pontos[rows]
+        mandos = mandos[index[rows]]
+        adversario_ids = adversario_ids[index[rows]]
+
+        self.atleta_ids = _grow(self.atleta_ids, atleta_ids, self.atletas)
+        atletas = self.atletas
+        slots = np.searchsorted(self.atleta_ids, atleta_ids)
+        atletas['ultimos'][slots, atletas['proximo'][slots]] = pontos
+        atletas['proximo'][slots] = (atletas['proximo'][slots] + 1) % self.n
+        atletas['num_ultimos'][slots] = np.minimum(
+            atletas['num_ultimos'][slots] + 1, self.n)
+        atletas['soma_mando'][slots, mandos] += pontos
+        atletas['jogos_mando'][slots, mandos] += 1
+
+        self.clube_ids = _grow(self.clube_ids, adversario_ids, self.clubes)
+        clubes = self.clubes
+        slots = np.searchsorted(self.clube_ids, adversario_ids)
+        np.add.at(clubes['soma_cedida'], slots, pontos)
+        np.add.at(clubes['jogos_cedidos'], slots, 1)
+
+    def save(self, path):
+        """Writes the state to the .npz file 'path', to be updated with
+        later rodadas after load()"""
+        arrays = dict(('atletas_' + name, array)
+                      for name, array in self.atletas.items())
+        arrays.update(('clubes_' + name, array)
+                      for name, array in self.clubes.items())
+        np.savez(path, n=self.n, temporada=self.temporada,
+                 rodada=self.rodada, atleta_ids=self.atleta_ids,
+                 clube_ids=self.clube_ids, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=True) as data:
+            state = cls(int(data['n']))
+            state.temporada = data['temporada'].item()
+            state.rodada = data['rodada'].item()
+            state.atleta_ids = data['atleta_ids']
+            state.clube_ids = data['clube_ids']
+            for name in state.atletas:
+                state.atletas[name] = data['atletas_' + name]
+            for name in state.clubes:
+                state.clubes[name] = data['clubes_' + name]
+        return state
+
+    def fit(self, scouts, partidas):
+        """Adds every rodada of the Tables 'scouts' and 'partidas', such as
+        load_table('scouts') and load_table('partidas'), in order"""
+        scouts = scout_deltas(scouts)
+        keys = scouts['temporada'] * 100 + scouts['rodada']
+        partida_keys = partidas['temporada'] * 100 + partidas['rodada']
+        order = np.argsort(keys, kind='mergesort')
+        partida_order = np.argsort(partida_keys, kind='mergesort')
+        sorted_keys = keys[order]
+        sorted_partida_keys = partida_keys[partida_order]
+        for key in np.unique(sorted_keys):
+            start, end = np.searchsorted(sorted_keys, [key, key + 1])
+            partida_start, partida_end = np.searchsorted(
+                sorted_partida_keys, [key, key + 1])
+            self.update(int(key // 100), int(key % 100),
+                        scouts.take(order[start:end]),
+                        partidas.take(partida_order[partida_start:
+                                                    partida_end]))
+        return self
+
+    def features(self, atleta_ids, clube_ids, partidas):
+        """Table of the features of the athletes 'atleta_ids', playing for
+        'clube_ids' the next rodada's 'partidas'.
+
+        Athletes without any game have NaN averages, and athletes whose
+        club has no opponent in 'partidas' have a mando of -1 and a NaN
+        fator_adversario"""
+        atleta_ids = np.asarray(atleta_ids)
+        size = len(atleta_ids)
+        slots, known = _lookup(self.atleta_ids, atleta_ids)
+        rows = np.flatnonzero(known)
+        slots = slots[rows]
+        atletas = self.atletas
+        num_ultimos = atletas['num_ultimos'][slots]
+        soma = atletas['soma_mando'][slots]
+        jogos = atletas['jogos_mando'][slots]
+
+        partida_clube_ids, adversario_ids, mandos = confrontos(partidas)
+        index, has_partida = _lookup(partida_clube_ids, np.asarray(clube_ids))
+        mando = np.where(has_partida, mandos[index] if len(mandos) else 0, -1)
+        adversario = np.where(has_partida, adversario_ids[index]
+                              if len(mandos) else 0, -1)
+        clube_slots, clube_known = _lookup(self.clube_ids, adversario)
+        clube_rows = np.flatnonzero(clube_known & has_partida)
+        clube_slots = clube_slots[clube_rows]
+        clubes = self.clubes
+
+        media_ultimos = np.full(size, np.nan)
+        media_geral = np.full(size, np.nan)
+        media_mando = np.full(size, np.nan)
+        fator_adversario = np.full(size, np.nan)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            media_ultimos[rows] = (atletas['ultimos'][slots].sum(axis=1) /
+                                   num_ultimos)
+            media_geral[rows] = soma.sum(axis=1) / jogos.sum(axis=1)
+            mando_rows = mando[rows] >= 0
+            media_mando[rows[mando_rows]] = (
+                soma[mando_rows, mando[rows][mando_rows]] /
+                jogos[mando_rows, mando[rows][mando_rows]])
+            media_cedida = (clubes['soma_cedida'].sum() /
+                            clubes['jogos_cedidos'].sum())
+            fator_adversario[clube_rows] = (
+                (clubes['soma_cedida'][clube_slots] +
+                 JOGOS_PRIOR * media_cedida) /
+                (clubes['jogos_cedidos'][clube_slots] + JOGOS_PRIOR) /
+                media_cedida)
+
+        return Table((
+            ('atleta_id', atleta_ids),
+            ('media_ultimos', media_ultimos),
+            ('media_geral', media_geral),
+            ('media_mando', media_mando),
+            ('mando', mando),
+            ('fator_adversario', fator_adversario),
+        ))
+
+    def project(self, atleta_ids, clube_ids, status_ids, partidas):
+        """Expected points of every athlete of the mercado in the next
+        rodada, from its features.
+
+        The average of the last games is blended with the average at the
+        coming mando (both falling back to the overall average), scaled by
+        how many points the opponent concedes compared with the average
+        club and weighted by the chance of playing given by the Status.
+        An athlete without any game or whose club does not play projects
+        0 points"""
+        features = self.features(atleta_ids, clube_ids, partidas)
+        media_geral = np.nan_to_num(features['media_geral'])
+        media_ultimos = np.where(np.isnan(features['media_ultimos']),
+                                 media_geral, features['media_ultimos'])
+        media_mando = np.where(np.isnan(features['media_mando']),
+                               media_geral, features['media_mando'])
+        fator_adversario = np.where(
+            np.isfinite(features['fator_adversario']),
+            features['fator_adversario'], 1.0)
+        status_ids = np.asarray(status_ids)
+        disponibilidade = np.zeros(len(status_ids))
+        for status_id, chance in DISPONIBILIDADE.items():
+            disponibilidade[status_ids == status_id] = chance
+        disponibilidade[features['mando'] < 0] = 0
+        return ((PESO_ULTIMOS * media_ultimos +
+                 (1 - PESO_ULTIMOS) * media_mando) *
+                fator_adversario * disponibilidade)
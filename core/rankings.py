@@ -0,0 +1,203 @@
+import heapq
+
+import numpy as np
+from django.db import transaction
+from django.db.models import Q
+
+from core.deltas import is_cumulative, scout_deltas
+from core.models import Ranking, RankingTotal, Scout
+from core.persistence import bulk_insert, bulk_upsert
+from core.similaridade import load_scouts
+
+TOP_K = 20
+# games an athlete needs in the temporada to enter the media rankings,
+# fewer in the first rodadas
+JOGOS_MINIMOS = 3
+KEY_FIELDS = ('temporada', 'rodada', 'posicao_id', 'criterio', 'colocacao')
+
+
+def _top(k, valores, atleta_ids, posicao_ids):
+    """The 'k' largest of 'valores' of every Posicao, as (posicao_id,
+    colocacao, atleta_id, valor) tuples. Ties go to the lowest atleta_id"""
+    grupos = {}
+    for valor, atleta_id, posicao_id in zip(
+            valores.tolist(), atleta_ids.tolist(), posicao_ids.tolist()):
+        grupos.setdefault(posicao_id, []).append((valor, -atleta_id))
+    for posicao_id, grupo in sorted(grupos.items()):
+        for colocacao, (valor, atleta_id) in enumerate(
+                heapq.nlargest(k, grupo), 1):
+            yield posicao_id, colocacao, -atleta_id, valor
+
+
+class RankingState():
+    """Points and games of every athlete in a temporada, added one rodada
+    at a time, and the top 'k' athletes of every Posicao after each.
+
+    A rodada only costs its own rows, and the top of each Posicao is kept
+    by a bounded heap, so neither depends on the rodadas or temporadas
+    before it. The totals are stored as RankingTotal rows, so the next
+    sync only reads the rodadas after them"""
+
+    def __init__(self, k=TOP_K):
+        self.k = k
+        self.atleta_ids = np.zeros(0, dtype='i4')
+        self.soma = np.zeros(0)
+        self.jogos = np.zeros(0, dtype='i4')
+        self.jogos_num = np.zeros(0, dtype='i4')
+        self.rodada = 0
+        self.rodadas = 0
+
+    def update(self, scouts):
+        """Adds the rows of one rodada of the Table 'scouts' and sets its
+        'jogou' column, in cumulative seasons by comparing jogos_num with
+        the athlete's last one, like scout_deltas"""
+        atleta_ids = np.asarray(scouts['atleta_id'])
+        novos = np.setdiff1d(atleta_ids, self.atleta_ids)
+        if len(novos):
+            todos = np.union1d(self.atleta_ids, novos)
+            index = np.searchsorted(todos, self.atleta_ids)
+            for name in ('soma', 'jogos', 'jogos_num'):
+                array = getattr(self, name)
+                grown = np.zeros(len(todos), dtype=array.dtype)
+                grown[index] = array
+                setattr(self, name, grown)
+            self.atleta_ids = todos
+        rows = np.searchsorted(self.atleta_ids, atleta_ids)
+        jogos_num = np.asarray(scouts['jogos_num'])
+        jogou = np.asarray(scout_deltas(scouts)['jogou'])
+        cumulative = is_cumulative(np.asarray(scouts['temporada']))
+        jogou[cumulative] = (jogos_num[cumulative] >
+                             self.jogos_num[rows[cumulative]])
+        scouts['jogou'] = jogou
+        self.jogos_num[rows] = jogos_num
+        np.add.at(self.soma, rows[jogou],
+                  np.asarray(scouts['pontos_num'])[jogou])
+        np.add.at(self.jogos, rows[jogou], 1)
+        self.rodada = int(np.max(scouts['rodada']))
+        self.rodadas += 1
+
+    def rankings(self, scouts):
+        """(criterio, posicao_id, colocacao, atleta_id, valor) tuples of
+        the athletes of the rodada just added, 'scouts'"""
+        atleta_ids = np.asarray(scouts['atleta_id'])
+        posicao_ids = np.asarray(scouts['posicao_id'])
+        jogou = np.asarray(scouts['jogou'])
+        for ranking in _top(self.k, np.asarray(scouts['pontos_num'])[jogou],
+                            atleta_ids[jogou], posicao_ids[jogou]):
+            yield ('pontos',) + ranking
+
+        rows = np.searchsorted(self.atleta_ids, atleta_ids)
+        jogos = self.jogos[rows]
+        elegiveis = jogos >= min(JOGOS_MINIMOS, self.rodadas)
+        medias = self.soma[rows][elegiveis] / jogos[elegiveis]
+        for ranking in _top(self.k, medias, atleta_ids[elegiveis],
+                            posicao_ids[elegiveis]):
+            yield ('media',) + ranking
+
+        precos = np.asarray(scouts['preco_num'])[elegiveis]
+        pagos = precos > 0
+        for ranking in _top(self.k, medias[pagos] / precos[pagos],
+                            atleta_ids[elegiveis][pagos],
+                            posicao_ids[elegiveis][pagos]):
+            yield ('pontos_por_cartoleta',) + ranking
+
+    def totais(self, temporada):
+        """Unsaved RankingTotal rows of the athletes"""
+        return [RankingTotal(temporada=temporada, rodada=self.rodada,
+                             rodadas=self.rodadas, atleta_id=atleta_id,
+                             soma=soma, jogos=jogos, jogos_num=jogos_num)
+                for atleta_id, soma, jogos, jogos_num in zip(
+                    self.atleta_ids.tolist(), self.soma.tolist(),
+                    self.jogos.tolist(), self.jogos_num.tolist())]
+
+    @classmethod
+    def load(cls, temporada, k=TOP_K):
+        """State stored by the RankingTotal rows of 'temporada'"""
+        state = cls(k)
+        rows = list(RankingTotal.objects.filter(
+            temporada=temporada).order_by('atleta_id').values_list(
+                'atleta_id', 'soma', 'jogos', 'jogos_num', 'rodada',
+                'rodadas'))
+        if rows:
+            columns = list(zip(*rows))
+            state.atleta_ids = np.array(columns[0], dtype='i4')
+            state.soma = np.array(columns[1])
+            state.jogos = np.array(columns[2], dtype='i4')
+            state.jogos_num = np.array(columns[3], dtype='i4')
+            state.rodada, state.rodadas = rows[0][4:]
+        return state
+
+
+def atualizar_rankings(desde=None, k=TOP_K, batch_size=500):
+    """Ranks every rodada of Scout from the last ranked one on, which a
+    sync may have changed.
+
+    'desde', a (temporada, rodada) tuple, ranks again every rodada from it
+    on, for instance after importing an older season. Each temporada goes
+    on from its stored RankingTotal rows, kept up to the rodada before
+    the last one ranked, and reads only the Scout rows after them. The
+    rows are added up again from the first rodada when they are past
+    'desde'. Ranking rows of the rodadas ranked that are not ranked again
+    are deleted.
+
+    Returns a (created, updated) tuple of Ranking rows"""
+    created = updated = 0
+    with transaction.atomic():
+        if desde is None:
+            last = Ranking.objects.order_by('-temporada', '-rodada').first()
+            desde = (last.temporada, last.rodada) if last else (0, 0)
+        temporadas = Scout.objects.filter(
+            temporada__gte=desde[0]).values_list(
+                'temporada', flat=True).distinct().order_by('temporada')
+
+        rows = []
+        for temporada in temporadas:
+            primeira = desde[1] if temporada == desde[0] else 0
+            state = RankingState.load(temporada, k)
+            if state.rodada >= primeira:
+                state = RankingState(k)
+            season = load_scouts(temporada, state.rodada + 1)
+            rodadas = np.asarray(season['rodada'])
+            unique = np.unique(rodadas).tolist()
+            for rodada in unique:
+                if rodada == unique[-1]:
+                    # the next sync ranks the last rodada again
+                    RankingTotal.objects.filter(temporada=temporada).delete()
+                    bulk_insert(RankingTotal, state.totais(temporada),
+                                batch_size=batch_size)
+                scouts = season.take(rodadas == rodada)
+                state.update(scouts)
+                if rodada < primeira:
+                    continue
+                rows.extend(
+                    Ranking(temporada=temporada, rodada=rodada,
+                            posicao_id=posicao_id, criterio=criterio,
+                            colocacao=colocacao, atleta_id=atleta_id,
+                            valor=valor)
+                    for criterio, posicao_id, colocacao, atleta_id, valor
+                    in state.rankings(scouts))
+
+        queryset = Ranking.objects.filter(
+            Q(temporada__gt=desde[0]) |
+            Q(temporada=desde[0], rodada__gte=desde[1]))
+        # rankings of fewer athletes than before leave places behind
+        keys = {tuple(getattr(row, field) for field in KEY_FIELDS)
+                for row in rows}
+        stale = [row[0] for row in queryset.values_list(
+            'pk', *KEY_FIELDS).iterator() if row[1:] not in keys]
+        for start in range(0, len(stale), batch_size):
+            Ranking.objects.filter(
+                pk__in=stale[start:start + batch_size]).delete()
+        if rows:
+            created, updated = bulk_upsert(
+                Ranking, rows, KEY_FIELDS, queryset=queryset,
+                batch_size=batch_size)
+    return created, updated
+
+
+def ranking(temporada, rodada, posicao_id, criterio):
+    """Ranking rows of a Posicao after 'rodada', first place first, from
+    the unique index of the rodada"""
+    return Ranking.objects.filter(
+        temporada=temporada, rodada=rodada, posicao_id=posicao_id,
+        criterio=criterio).select_related('atleta').order_by('colocacao')
@@ -0,0 +1,195 @@
+import math
+from collections import OrderedDict
+from datetime import datetime
+from itertools import groupby
+
+from django.db import transaction
+from django.db.models import Q
+
+from core.models import ClubeRating, Partida
+from core.persistence import bulk_upsert
+
+ELO_INICIAL = 1500.0
+# Elo points of playing at home and of a win by a single goal
+ELO_MANDO = 60.0
+ELO_K = 20.0
+# average goals of the home and away sides, scaled by the attack of one
+# side and the defence of the other
+GOLS_CASA = 1.5
+GOLS_FORA = 1.0
+# step of the log attack and defence ratings per goal above expected
+TAXA_GOLS = 0.05
+# share of every rating lost towards the average between temporadas
+REGRESSAO = 1 / 3.0
+
+
+class Rating():
+    """Elo and log Poisson attack and defence ratings of a club"""
+
+    def __init__(self, elo=ELO_INICIAL, ataque=0.0, defesa=0.0, jogos=0):
+        self.elo = elo
+        self.ataque = ataque
+        self.defesa = defesa
+        self.jogos = jogos
+
+
+def _elo_k(gols):
+    """K factor of a match won by 'gols' goals"""
+    if gols <= 1:
+        return ELO_K
+    if gols == 2:
+        return ELO_K * 1.5
+    return ELO_K * (11 + gols) / 8.0
+
+
+class RatingEngine():
+    """Ratings of every club, updated one rodada at a time.
+
+    Elo moves by how far the result was from the expected one, and the
+    attack and defence ratings take a gradient step of the Poisson
+    likelihood of the goals scored and conceded. A club's expected goals
+    are GOLS_CASA or GOLS_FORA times exp(its ataque + the other's
+    defesa)."""
+
+    def __init__(self, ratings=None):
+        self.ratings = ratings or {}
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Engine holding the ratings of the ClubeRating rows 'rows'"""
+        return cls({row.clube_id: Rating(row.elo, math.log(row.ataque),
+                                         math.log(row.defesa), row.jogos)
+                    for row in rows})
+
+    def nova_temporada(self, clube_ids):
+        """Regresses every rating towards the average and adds the clubs
+        of 'clube_ids' that were not rated yet"""
+        for rating in self.ratings.values():
+            rating.elo = ELO_INICIAL + (rating.elo - ELO_INICIAL) * (
+                1 - REGRESSAO)
+            rating.ataque *= 1 - REGRESSAO
+            rating.defesa *= 1 - REGRESSAO
+            rating.jogos = 0
+        for clube_id in clube_ids:
+            self.ratings.setdefault(clube_id, Rating())
+
+    def expected_gols(self, casa_id, visitante_id):
+        casa = self.ratings[casa_id]
+        visitante = self.ratings[visitante_id]
+        return (GOLS_CASA * math.exp(casa.ataque + visitante.defesa),
+                GOLS_FORA * math.exp(visitante.ataque + casa.defesa))
+
+    def update(self, partidas):
+        """Adds the results of the Partida instances of one rodada. All
+        updates are computed from the ratings before the rodada"""
+        deltas = []
+        for partida in partidas:
+            casa_id = partida.clube_casa_id
+            visitante_id = partida.clube_visitante_id
+            for clube_id in (casa_id, visitante_id):
+                self.ratings.setdefault(clube_id, Rating())
+            gols_casa = partida.placar_oficial_mandante
+            gols_fora = partida.placar_oficial_visitante
+            casa = self.ratings[casa_id]
+            visitante = self.ratings[visitante_id]
+
+            esperado = 1 / (1 + 10 ** ((visitante.elo - casa.elo -
+                                        ELO_MANDO) / 400.0))
+            resultado = (1.0 if gols_casa > gols_fora else
+                         0.5 if gols_casa == gols_fora else 0.0)
+            elo = _elo_k(abs(gols_casa - gols_fora)) * (resultado - esperado)
+
+            esperados_casa, esperados_fora = self.expected_gols(
+                casa_id, visitante_id)
+            erro_casa = TAXA_GOLS * (gols_casa - esperados_casa)
+            erro_fora = TAXA_GOLS * (gols_fora - esperados_fora)
+            deltas.append((casa, elo, erro_casa, erro_fora))
+            deltas.append((visitante, -elo, erro_fora, erro_casa))
+        for rating, elo, marcados, sofridos in deltas:
+            rating.elo += elo
+            rating.ataque += marcados
+            rating.defesa += sofridos
+            rating.jogos += 1
+
+    def rows(self, temporada, rodada):
+        """Unsaved ClubeRating instances of every club"""
+        return [ClubeRating(temporada=temporada, rodada=rodada,
+                            clube_id=clube_id, elo=rating.elo,
+                            ataque=math.exp(rating.ataque),
+                            defesa=math.exp(rating.defesa),
+                            jogos=rating.jogos)
+                for clube_id, rating in sorted(self.ratings.items())]
+
+
+def atualizar_ratings(desde=None, batch_size=500):
+    """Rates every rodada of Partida after the last rated one.
+
+    'desde', a (temporada, rodada) tuple, rates again every rodada from it
+    on, for instance after importing an older season. Rodadas are rated in
+    order and the first one with a Partida still to be played, or without
+    its placar, stops the update, so it is rated once complete. Every club rated so far is
+    stored at every rodada, so any rodada holds the whole state.
+
+    Returns a (created, updated) tuple of ClubeRating rows"""
+    created = updated = 0
+    with transaction.atomic():
+        ratings = ClubeRating.objects.all()
+        if desde is not None:
+            temporada, rodada = desde
+            ratings.filter(Q(temporada__gt=temporada) |
+                           Q(temporada=temporada, rodada__gte=rodada)
+                           ).delete()
+        last = ratings.order_by('-temporada', '-rodada').first()
+        partidas = Partida.objects.filter(valida=True)
+        # the only rows the rodadas rated below can match
+        novos = ratings
+        if last is None:
+            engine = RatingEngine()
+            temporada = None
+        else:
+            engine = RatingEngine.from_rows(ratings.filter(
+                temporada=last.temporada, rodada=last.rodada))
+            temporada = last.temporada
+            partidas = partidas.filter(
+                Q(temporada__gt=last.temporada) |
+                Q(temporada=last.temporada, rodada__gt=last.rodada))
+            novos = ratings.filter(
+                Q(temporada__gt=last.temporada) |
+                Q(temporada=last.temporada, rodada__gt=last.rodada))
+        partidas = partidas.order_by('temporada', 'rodada')
+
+        agora = datetime.now()
+        rows = []
+        rodadas = OrderedDict(
+            (key, list(group)) for key, group in groupby(
+                partidas, lambda partida: (partida.temporada,
+                                           partida.rodada)))
+        for (partida_temporada, rodada), rodada_partidas in rodadas.items():
+            if any(partida.partida_data > agora or
+                   partida.placar_oficial_mandante is None or
+                   partida.placar_oficial_visitante is None
+                   for partida in rodada_partidas):
+                break
+            if partida_temporada != temporada:
+                temporada = partida_temporada
+                clube_ids = set()
+                for ids in Partida.objects.filter(
+                        temporada=temporada).values_list(
+                            'clube_casa_id', 'clube_visitante_id'):
+                    clube_ids.update(ids)
+                engine.nova_temporada(clube_ids)
+                rows.extend(engine.rows(temporada, 0))
+            engine.update(rodada_partidas)
+            rows.extend(engine.rows(temporada, rodada))
+        if rows:
+            created, updated = bulk_upsert(
+                ClubeRating, rows, ('temporada', 'rodada', 'clube_id'),
+                queryset=novos, batch_size=batch_size)
+    return created, updated
+
+
+def rating(clube_id, temporada, rodada):
+    """ClubeRating of a club before 'rodada', from the unique index of
+    the rodada before it"""
+    return ClubeRating.objects.get(clube_id=clube_id, temporada=temporada,
+                                   rodada=rodada - 1)
@@ -0,0 +1,59 @@
+import os
+
+import numpy as np
+
+from core.datasets import DATA_DIR, Table
+from core.deltas import SCOUT_COLUMNS, is_cumulative, scout_deltas
+from core.models import Pontuacao, SCOUTS
+from core.services import CartolaCsvReader
+
+PONTUACAO_CSV = os.path.join(DATA_DIR, 'common', 'pontuacao.csv')
+
+
+def load_pesos(csv_path=PONTUACAO_CSV):
+    """Points earned per scout, by abbreviation, read from the Pontuacao
+    table or, when it does not cover every scout, from 'csv_path'"""
+    pesos = dict(Pontuacao.objects.values_list('abreviacao', 'pontuacao'))
+    if not set(SCOUTS) <= set(pesos):
+        pesos = {pontuacao.abreviacao: pontuacao.pontuacao
+                 for pontuacao in CartolaCsvReader().pontuacoes(csv_path)}
+    return pesos
+
+
+class ScoringEngine():
+    """Computes the points of Scout rows from the Pontuacao weights.
+
+    The weights are loaded once, as a vector in the order of the scouts_*
+    columns, and a whole Table of any number of seasons is scored with a
+    single matrix product."""
+
+    def __init__(self, pesos=None):
+        pesos = pesos or load_pesos()
+        self.pesos = np.array([pesos[key] for key in SCOUTS], dtype='f8')
+
+    def scout_matrix(self, scouts):
+        """Per round scouts of every row as a (rows, scouts) matrix"""
+        if is_cumulative(np.asarray(scouts['temporada'])).any():
+            scouts = scout_deltas(scouts)
+        return np.column_stack([np.asarray(scouts[name], dtype='f8')
+                                for name in SCOUT_COLUMNS])
+
+    def score(self, scouts):
+        """Points of every row of the Table 'scouts', which needs a
+        'temporada' column to tell cumulative seasons apart"""
+        if not scouts.num_rows:
+            return np.zeros(0)
+        return self.scout_matrix(scouts).dot(self.pesos)
+
+    def check(self, scouts, tolerance=0.01):
+        """Scores 'scouts' and compares the result with pontos_num.
+
+        Returns a Table with the 'pontos_calculados' of every row, their
+        'diferenca' to pontos_num and a boolean 'divergente' column set
+        where they differ by more than 'tolerance'"""
+        pontos_calculados = self.score(scouts)
+        diferenca = pontos_calculados - np.asarray(scouts['pontos_num'])
+        return Table((
+            ('pontos_calculados', pontos_calculados),
+            ('diferenca', diferenca),
+            ('divergente', np.abs(diferenca) > tolerance)))
@@ -0,0 +1,229 @@
+import json
+import os
+
+import numpy as np
+from django.db.models import Count, Max, Q, Sum
+
+from core.datasets import CACHE_DIR, Table
+from core.models import Scout, SyncState
+
+SERIES_DIR = os.path.join(CACHE_DIR, 'series')
+# per rodada values kept for every athlete
+FIELDS = ('preco_num', 'pontos_num', 'variacao_num')
+
+
+def _key(temporada, rodada):
+    return np.asarray(temporada, dtype='i4') * 100 + np.asarray(rodada)
+
+
+class SerieStore():
+    """Per rodada preco_num, pontos_num and variacao_num of every athlete
+    over all seasons, as dense (athletes, rodadas) float32 arrays.
+
+    An athlete's row is found through a dict, so its whole series is a
+    single slice, and a window of rodadas of many athletes is a single
+    fancy index. Rodadas the athlete was not in the mercado are NaN.
+
+    The arrays are saved as .npy files under 'path' and memory-mapped
+    when loaded. open() brings them up to date with the Scout table once
+    a sync or an import has written to it, by reading again only the
+    rodadas a sync may have changed, or every rodada if older ones were
+    added or rewritten."""
+
+    def __init__(self, path=SERIES_DIR):
+        self.path = path
+        self.clear()
+
+    def clear(self):
+        # stored rodadas as temporada * 100 + rodada, in order
+        self.rodadas = np.zeros(0, dtype='i4')
+        self.atleta_ids = np.zeros(0, dtype='i4')
+        self.values = {field: np.zeros((0, 0), dtype='f4')
+                       for field in FIELDS}
+        # last SyncState update when the Scout rows were read
+        self.versao = None
+        self.assinatura = None
+        self._rows = None
+
+    @property
+    def rows(self):
+        """Row of every atleta_id"""
+        if self._rows is None:
+            self._rows = {atleta_id: row for row, atleta_id
+                          in enumerate(self.atleta_ids.tolist())}
+        return self._rows
+
+    def _grow(self, atleta_ids, rodadas):
+        """Adds rows and columns for the athletes and rodadas not stored"""
+        all_atleta_ids = np.union1d(self.atleta_ids, atleta_ids)
+        all_rodadas = np.union1d(self.rodadas, rodadas)
+        if (len(all_atleta_ids) == len(self.atleta_ids) and
+                len(all_rodadas) == len(self.rodadas)):
+            return
+        rows = np.searchsorted(all_atleta_ids, self.atleta_ids)
+        columns = np.searchsorted(all_rodadas, self.rodadas)
+        for field, array in self.values.items():
+            grown = np.full((len(all_atleta_ids), len(all_rodadas)), np.nan,
+                            dtype='f4')
+            grown[np.ix_(rows, columns)] = array
+            self.values[field] = grown
+        self.atleta_ids = all_atleta_ids.astype('i4')
+        self.rodadas = all_rodadas.astype('i4')
+        self._rows = None
+
+    def ingest(self, temporadas, rodadas, atleta_ids, values):
+        """Writes the rows given as equally long arrays, 'values' mapping
+        every field to its array, over whatever was stored for them"""
+        keys = _key(temporadas, rodadas)
+        atleta_ids = np.asarray(atleta_ids)
+        self._grow(atleta_ids, keys)
+        rows = np.searchsorted(self.atleta_ids, atleta_ids)
+        columns = np.searchsorted(self.rodadas, keys)
+        for field in FIELDS:
+            if not isinstance(self.values[field], np.memmap):
+                array = self.values[field]
+            else:
+                array = self.values[field] = np.array(self.values[field])
+            array[rows, columns] = values[field]
+
+    def ingest_queryset(self, queryset):
+        """Writes the Scout rows of 'queryset'"""
+        rows = list(queryset.values_list('temporada', 'rodada', 'atleta_id',
+                                         *FIELDS).iterator())
+        if not rows:
+            return
+        columns = list(zip(*rows))
+        self.ingest(columns[0], columns[1], columns[2],
+                    {field: np.array(column, dtype='f4')
+                     for field, column in zip(FIELDS, columns[3:])})
+
+    def _current_versao(self):
+        # every sync and import touches a SyncState row, see core.views
+        versao = SyncState.objects.aggregate(Max('updated_at'))[
+            'updated_at__max']
+        return versao.isoformat() if versao else None
+
+    def _assinatura(self):
+        """Count and sums of the values of the Scout rows before the last
+        stored rodada, which change with any row added or rewritten"""
+        if not len(self.rodadas):
+            return None
+        temporada, rodada = divmod(int(self.rodadas[-1]), 100)
+        assinatura = Scout.objects.filter(
+            Q(temporada__lt=temporada) |
+            Q(temporada=temporada, rodada__lt=rodada)).aggregate(
+                Count('id'), *(Sum(field) for field in FIELDS))
+        return [assinatura['id__count']] + [
+            assinatura['{}__sum'.format(field)] for field in FIELDS]
+
+    def build(self):
+        """Reads every Scout row"""
+        self.clear()
+        self.versao = self._current_versao()
+        self.ingest_queryset(Scout.objects.all())
+        self.assinatura = self._assinatura()
+
+    def atualizar(self):
+        """Reads again the Scout rows from the last stored rodada on, the
+        only ones a sync upserts, or every row if the rows before it were
+        added to or rewritten, as by an import. Returns whether anything
+        was read"""
+        versao = self._current_versao()
+        if versao == self.versao:
+            return False
+        if not len(self.rodadas) or self._assinatura() != self.assinatura:
+            self.build()
+            return True
+        temporada, rodada = divmod(int(self.rodadas[-1]), 100)
+        self.versao = versao
+        self.ingest_queryset(Scout.objects.filter(
+            Q(temporada__gt=temporada) |
+            Q(temporada=temporada, rodada__gte=rodada)))
+        self.assinatura = self._assinatura()
+        return True
+
+    def save(self):
+        os.makedirs(self.path, exist_ok=True)
+        meta_path = os.path.join(self.path, 'meta.json')
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+        arrays = dict(self.values, atleta_ids=self.atleta_ids,
+                      rodadas=self.rodadas)
+        for name, array in arrays.items():
+            path = os.path.join(self.path, '{}.npy'.format(name))
+            tmp_path = path + '.tmp.npy'
+            np.save(tmp_path, array)
+            os.replace(tmp_path, path)
+        # written last, so an interrupted save is built again
+        with open(meta_path, 'w') as f:
+            json.dump({'versao': self.versao,
+                       'assinatura': self.assinatura}, f)
+
+    def load(self):
+        """Maps the saved arrays, returns False if there are none"""
+        try:
+            with open(os.path.join(self.path, 'meta.json')) as f:
+                meta = json.load(f)
+        except (IOError, ValueError):
+            return False
+        self.versao = meta.get('versao')
+        self.assinatura = meta.get('assinatura')
+        for name in ('atleta_ids', 'rodadas') + FIELDS:
+            array = np.load(os.path.join(self.path, '{}.npy'.format(name)),
+                            mmap_mode='r')
+            if name in FIELDS:
+                self.values[name] = array
+            else:
+                setattr(self, name, np.array(array))
+        self._rows = None
+        return True
+
+    @classmethod
+    def open(cls, path=SERIES_DIR):
+        """The store saved under 'path', built from the database if there
+        is none and brought up to date with the last sync"""
+        store = cls(path)
+        if not store.load():
+            store.build()
+            store.save()
+        elif store.atualizar():
+            store.save()
+        return store
+
+    def serie(self, atleta_id, ultimas=None):
+        """Table of the rodadas of the athlete 'atleta_id' in the mercado,
+        the last 'ultimas' of them if given, with their 'temporada',
+        'rodada' and values"""
+        row = self.rows.get(atleta_id)
+        if row is None:
+            columns = np.zeros(0, dtype=np.intp)
+        else:
+            columns = np.flatnonzero(~np.isnan(self.values['preco_num'][row]))
+            if ultimas is not None:
+                columns = columns[len(columns) - min(ultimas,
+                                                     len(columns)):]
+        temporadas, rodadas = np.divmod(self.rodadas[columns], 100)
+        serie = Table((('temporada', temporadas), ('rodada', rodadas)))
+        for field in FIELDS:
+            serie[field] = (self.values[field][row, columns]
+                            if row is not None else np.zeros(0, dtype='f4'))
+        return serie
+
+    def janela(self, atleta_ids, ultimas=10):
+        """Values of the last 'ultimas' stored rodadas of every athlete in
+        'atleta_ids', as a Table of (athletes, rodadas) arrays whose
+        columns are the last 'ultimas' items of 'rodadas'. Unknown
+        athletes are all NaN"""
+        atleta_ids = np.asarray(atleta_ids)
+        rows = np.array([self.rows.get(atleta_id, -1)
+                         for atleta_id in atleta_ids.tolist()],
+                        dtype=np.intp)
+        columns = np.arange(max(len(self.rodadas) - ultimas, 0),
+                            len(self.rodadas))
+        janela = Table((('atleta_id', atleta_ids),))
+        for field in FIELDS:
+            values = np.asarray(self.values[field])[
+                np.ix_(np.maximum(rows, 0), columns)]
+            values[rows < 0] = np.nan
+            janela[field] = values
+        return janela
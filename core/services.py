@@ -1,8 +1,22 @@
+import asyncio
 import requests
 import csv
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from django.db.models import Q
-from core.models import Clube, Partida, Atleta, Posicao, Status, Scout
+from core.models import (
+    Clube, Partida, Atleta, Posicao, Status, Pontuacao, Scout, SCOUTS)
+
+
+class MercadoSnapshot():
+    """Parsed response of the atletas/mercado endpoint, shared by every
+    CartolafcAPIClient method that reads the mercado"""
+
+    def __init__(self, response):
+        self.response = response
+        self.atletas = response.get('atletas', [])
+        self.clubes = response.get('clubes', {})
+        self.posicoes = response.get('posicoes', {})
+        self.status = response.get('status', {})
 
 
 class CartolafcAPIClient():
@@ -10,11 +24,17 @@ class CartolafcAPIClient():
 
     base_url = 'https://api.cartolafc.globo.com/'
 
+    def __init__(self, session=None):
+        # a single keep-alive session, so consecutive requests reuse the
+        # same pooled TLS connection instead of opening a new one each
+        self.session = session or requests.Session()
+        self._mercado = None
+
     def _get(self, url, retries=3):
         """Make a GET request to an endpoint defined by 'url'"""
         while retries > 0:
             try:
-                response = requests.get(url=url)
+                response = self.session.get(url=url)
                 try:
                     response.raise_for_status()
                     return response.json()
@@ -47,10 +67,24 @@ class CartolafcAPIClient():
         r = requests.post(url=url, json=data)
         return r.json()['glbId']
 
+    def mercado(self, refresh=False):
+        """Retrieves the atletas/mercado endpoint as a MercadoSnapshot.
+
+        The response is downloaded and parsed only once per client; pass
+        'refresh' to fetch it again."""
+        if self._mercado is None or refresh:
+            url = '{}atletas/mercado'.format(self.base_url)
+            self._mercado = MercadoSnapshot(self._get(url))
+        return self._mercado
+
     def clubes(self):
         """Retrieves a list of Clube from the CartolaFC API"""
         url = '{}partidas/1'.format(self.base_url)
         response = self._get(url)
+        return self._clubes_from_response(response)
+
+    def _clubes_from_response(self, response):
+        """Builds a list of Clube from a partidas/{rodada} response"""
         response_clubes = response["clubes"]
         clube_list = []
         for key in response_clubes:
@@ -65,18 +99,25 @@ class CartolafcAPIClient():
             clube_list.append(clube)
         return clube_list
 
-    def partidas(self, rodada):
+    def partidas(self, rodada, temporada=None):
         """Retrieves a list of Partida from the CartolaFC API"""
         url = '{}partidas/{}'.format(self.base_url, rodada)
         response = self._get(url)
+        return self._partidas_from_response(response, temporada)
+
+    def _partidas_from_response(self, response, temporada=None):
+        """Builds a list of Partida from a partidas/{rodada} response.
+
+        The response does not tell its season, 'temporada' defaults to the
+        current year, like scouts()"""
+        temporada = temporada or datetime.now().year
         rodada = response['rodada']
         partida_list_json = response['partidas']
+        clubes = Clube.objects.in_bulk()
         partida_list = []
         for partida_json in partida_list_json:
-            clube_casa_id = partida_json['clube_casa_id']
-            clube_visitante_id = partida_json['clube_visitante_id']
-            clube_casa = Clube.objects.get(pk=clube_casa_id)
-            clube_visitante = Clube.objects.get(pk=clube_visitante_id)
+            clube_casa = clubes[partida_json['clube_casa_id']]
+            clube_visitante = clubes[partida_json['clube_visitante_id']]
             partida_data = datetime.strptime(partida_json['partida_data'],
                                              '%Y-%m-%d %H:%M:%S')
             partida = Partida(
@@ -92,15 +133,14 @@ class CartolafcAPIClient():
                 local=partida_json['local'],
                 valida=partida_json['valida'],
                 url_confronto=partida_json['url_confronto'],
+                temporada=temporada,
                 rodada=rodada)
             partida_list.append(partida)
         return partida_list
 
     def atletas(self):
         """Retrieves a list of Atleta from the CartolaFC API"""
-        url = '{}atletas/mercado'.format(self.base_url)
-        response = self._get(url)
-        atleta_list_json = response['atletas']
+        atleta_list_json = self.mercado().atletas
         atleta_list = []
         for atleta_json in atleta_list_json:
             atleta = Atleta(
@@ -113,9 +153,7 @@ class CartolafcAPIClient():
 
     def posicoes(self):
         """Retrieves a list of Posicao from the CartolaFC API"""
-        url = '{}atletas/mercado'.format(self.base_url)
-        response = self._get(url)
-        posicao_list_json = response['posicoes']
+        posicao_list_json = self.mercado().posicoes
         posicao_list = []
         for key in posicao_list_json:
             posicao_json = posicao_list_json[key]
@@ -128,9 +166,7 @@ class CartolafcAPIClient():
 
     def status(self):
         """Retrieves a list of Status from the CartolaFC API"""
-        url = '{}atletas/mercado'.format(self.base_url)
-        response = self._get(url)
-        status_list_json = response['status']
+        status_list_json = self.mercado().status
         status_list = []
         for key in status_list_json:
             status_json = status_list_json[key]
@@ -140,27 +176,37 @@ class CartolafcAPIClient():
             status_list.append(status)
         return status_list
 
-    def scouts(self):
-        """Retrieves a list of Scout from the CartolaFC API"""
-        url = '{}atletas/mercado'.format(self.base_url)
-        response = self._get(url)
-        scout_list_json = response['atletas']
-        ano = datetime.now().year
+    def scouts(self, temporada=None):
+        """Retrieves a list of Scout from the CartolaFC API.
+
+        The mercado does not tell its season, 'temporada' defaults to the
+        current year. Athletes whose club has no Partida of the rodada in
+        the database, like one postponed or not synced yet, are skipped"""
+        scout_list_json = self.mercado().atletas
+        temporada = temporada or datetime.now().year
+
+        # resolve every foreign key from in-memory indexes, built with a
+        # single query per table
+        atletas = Atleta.objects.in_bulk()
+        clubes = Clube.objects.in_bulk()
+        posicoes = Posicao.objects.in_bulk()
+        status_dict = Status.objects.in_bulk()
+        partidas = {}
+        for partida in Partida.objects.filter(temporada=temporada):
+            partidas[(partida.rodada, partida.clube_casa_id)] = partida
+            partidas[(partida.rodada, partida.clube_visitante_id)] = partida
 
         scout_list = []
         for scout_json in scout_list_json:
-            atleta_id = scout_json['atleta_id']
-            atleta = Atleta.objects.get(pk=atleta_id)
             clube_id = scout_json['clube_id']
-            clube = Clube.objects.get(pk=clube_id)
-            posicao_id = scout_json['posicao_id']
-            posicao = Posicao.objects.get(pk=posicao_id)
-            status_id = scout_json['status_id']
-            status = Status.objects.get(pk=status_id)
             rodada = scout_json['rodada_id']
-            partida = Partida.objects.get(
-                Q(partida_data__year=ano, rodada=rodada),
-                Q(clube_casa=clube) | Q(clube_visitante=clube))
+            partida = partidas.get((rodada, clube_id))
+            if partida is None:
+                continue
+            atleta = atletas[scout_json['atleta_id']]
+            clube = clubes[clube_id]
+            posicao = posicoes[scout_json['posicao_id']]
+            status = status_dict[scout_json['status_id']]
             scouts = scout_json['scout']
             scouts_kwargs = {}
             for key in scouts:
@@ -169,6 +215,7 @@ class CartolafcAPIClient():
                 scouts_kwargs[arg_name] = value
 
             scout = Scout(
+                temporada=temporada,
                 rodada=rodada,
                 atleta=atleta,
                 clube=clube,
@@ -186,11 +233,205 @@ class CartolafcAPIClient():
         return scout_list
 
 
+class AsyncCartolafcAPIClient(CartolafcAPIClient):
+    """A CartolafcAPIClient that fetches many endpoints concurrently.
+
+    Requests run on a thread pool driven by asyncio, with at most
+    'concurrency' of them in flight at once."""
+
+    def __init__(self, session=None, concurrency=10):
+        super().__init__(session)
+        self.concurrency = concurrency
+        # keep one pooled connection per concurrent request
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=concurrency, pool_maxsize=concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def _run(self, coroutine):
+        """Runs 'coroutine' to completion on a private event loop"""
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(coroutine)
+        finally:
+            loop.close()
+
+    async def get_many_async(self, urls):
+        """Makes GET requests to every url in 'urls', returning the
+        responses in the same order"""
+        loop = asyncio.get_event_loop()
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def get(url):
+            async with semaphore:
+                return await loop.run_in_executor(executor, self._get, url)
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            return await asyncio.gather(*[get(url) for url in urls])
+
+    def get_many(self, urls):
+        """Blocking version of get_many_async"""
+        return self._run(self.get_many_async(urls))
+
+    async def partidas_many_async(self, rodadas, temporada=None):
+        """Retrieves the Partida list of every rodada in 'rodadas',
+        returning a dict keyed by rodada"""
+        rodadas = list(rodadas)
+        urls = ['{}partidas/{}'.format(self.base_url, rodada)
+                for rodada in rodadas]
+        responses = await self.get_many_async(urls)
+        return {rodada: self._partidas_from_response(response, temporada)
+                for rodada, response in zip(rodadas, responses)}
+
+    def partidas_many(self, rodadas, temporada=None):
+        """Blocking version of partidas_many_async"""
+        return self._run(self.partidas_many_async(rodadas, temporada))
+
+
+def _int(value, default=None):
+    """Parses csv integers, which pandas-written files store as '262.0'"""
+    if value in (None, '', 'NA', 'nan'):
+        return default
+    return int(float(value))
+
+
+def _float(value, default=0.0):
+    if value in (None, '', 'NA', 'nan'):
+        return default
+    return float(value)
+
+
+def _bool(value, default=None):
+    if value in (None, '', 'NA', 'nan'):
+        return default
+    return value in ('1', '1.0', 'True', 'true')
+
+
 class CartolaCsvReader():
-    """Reads Cartola data from csv and returns Django model instances"""
+    """Reads Cartola data from csv and returns Django model instances.
+
+    Every method is a generator reading one row at a time, so memory does
+    not grow with the size of the file. The column layouts of every season
+    under data/ are supported: 2014 to 2016 files identify athletes by
+    'id' and rounds by 'rodada', 2017 files use 'atleta_id' and
+    'rodada_id'; columns missing from a season get the model defaults."""
+
+    def _rows(self, csv_path):
+        with open(csv_path, encoding='utf-8') as csvfile:
+            for row in csv.DictReader(csvfile):
+                yield row
+
+    def clubes(self, csv_path):
+        for row in self._rows(csv_path):
+            yield Clube(
+                id=_int(row['id']),
+                nome=row['nome'],
+                abreviacao=row['abreviacao'])
+
+    def posicoes(self, csv_path):
+        for row in self._rows(csv_path):
+            yield Posicao(
+                id=_int(row['id']),
+                nome=row['nome'],
+                abreviacao=row['abreviacao'])
 
-    def partidas(self, csv_path):
-        with open(csv_path) as csvfile:
-            reader = csv.reader(csvfile)
-            for row in reader:
-                print(', '.join(row))
+    def status(self, csv_path):
+        for row in self._rows(csv_path):
+            yield Status(id=_int(row['id']), nome=row['nome'])
+
+    def pontuacoes(self, csv_path):
+        for row in self._rows(csv_path):
+            yield Pontuacao(
+                abreviacao=row['abreviacao'],
+                nome=row['nome'],
+                pontuacao=_float(row['pontuacao']))
+
+    def atletas(self, csv_path):
+        """Atleta of every row. The nome is left empty in the seasons whose
+        csv does not have it"""
+        for row in self._rows(csv_path):
+            yield Atleta(
+                id=_int(row.get('atleta_id') or row['id']),
+                nome=row.get('nome', ''),
+                apelido=row['apelido'])
+
+    def atleta_posicoes(self, csv_path):
+        """Maps atleta id to posicao id, for seasons whose scouts do not
+        carry the posicao"""
+        posicoes = {}
+        for row in self._rows(csv_path):
+            posicao_id = _int(row.get('posicao_id'))
+            if posicao_id is not None:
+                posicoes[_int(row.get('atleta_id') or row['id'])] = posicao_id
+        return posicoes
+
+    def partidas(self, csv_path, ano):
+        """Partida of the season 'ano'. Seasons without match dates get
+        January 1st of 'ano'"""
+        for row in self._rows(csv_path):
+            partida_data = row.get('partida_data')
+            if partida_data:
+                partida_data = datetime.strptime(partida_data,
+                                                 '%Y-%m-%d %H:%M:%S')
+            else:
+                partida_data = datetime(year=ano, month=1, day=1)
+            yield Partida(
+                id=_int(row.get('id')),
+                clube_casa_id=_int(row['clube_casa_id']),
+                clube_visitante_id=_int(row['clube_visitante_id']),
+                clube_casa_posicao=_int(row.get('clube_casa_posicao'), 0),
+                clube_visitante_posicao=_int(
+                    row.get('clube_visitante_posicao'), 0),
+                aproveitamento_mandante=row.get('aproveitamento_mandante', ''),
+                aproveitamento_visitante=row.get(
+                    'aproveitamento_visitante', ''),
+                placar_oficial_mandante=_int(
+                    row['placar_oficial_mandante'], 0),
+                placar_oficial_visitante=_int(
+                    row['placar_oficial_visitante'], 0),
+                partida_data=partida_data,
+                local=row.get('local', ''),
+                valida=_bool(row.get('valida'), True),
+                url_confronto='',
+                temporada=ano,
+                rodada=_int(row.get('rodada_id') or row['rodada']))
+
+    def scouts(self, csv_path, ano, atleta_posicoes=None):
+        """Scout of every athlete that had a club in a played rodada of
+        the season 'ano'.
+
+        The partida is left unset, to be resolved from (rodada, clube_id).
+        Rows without a posicao column take it from 'atleta_posicoes', and
+        rows without a status are Provável if the athlete played, Nulo
+        otherwise."""
+        atleta_posicoes = atleta_posicoes or {}
+        for row in self._rows(csv_path):
+            rodada = _int(row.get('rodada_id') or row['rodada'])
+            clube_id = _int(row['clube_id'])
+            atleta_id = _int(row['atleta_id'])
+            posicao_id = _int(row.get('posicao_id'),
+                              atleta_posicoes.get(atleta_id))
+            if not rodada or clube_id is None or posicao_id is None:
+                continue
+            pontos_num = _float(row['pontos_num'])
+            status_id = _int(row.get('status_id'))
+            if status_id is None:
+                participou = _bool(row.get('participou'), pontos_num != 0)
+                status_id = 7 if participou else 6
+            scouts_kwargs = {}
+            for key in SCOUTS:
+                scouts_kwargs['scouts_{}'.format(key)] = _int(row[key], 0)
+
+            yield Scout(
+                temporada=ano,
+                rodada=rodada,
+                atleta_id=atleta_id,
+                clube_id=clube_id,
+                posicao_id=posicao_id,
+                status_id=status_id,
+                pontos_num=pontos_num,
+                preco_num=_float(row['preco_num']),
+                variacao_num=_float(row['variacao_num']),
+                media_num=_float(row['media_num']),
+                jogos_num=_int(row.get('jogos_num'), 0),
+                **scouts_kwargs)
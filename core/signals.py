@@ -0,0 +1,5 @@
+from django.dispatch import Signal
+
+# sent once a sync or an import has written to the database, with the
+# (created, updated) counts of every model as 'result'
+synced = Signal(providing_args=['result'])
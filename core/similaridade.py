@@ -0,0 +1,144 @@
+import numpy as np
+from django.core.cache import cache
+
+from core.datasets import Table
+from core.deltas import SCOUT_COLUMNS, is_cumulative, scout_deltas
+from core.models import Scout
+
+CACHE_KEY = 'similaridade:indice'
+FIELDS = ('temporada', 'rodada', 'atleta_id', 'posicao_id', 'status_id',
+          'preco_num', 'pontos_num', 'jogos_num') + SCOUT_COLUMNS
+DTYPES = ('i4',) * 5 + ('f8', 'f8', 'i4') + ('i4',) * len(SCOUT_COLUMNS)
+
+
+def taxas(scouts):
+    """Per game rate of every scout of the athletes of a Table of scouts of
+    one temporada, such as load_table('scouts', [ano]).
+
+    In cumulative seasons the scouts of the last rodada of each athlete
+    are divided by its jogos_num, in per round seasons the scouts of every
+    rodada are summed and divided by the rodadas it played. Returns a
+    Table with the 'atleta_id', 'jogos' and 'taxas', an (athletes, scouts)
+    array, plus the 'posicao_id', 'status_id' and 'preco_num' of its last
+    rodada"""
+    jogou = scout_deltas(scouts)['jogou']
+    atleta_ids = np.asarray(scouts['atleta_id'])
+    ids, index = np.unique(atleta_ids, return_inverse=True)
+    last = np.lexsort((scouts['rodada'], index))
+    ends = np.ones(len(last), dtype=bool)
+    ends[:-1] = index[last][1:] != index[last][:-1]
+    last = last[ends]
+
+    values = np.column_stack([np.asarray(scouts[name], dtype='f8')
+                              for name in SCOUT_COLUMNS])
+    # the last row of a cumulative season holds the whole season, every
+    # row of a per round season only its rodada
+    cumulative = is_cumulative(np.asarray(scouts['temporada'])[last])
+    counts = np.where(
+        cumulative[:, np.newaxis], values[last],
+        np.column_stack([np.bincount(index, column, len(ids))
+                         for column in values.T]))
+    jogos = np.where(cumulative, np.asarray(scouts['jogos_num'])[last],
+                     np.bincount(index, jogou, len(ids))).astype('i4')
+    result = Table((
+        ('atleta_id', ids),
+        ('jogos', jogos),
+        ('taxas', counts / np.maximum(jogos, 1)[:, np.newaxis]),
+    ))
+    for name in ('posicao_id', 'status_id', 'preco_num'):
+        result[name] = np.asarray(scouts[name])[last]
+    return result
+
+
+class SimilaridadeIndex():
+    """Nearest neighbours of the athletes of each Posicao by their per game
+    scout rates.
+
+    Every rate is standardized within the Posicao, so a scout every
+    athlete does weighs as much as a rare one, and every vector is scaled
+    to unit length, so the similarity of two athletes is the cosine of
+    their vectors. Athletes who have not played are left out"""
+
+    def __init__(self, taxas):
+        self.posicoes = {}
+        self.lookup = {}
+        jogou = np.flatnonzero(taxas['jogos'] > 0)
+        for posicao_id in np.unique(taxas['posicao_id'][jogou]).tolist():
+            rows = jogou[taxas['posicao_id'][jogou] == posicao_id]
+            vetores = taxas['taxas'][rows]
+            vetores = vetores - vetores.mean(axis=0)
+            desvios = vetores.std(axis=0)
+            vetores /= np.where(desvios > 0, desvios, 1)
+            normas = np.sqrt((vetores ** 2).sum(axis=1))
+            vetores /= np.where(normas > 0, normas, 1)[:, np.newaxis]
+            self.posicoes[posicao_id] = Table((
+                ('atleta_id', taxas['atleta_id'][rows]),
+                ('status_id', taxas['status_id'][rows]),
+                ('preco_num', taxas['preco_num'][rows]),
+                ('vetor', vetores.astype('f4')),
+            ))
+            for row, atleta_id in enumerate(
+                    taxas['atleta_id'][rows].tolist()):
+                self.lookup[atleta_id] = (posicao_id, row)
+
+    def similares(self, atleta_id, k=5, preco_max=None, status_ids=None):
+        """Table of the 'k' athletes of the same Posicao most similar to
+        'atleta_id', most similar first, with their 'similaridade'.
+
+        Only athletes costing at most 'preco_max' and, if given, whose
+        last status is in 'status_ids' are considered. An athlete who has
+        not played has no neighbours"""
+        if atleta_id not in self.lookup:
+            return Table((('atleta_id', np.zeros(0, dtype='i4')),
+                          ('preco_num', np.zeros(0)),
+                          ('similaridade', np.zeros(0, dtype='f4'))))
+        posicao_id, row = self.lookup[atleta_id]
+        posicao = self.posicoes[posicao_id]
+        similaridades = posicao['vetor'].dot(posicao['vetor'][row])
+        candidatos = np.ones(len(similaridades), dtype=bool)
+        candidatos[row] = False
+        if preco_max is not None:
+            candidatos &= posicao['preco_num'] <= preco_max
+        if status_ids is not None:
+            candidatos &= np.in1d(posicao['status_id'], list(status_ids))
+        candidatos = np.flatnonzero(candidatos)
+        if len(candidatos) > k:
+            candidatos = candidatos[np.argpartition(
+                -similaridades[candidatos], k - 1)[:k]]
+        candidatos = candidatos[np.argsort(-similaridades[candidatos],
+                                           kind='mergesort')]
+        return Table((
+            ('atleta_id', posicao['atleta_id'][candidatos]),
+            ('preco_num', posicao['preco_num'][candidatos]),
+            ('similaridade', similaridades[candidatos]),
+        ))
+
+
+def _ultima_rodada():
+    return Scout.objects.order_by('-temporada', '-rodada').values_list(
+        'temporada', 'rodada').first()
+
+
+def load_scouts(temporada, rodada=None):
+    """Table of the Scout rows of 'temporada' in the database, only from
+    'rodada' on if given"""
+    queryset = Scout.objects.filter(temporada=temporada)
+    if rodada is not None:
+        queryset = queryset.filter(rodada__gte=rodada)
+    rows = list(queryset.values_list(*FIELDS).iterator())
+    columns = list(zip(*rows)) or [()] * len(FIELDS)
+    return Table((name, np.array(column, dtype=dtype))
+                 for name, column, dtype in zip(FIELDS, columns, DTYPES))
+
+
+def indice():
+    """SimilaridadeIndex of the last temporada in the Scout table, kept in
+    the cache and built again only once a new rodada is ingested"""
+    rodada = _ultima_rodada()
+    cached = cache.get(CACHE_KEY)
+    if cached is not None and cached[0] == rodada:
+        return cached[1]
+    result = SimilaridadeIndex(taxas(
+        load_scouts(rodada[0] if rodada else None)))
+    cache.set(CACHE_KEY, (rodada, result), None)
+    return result
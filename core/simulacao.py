@@ -0,0 +1,186 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from core.datasets import Table
+from core.deltas import scout_deltas
+
+# games of an average athlete of the same Posicao added to every athlete,
+# so the spread of an athlete with few games stays near its position's
+JOGOS_PRIOR = 10
+# share of the variance of an athlete's points explained by its partida,
+# like a goalfest lifting both sides, and by its club's side of it
+RHO_PARTIDA = 0.05
+RHO_CLUBE = 0.15
+
+
+def historico(scouts):
+    """Mean and standard deviation of the points of every athlete in the
+    games it played, from a Table of scouts such as load_table('scouts').
+
+    The variance is shrunk towards the variance of its Posicao, by
+    JOGOS_PRIOR games, and athletes are identified by their last
+    posicao_id"""
+    scouts = scout_deltas(scouts)
+    jogou = scouts['jogou']
+    atleta_ids = np.asarray(scouts['atleta_id'])[jogou]
+    posicao_ids = np.asarray(scouts['posicao_id'])[jogou]
+    pontos = np.asarray(scouts['pontos_num'], dtype='f8')[jogou]
+    keys = (np.asarray(scouts['temporada'])[jogou] * 100 +
+            np.asarray(scouts['rodada'])[jogou])
+
+    ids, index = np.unique(atleta_ids, return_inverse=True)
+    jogos = np.bincount(index, minlength=len(ids))
+    media = np.bincount(index, pontos, len(ids)) / jogos
+    variancia = np.bincount(index, (pontos - media[index]) ** 2,
+                            len(ids)) / jogos
+    last = np.lexsort((keys, index))
+    last = last[np.r_[index[last][1:] != index[last][:-1], True]]
+    posicao = posicao_ids[last]
+
+    variancia_posicao = np.zeros(posicao.max() + 1 if len(posicao) else 0)
+    for posicao_id in np.unique(posicao_ids):
+        variancia_posicao[posicao_id] = pontos[posicao_ids == posicao_id].var()
+    variancia = ((jogos * variancia + JOGOS_PRIOR *
+                  variancia_posicao[posicao]) / (jogos + JOGOS_PRIOR))
+    return Table((
+        ('atleta_id', ids),
+        ('posicao_id', posicao),
+        ('jogos', jogos),
+        ('media', media),
+        ('desvio', np.sqrt(variancia)),
+    ))
+
+
+def _groups(clube_ids, partidas):
+    """Index of the partida and of the club's side of it of every athlete,
+    -1 for clubs not in 'partidas'"""
+    clube_ids = np.asarray(clube_ids)
+    lados = np.concatenate((partidas['clube_casa_id'],
+                            partidas['clube_visitante_id']))
+    num_partidas = len(partidas['clube_casa_id'])
+    order = np.argsort(lados, kind='mergesort')
+    sorted_lados = lados[order]
+    if not len(sorted_lados):
+        return (np.full(len(clube_ids), -1, dtype=np.intp),) * 2
+    index = np.minimum(np.searchsorted(sorted_lados, clube_ids),
+                       len(sorted_lados) - 1)
+    found = sorted_lados[index] == clube_ids
+    lado = np.where(found, order[index], -1)
+    partida = np.where(found, lado % max(num_partidas, 1), -1)
+    return partida, lado
+
+
+def _simulate(task):
+    """Totals of the lineups in a chunk of simulations or, given 'alvo',
+    how many of them score more than it, in a worker process"""
+    simulator, escalacoes, n, seed, alvo = task
+    totals = simulator.sample(n, np.random.RandomState(seed)).dot(
+        escalacoes.T)
+    if alvo is None:
+        return totals
+    return (totals > alvo).sum(axis=0)
+
+
+class RodadaSimulator():
+    """Draws the points of the athletes of a rodada many times at once.
+
+    Each athlete scores media + desvio * z, where z is a standard normal
+    made of a share RHO_PARTIDA shared with everyone in the same partida,
+    a share RHO_CLUBE shared with its teammates and an independent rest.
+    'medias' are usually projected points and 'desvios' the historical
+    spread of historico(); 'partidas' is a Table of the rodada's partidas,
+    whose clube ids 'clube_ids' are matched against"""
+
+    def __init__(self, atleta_ids, medias, desvios, clube_ids, partidas,
+                 rho_partida=RHO_PARTIDA, rho_clube=RHO_CLUBE):
+        self.atleta_ids = np.asarray(atleta_ids)
+        self.medias = np.asarray(medias, dtype='f8')
+        self.desvios = np.asarray(desvios, dtype='f8')
+        self.partida, self.lado = _groups(clube_ids, partidas)
+        self.rho_partida = rho_partida
+        self.rho_clube = rho_clube
+
+    def subset(self, index):
+        """The simulator of the athletes at positions 'index' only"""
+        simulator = RodadaSimulator.__new__(RodadaSimulator)
+        simulator.__dict__.update(self.__dict__)
+        for name in ('atleta_ids', 'medias', 'desvios', 'partida', 'lado'):
+            setattr(simulator, name, getattr(self, name)[index])
+        return simulator
+
+    def sample(self, n, random_state=None):
+        """(n, athletes) array of simulated points"""
+        random_state = random_state or np.random.RandomState()
+        size = len(self.atleta_ids)
+        z = random_state.standard_normal((n, size))
+        z *= np.sqrt(1 - self.rho_partida - self.rho_clube)
+        for groups, rho in ((self.partida, self.rho_partida),
+                            (self.lado, self.rho_clube)):
+            playing = np.flatnonzero(groups >= 0)
+            if not len(playing) or not rho:
+                continue
+            labels, inverse = np.unique(groups[playing], return_inverse=True)
+            shared = random_state.standard_normal((n, len(labels)))
+            z[:, playing] += np.sqrt(rho) * shared[:, inverse]
+        # athletes of clubs without a partida keep all their variance
+        # independent
+        independent = np.flatnonzero(self.lado < 0)
+        z[:, independent] /= np.sqrt(1 - self.rho_partida - self.rho_clube)
+        z *= self.desvios
+        z += self.medias
+        return z
+
+    def _run(self, escalacoes, n, seed, chunk_size, jobs, alvo=None):
+        escalacoes = [np.asarray(escalacao) for escalacao in escalacoes]
+        ids = np.unique(np.concatenate(escalacoes)) if escalacoes else \
+            np.zeros(0, dtype=self.atleta_ids.dtype)
+        order = np.argsort(self.atleta_ids, kind='mergesort')
+        positions = np.searchsorted(self.atleta_ids, ids, sorter=order)
+        positions = np.minimum(positions, len(order) - 1)
+        found = self.atleta_ids[order[positions]] == ids
+        index = order[positions[found]]
+        ids = ids[found]
+        matrix = np.zeros((len(escalacoes), len(ids)))
+        for row, escalacao in enumerate(escalacoes):
+            escalados = escalacao[np.in1d(escalacao, ids)]
+            matrix[row, np.searchsorted(ids, escalados)] = 1
+
+        simulator = self.subset(index)
+        sizes = [min(chunk_size, n - start)
+                 for start in range(0, n, chunk_size)]
+        seeds = np.random.RandomState(seed).randint(2 ** 31 - 1,
+                                                    size=len(sizes))
+        tasks = [(simulator, matrix, size, chunk_seed, alvo)
+                 for size, chunk_seed in zip(sizes, seeds)]
+        if jobs > 1 and len(tasks) > 1:
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                chunks = list(executor.map(_simulate, tasks))
+        else:
+            chunks = [_simulate(task) for task in tasks]
+        return chunks
+
+    def simulate(self, escalacoes, n=100000, seed=None, chunk_size=20000,
+                 jobs=1):
+        """Total points of every lineup in every simulation, as an
+        (n, lineups) array.
+
+        'escalacoes' is a sequence of lineups, each a sequence of atleta
+        ids (ids not in the simulator, like the -1 padding of
+        escalar_grid, are ignored). Only the athletes of some lineup are
+        drawn, 'chunk_size' simulations at a time, and every lineup is
+        scored with one matrix product. Each chunk has its own seed drawn
+        from 'seed', so the result does not depend on 'jobs', the number
+        of worker processes the chunks are spread over"""
+        chunks = self._run(escalacoes, n, seed, chunk_size, jobs)
+        if not chunks:
+            return np.zeros((0, len(escalacoes)))
+        return np.concatenate(chunks)
+
+    def probabilidade(self, escalacoes, alvo, n=100000, seed=None,
+                      chunk_size=20000, jobs=1):
+        """Chance of every lineup in 'escalacoes' scoring more than 'alvo'
+        points, see simulate(). Only the counts of every chunk are kept, so
+        memory does not grow with 'n'"""
+        chunks = self._run(escalacoes, n, seed, chunk_size, jobs, alvo)
+        return np.sum(chunks, axis=0) / float(n)
@@ -0,0 +1,132 @@
+import gzip
+import json
+import os
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db.models import Q, Sum
+
+from core.models import ClubeRating, Partida, Scout
+
+NOMES = ('destaques', 'pontuacao', 'forma')
+# athletes of each Posicao in destaques, and partidas in forma
+DESTAQUES = 10
+JOGOS_FORMA = 5
+
+
+def snapshot_path(temporada, rodada, nome):
+    return os.path.join(settings.SNAPSHOT_DIR, str(temporada), str(rodada),
+                        '{}.json.gz'.format(nome))
+
+
+def destaques(temporada, rodada):
+    """Best scoring athletes of every Posicao in the rodada"""
+    result = OrderedDict()
+    for row in Scout.objects.filter(
+            temporada=temporada, rodada=rodada).order_by(
+                'posicao_id', '-pontos_num', 'atleta_id').values(
+                    'atleta_id', 'atleta__apelido', 'clube_id', 'posicao_id',
+                    'pontos_num', 'preco_num').iterator():
+        atletas = result.setdefault(str(row['posicao_id']), [])
+        if len(atletas) < DESTAQUES:
+            atletas.append({'atleta_id': row['atleta_id'],
+                            'apelido': row['atleta__apelido'],
+                            'clube_id': row['clube_id'],
+                            'pontos_num': row['pontos_num'],
+                            'preco_num': row['preco_num']})
+    return result
+
+
+def pontuacao(temporada, rodada):
+    """Result of every partida of the rodada and the points scored by the
+    athletes of each side"""
+    pontos = dict(Scout.objects.filter(
+        temporada=temporada, rodada=rodada).values_list('clube_id').annotate(
+            Sum('pontos_num')).order_by())
+    return [{'clube_casa_id': partida['clube_casa_id'],
+             'clube_visitante_id': partida['clube_visitante_id'],
+             'placar_oficial_mandante': partida['placar_oficial_mandante'],
+             'placar_oficial_visitante': partida['placar_oficial_visitante'],
+             'pontos_casa': pontos.get(partida['clube_casa_id'], 0),
+             'pontos_visitante': pontos.get(partida['clube_visitante_id'], 0)}
+            for partida in Partida.objects.filter(
+                temporada=temporada, rodada=rodada, valida=True).order_by(
+                    'id').values()]
+
+
+def forma(temporada, rodada):
+    """Results of the last JOGOS_FORMA partidas of every club up to the
+    rodada, as 'V', 'E' or 'D', the points they earned and the club's
+    Elo rating after the rodada, null if it is not rated yet"""
+    resultados = OrderedDict()
+    for partida in Partida.objects.filter(
+            temporada=temporada, rodada__lte=rodada, valida=True,
+            placar_oficial_mandante__isnull=False,
+            placar_oficial_visitante__isnull=False).order_by(
+                'rodada', 'id').values().iterator():
+        saldo = (partida['placar_oficial_mandante'] -
+                 partida['placar_oficial_visitante'])
+        for clube_id, lado in ((partida['clube_casa_id'], saldo),
+                               (partida['clube_visitante_id'], -saldo)):
+            resultados.setdefault(clube_id, []).append(
+                'V' if lado > 0 else 'E' if lado == 0 else 'D')
+    elos = dict(ClubeRating.objects.filter(
+        temporada=temporada, rodada=rodada).values_list('clube_id', 'elo'))
+    return [{'clube_id': clube_id,
+             'resultados': ''.join(clube_resultados[-JOGOS_FORMA:]),
+             'pontos': sum(3 if resultado == 'V' else
+                           1 if resultado == 'E' else 0
+                           for resultado in clube_resultados[-JOGOS_FORMA:]),
+             'elo': elos.get(clube_id)}
+            for clube_id, clube_resultados in sorted(resultados.items())]
+
+
+AGREGADOS = {'destaques': destaques, 'pontuacao': pontuacao,
+             'forma': forma}
+
+
+def write_snapshot(temporada, rodada, nome, content):
+    """Writes 'content' as gzipped JSON, replacing the old file at once so
+    readers never see a partial one"""
+    path = snapshot_path(temporada, rodada, nome)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with gzip.open(tmp_path, 'wb') as f:
+        f.write(json.dumps(content, separators=(',', ':')).encode('utf-8'))
+    os.replace(tmp_path, path)
+
+
+def _ultima_rodada():
+    """Last (temporada, rodada) with snapshots, or None"""
+    def numeros(path):
+        try:
+            names = os.listdir(path)
+        except OSError:
+            return []
+        return [int(name) for name in names if name.isdigit()]
+
+    temporadas = numeros(settings.SNAPSHOT_DIR)
+    for temporada in sorted(temporadas, reverse=True):
+        rodadas = numeros(os.path.join(settings.SNAPSHOT_DIR, str(temporada)))
+        if rodadas:
+            return temporada, max(rodadas)
+    return None
+
+
+def materializar(desde=None):
+    """Writes the snapshots of every rodada with Scout rows from the last
+    one written on, which a sync may have changed, or from the
+    (temporada, rodada) tuple 'desde'. Returns the number of rodadas
+    written"""
+    desde = desde or _ultima_rodada()
+    rodadas = Scout.objects.values_list('temporada', 'rodada').distinct()
+    if desde is not None:
+        temporada, rodada = desde
+        rodadas = rodadas.filter(Q(temporada__gt=temporada) |
+                                 Q(temporada=temporada, rodada__gte=rodada))
+    rodadas = list(rodadas.order_by('temporada', 'rodada'))
+    for temporada, rodada in rodadas:
+        for nome in NOMES:
+            write_snapshot(temporada, rodada, nome,
+                           AGREGADOS[nome](temporada, rodada))
+    return len(rodadas)
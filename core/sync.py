@@ -0,0 +1,164 @@
+import hashlib
+import json
+from collections import OrderedDict
+from datetime import datetime
+
+from django.db import transaction
+
+from core.models import (
+    Clube, Partida, Atleta, Posicao, Status, Scout, SyncState)
+from core.persistence import bulk_upsert
+from core.rankings import atualizar_rankings
+from core.ratings import atualizar_ratings
+from core.services import AsyncCartolafcAPIClient
+from core.signals import synced
+from core.snapshots import materializar
+
+
+def content_hash(response):
+    """SHA-1 of a decoded JSON response, independent of key order"""
+    dump = json.dumps(response, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(dump.encode('utf-8')).hexdigest()
+
+
+class CartolaSync():
+    """Incrementally upserts the CartolaFC API into the database.
+
+    A SyncState row per endpoint records the content hash of the last
+    ingested response, so unchanged responses are never written again and
+    a sync is a no-op when the mercado has not changed. The mercado does
+    not tell its season, 'temporada' defaults to the current year."""
+
+    def __init__(self, client=None, batch_size=500, force=False,
+                 temporada=None):
+        self.client = client or AsyncCartolafcAPIClient()
+        self.batch_size = batch_size
+        self.force = force
+        self.temporada = temporada or datetime.now().year
+        self.states = {state.endpoint: state
+                       for state in SyncState.objects.all()}
+        # first rodada whose Partida rows were written
+        self.partidas_desde = None
+        self.result = OrderedDict()
+
+    def _changed(self, endpoint, response):
+        """Whether 'response' differs from the last one ingested"""
+        state = self.states.get(endpoint)
+        return (self.force or state is None or
+                state.content_hash != content_hash(response))
+
+    def _ingested(self, endpoint, response, rodada=0):
+        state = self.states.get(endpoint) or SyncState(endpoint=endpoint)
+        state.content_hash = content_hash(response)
+        state.rodada = rodada
+        state.save()
+        self.states[endpoint] = state
+
+    def _upsert(self, model, objs, key_fields=('id',), queryset=None):
+        created, updated = bulk_upsert(
+            model, objs, key_fields, queryset=queryset,
+            batch_size=self.batch_size)
+        total_created, total_updated = self.result.get(model.__name__, (0, 0))
+        self.result[model.__name__] = (total_created + created,
+                                       total_updated + updated)
+        return created, updated
+
+    def _partidas_endpoint(self, rodada):
+        return 'partidas/{}/{}'.format(self.temporada, rodada)
+
+    @property
+    def watermark(self):
+        """Last rodada of the temporada whose partidas were ingested"""
+        prefix = self._partidas_endpoint('')
+        return max([state.rodada for endpoint, state in self.states.items()
+                    if endpoint.startswith(prefix)] or [0])
+
+    def sync_partidas(self, rodadas):
+        """Upserts the Partida list of every changed rodada in 'rodadas'"""
+        rodadas = sorted(rodadas)
+        urls = ['{}partidas/{}'.format(self.client.base_url, rodada)
+                for rodada in rodadas]
+        responses = self.client.get_many(urls)
+        for rodada, response in zip(rodadas, responses):
+            endpoint = self._partidas_endpoint(rodada)
+            if not self._changed(endpoint, response):
+                continue
+            # the same temporada as the scouts, whatever the match dates
+            partida_list = self.client._partidas_from_response(
+                response, self.temporada)
+            if any(self._upsert(
+                    Partida, partida_list,
+                    ('temporada', 'rodada', 'clube_casa_id'),
+                    Partida.objects.filter(temporada=self.temporada,
+                                           rodada=rodada))):
+                self.partidas_desde = min(self.partidas_desde or rodada,
+                                          rodada)
+            self._ingested(endpoint, response, rodada)
+
+    def run(self, rodadas=None):
+        """Syncs everything that changed since the last run.
+
+        'rodadas' forces the partidas of those rodadas to be fetched;
+        by default every rodada from the watermark up to the mercado
+        rodada is fetched. Returns an OrderedDict mapping each model name
+        to a (created, updated) tuple, empty when nothing changed, plus
+        the number of scouts skipped for lack of a matching Partida.
+        Once something was written, the snapshots of the changed rodadas
+        are written again and core.signals.synced is sent."""
+        mercado = self.client.mercado(refresh=True)
+        if not self._changed('atletas/mercado', mercado.response):
+            return self.result
+
+        with transaction.atomic():
+            clubes_url = '{}partidas/1'.format(self.client.base_url)
+            clubes_response = self.client._get(clubes_url)
+            if self._changed('clubes', clubes_response):
+                self._upsert(
+                    Clube, self.client._clubes_from_response(clubes_response))
+                self._ingested('clubes', clubes_response)
+
+            mercado_rodada = max(
+                [atleta['rodada_id'] for atleta in mercado.atletas] or [0])
+            if rodadas is None:
+                # the watermark rodada is fetched again, as its scores may
+                # have changed since it was ingested
+                rodadas = range(max(self.watermark, 1), mercado_rodada + 1)
+            self.sync_partidas(rodadas)
+
+            self._upsert(Posicao, self.client.posicoes())
+            self._upsert(Status, self.client.status())
+            self._upsert(Atleta, self.client.atletas())
+            # scouts are mapped to the Partida rows saved above
+            scout_list = self.client.scouts(self.temporada)
+            skipped = len(mercado.atletas) - len(scout_list)
+            if skipped:
+                self.result['Scout skipped'] = skipped
+            rodadas = {scout.rodada for scout in scout_list}
+            temporadas = {scout.temporada for scout in scout_list}
+            self._upsert(Scout, scout_list,
+                         ('temporada', 'rodada', 'atleta_id'),
+                         Scout.objects.filter(temporada__in=temporadas,
+                                              rodada__in=rodadas))
+            # rates the rodadas completed since the last sync, and again
+            # the ones rated before a placar changed
+            desde = None
+            if self.partidas_desde is not None:
+                desde = (self.temporada, self.partidas_desde)
+            self.result['ClubeRating'] = atualizar_ratings(
+                desde=desde, batch_size=self.batch_size)
+            self.result['Ranking'] = atualizar_rankings(
+                batch_size=self.batch_size)
+            self._ingested('atletas/mercado', mercado.response,
+                           mercado_rodada)
+        # written once committed, so they never hold rolled back rows
+        materializar()
+        synced.send(sender=self.__class__, result=self.result)
+        return self.result
+
+
+def sync_cartola(client=None, rodadas=None, batch_size=500, force=False,
+                 temporada=None):
+    """Fetches the CartolaFC API and upserts whatever changed since the
+    last sync. See CartolaSync.run"""
+    return CartolaSync(client, batch_size=batch_size, force=force,
+                       temporada=temporada).run(rodadas)
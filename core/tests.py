@@ -1,10 +1,56 @@
 import requests
 import csv
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
 from datetime import datetime
+from io import StringIO
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+import importlib
+import itertools
+import numpy as np
+from django.apps import apps
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management import call_command
+from django.db import IntegrityError
 from django.test import TestCase, mock
+from django.urls import reverse
 from django.db.models import Q
-from core.services import CartolafcAPIClient, CartolaCsvReader
-from core.models import Clube, Partida, Atleta, Posicao, Status, Scout
+from core.services import (
+    CartolafcAPIClient, AsyncCartolafcAPIClient, CartolaCsvReader)
+from core.models import (
+    Clube, ClubeRating, Partida, Atleta, Posicao, Status, Pontuacao,
+    Ranking, RankingTotal, Scout, SyncState)
+from core.datasets import SeasonDataset, Table, load_seasons, load_table
+from core.exports import COLUMNS, export_season
+from core.escalacao import (
+    EscalacaoOptimizer, GOL, ZAG, ATA, escalar, escalar_grid,
+    non_dominated)
+from core.deltas import SCOUT_COLUMNS, scout_deltas
+from core.projecao import JOGOS_PRIOR, PESO_ULTIMOS, ProjecaoState
+from core.simulacao import (
+    JOGOS_PRIOR as SIMULACAO_JOGOS_PRIOR, RHO_CLUBE, RHO_PARTIDA,
+    RodadaSimulator, historico)
+from core.backtest import EstrategiaProjecao, backtest, run_season
+from core.valorizacao import ModeloValorizacao, modelo, prever_mercado
+from core.rankings import atualizar_rankings, ranking
+from core.ratings import ELO_INICIAL, atualizar_ratings, rating
+from core.series import SerieStore
+from core.similaridade import (
+    SimilaridadeIndex, indice, load_scouts, taxas)
+from core.importers import CartolaCsvImporter, TABLES, find_season_files
+from core.persistence import bulk_upsert
+from core.scoring import ScoringEngine, load_pesos
+from core.signals import synced
+from core.snapshots import materializar, snapshot_path
+from core.views import versao
+from core.sync import CartolaSync
 
 
 class CustomHTTPException(Exception):
@@ -46,11 +92,12 @@ class CartolafcAPIClientTests(TestCase):
             local='Raulino de Oliveira',
             valida=True,
             url_confronto='http://globoesporte.globo.com/rj/futebol/brasileirao-serie-a/jogo/04-06-2017/flamengo-botafogo',
+            temporada=2017,
             rodada=4)
         Posicao.objects.create(id=4, nome='Meia', abreviacao='mei')
         Status.objects.create(id=3, nome='Suspenso')
 
-    @mock.patch('core.services.requests.get')
+    @mock.patch('core.services.requests.Session.get')
     def test_get(self, mock_get):
         """Test getting a 200 OK response from the _get method of
         MyAPIClient."""
@@ -79,7 +126,7 @@ class CartolafcAPIClientTests(TestCase):
         self.assertEqual(response_dict, expected_dict)
 
     @mock.patch('core.services.CartolafcAPIClient._handle_http_error')
-    @mock.patch('core.services.requests.get')
+    @mock.patch('core.services.requests.Session.get')
     def test_get_http_error(self, mock_get, mock_http_error_handler):
         """Test getting a HTTP error in the _get method of
         CartolafcAPIClient."""
@@ -110,7 +157,7 @@ class CartolafcAPIClientTests(TestCase):
         mock_http_error_handler.assert_called_once_with(http_error)
 
     @mock.patch('core.services.CartolafcAPIClient._handle_connection_error')
-    @mock.patch('core.services.requests.get')
+    @mock.patch('core.services.requests.Session.get')
     def test_get_connection_error(self, mock_get, mock_conn_error_handler):
         """Test getting a persistent connection error in the _get
         method of CartolafcAPIClient."""
@@ -132,7 +179,7 @@ class CartolafcAPIClientTests(TestCase):
         # Make sure our connection error handler is called
         mock_conn_error_handler.assert_called_once_with(conn_error)
 
-    @mock.patch('core.services.requests.get')
+    @mock.patch('core.services.requests.Session.get')
     def test_get_connection_error_then_success(self, mock_get):
         """Test getting a connection error, then a successful response,
         in the _get method of CartolafcAPIClient."""
@@ -164,7 +211,7 @@ class CartolafcAPIClientTests(TestCase):
         self.assertEqual(response_dict, expected_dict)
 
     @mock.patch('core.services.CartolafcAPIClient._handle_http_error')
-    @mock.patch('core.services.requests.get')
+    @mock.patch('core.services.requests.Session.get')
     def test_get_connection_error_then_http_error(
             self, mock_get, mock_http_error_handler):
         """Test getting a connection error, then a http error, in the
@@ -300,10 +347,11 @@ class CartolafcAPIClientTests(TestCase):
         expected_url = 'https://api.cartolafc.globo.com/partidas/4'
         mock_get.return_value = expected_response
 
-        output = self.client.partidas(4)
+        output = self.client.partidas(4, temporada=2017)
 
         mock_get.assert_called_once_with(expected_url)
         self.assertEqual(1, mock_get.call_count)
+        self.assertEqual(2017, output[0].temporada)
         self.assertEqual(output[0].clube_casa, expected_output[0].clube_casa)
         self.assertEqual(output[0].partida_data,
                          expected_output[0].partida_data)
@@ -412,12 +460,13 @@ class CartolafcAPIClientTests(TestCase):
         clube = Clube.objects.get(pk=263)
         posicao = Posicao.objects.get(pk=4)
         status = Status.objects.get(pk=3)
-        # get the Partida instance with the correct year and Clube
+        # get the Partida instance with the correct season and Clube
         partida = Partida.objects.get(
-            Q(partida_data__year=2017, rodada=4),
+            Q(temporada=2017, rodada=4),
             Q(clube_casa=clube) | Q(clube_visitante=clube))
 
-        expected_output = [Scout(rodada=4,
+        expected_output = [Scout(temporada=2017,
+                                 rodada=4,
                                  atleta=atleta,
                                  clube=clube,
                                  posicao=posicao,
@@ -435,7 +484,7 @@ class CartolafcAPIClientTests(TestCase):
         expected_url = 'https://api.cartolafc.globo.com/atletas/mercado'
         mock_get.return_value = expected_response
 
-        output = self.client.scouts()
+        output = self.client.scouts(temporada=2017)
 
         mock_get.assert_called_once_with(expected_url)
         self.assertEqual(1, mock_get.call_count)
@@ -445,62 +494,1819 @@ class CartolafcAPIClientTests(TestCase):
         self.assertEqual(output[0].status, expected_output[0].status)
         self.assertEqual(output[0].partida, expected_output[0].partida)
 
+    @mock.patch('core.services.CartolafcAPIClient._get')
+    def test_scouts_constant_queries(self, mock_get):
+        """Test that the scouts method of CartolafcAPIClient resolves
+        every foreign key with one query per table."""
+        clube_casa = Clube.objects.get(pk=262)
+        clube_visitante = Clube.objects.get(pk=263)
+        Partida.objects.create(
+            clube_casa=clube_casa, clube_visitante=clube_visitante,
+            clube_casa_posicao=1, clube_visitante_posicao=2,
+            aproveitamento_mandante='', aproveitamento_visitante='',
+            placar_oficial_mandante=0, placar_oficial_visitante=0,
+            partida_data=datetime(year=2017, month=6, day=4),
+            local='', valida=True, url_confronto='', temporada=2017,
+            rodada=5)
+        atletas_json = []
+        for atleta_id in range(1, 51):
+            Atleta.objects.create(id=atleta_id, nome='', apelido='')
+            atletas_json.append({
+                "atleta_id": atleta_id, "rodada_id": 5,
+                "clube_id": 262 if atleta_id % 2 else 263,
+                "posicao_id": 4, "status_id": 3, "pontos_num": 1.0,
+                "preco_num": 5.0, "variacao_num": 0.0, "media_num": 1.0,
+                "jogos_num": 1, "scout": {"FS": 1}})
+        mock_get.return_value = {"atletas": atletas_json}
+
+        with self.assertNumQueries(5):
+            output = self.client.scouts(temporada=2017)
+
+        self.assertEqual(50, len(output))
+        self.assertEqual(output[0].partida, output[1].partida)
+        self.assertEqual(263, output[1].clube.id)
+
+    @mock.patch('core.services.CartolafcAPIClient._get')
+    def test_mercado_fetched_once(self, mock_get):
+        """Test that atletas, posicoes, status and scouts share a single
+        download of the mercado endpoint."""
+        mock_get.return_value = {
+            "atletas": [],
+            "posicoes": {"4": {"id": 4, "nome": "Meia", "abreviacao": "mei"}},
+            "status": {"3": {"id": 3, "nome": "Suspenso"}}}
+
+        self.client.atletas()
+        self.client.posicoes()
+        self.client.status()
+        self.client.scouts()
+
+        mock_get.assert_called_once_with(
+            'https://api.cartolafc.globo.com/atletas/mercado')
+
+        self.client.mercado(refresh=True)
+        self.assertEqual(2, mock_get.call_count)
+
+    def test_session_reused(self):
+        """Test that the client keeps a single pooled session."""
+        self.assertIsInstance(self.client.session, requests.Session)
+        session = self.client.session
+        with mock.patch.object(session, 'get') as mock_get:
+            mock_get.return_value.json.return_value = {}
+            self.client._get('http://api.spam.com/eggs/')
+            self.client._get('http://api.spam.com/sausage/')
+        self.assertEqual(2, mock_get.call_count)
+        self.assertIs(session, self.client.session)
+
+
+class StubCartolaHandler(BaseHTTPRequestHandler):
+    """Serves partidas/{rodada} responses after a fixed delay"""
+    delay = 0.3
+
+    def do_GET(self):
+        time.sleep(self.delay)
+        rodada = int(self.path.rstrip('/').split('/')[-1])
+        body = json.dumps({
+            "rodada": rodada,
+            "partidas": [{
+                'clube_casa_id': 262,
+                'clube_visitante_id': 263,
+                'clube_casa_posicao': 4,
+                'clube_visitante_posicao': 7,
+                'aproveitamento_mandante': ['v', 'd', 'e', 'e', 'v'],
+                'aproveitamento_visitante': ['e', 'v', 'v', 'e', 'e'],
+                'placar_oficial_mandante': 0,
+                'placar_oficial_visitante': 0,
+                'partida_data': '2017-06-04 11:00:00',
+                'local': 'Raulino de Oliveira',
+                'valida': True,
+                'url_confronto': ''}]}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubCartolaServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class AsyncCartolafcAPIClientTests(TestCase):
+    def setUp(self):
+        Clube.objects.create(id=262, nome='Flamengo', abreviacao='FLA')
+        Clube.objects.create(id=263, nome='Botafogo', abreviacao='BOT')
+        self.server = StubCartolaServer(('127.0.0.1', 0), StubCartolaHandler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.client = AsyncCartolafcAPIClient(concurrency=8)
+        self.client.base_url = 'http://127.0.0.1:{}/'.format(
+            self.server.server_address[1])
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_partidas_many(self):
+        """Test fetching many rodadas at once against a stub server."""
+        rodadas = range(1, 9)
+
+        start = time.time()
+        output = self.client.partidas_many(rodadas)
+        elapsed = time.time() - start
+
+        self.assertEqual(sorted(output), list(rodadas))
+        for rodada, partida_list in output.items():
+            self.assertEqual(1, len(partida_list))
+            self.assertEqual(rodada, partida_list[0].rodada)
+            self.assertEqual(262, partida_list[0].clube_casa.id)
+        # eight requests of 0.3s each, all in flight at the same time
+        self.assertLess(elapsed, 8 * StubCartolaHandler.delay / 2)
+
+    def test_get_many_concurrency_limit(self):
+        """Test that no more than 'concurrency' requests are in flight."""
+        self.client = AsyncCartolafcAPIClient(concurrency=2)
+        in_flight = []
+        peak = []
+        lock = threading.Lock()
+
+        def fake_get(url):
+            with lock:
+                in_flight.append(url)
+                peak.append(len(in_flight))
+            time.sleep(0.05)
+            with lock:
+                in_flight.remove(url)
+            return url
+
+        with mock.patch.object(self.client, '_get', side_effect=fake_get):
+            urls = ['http://api.spam.com/{}'.format(i) for i in range(6)]
+            output = self.client.get_many(urls)
+
+        self.assertEqual(output, urls)
+        self.assertEqual(2, max(peak))
+
+
+SAMPLE_CSV_DIR = os.path.join(os.path.dirname(__file__), 'sample_csv')
+
 
 class CartolaCsvReaderTests(TestCase):
     def setUp(self):
         self.csv_reader = CartolaCsvReader()
-        Clube.objects.create(
-            id=262, nome='Flamengo', abreviacao='FLA',
-            escudo_30x30='https://s.glbimg.com/es/sde/f/equipes/2013/12/16/flamengo_30x30.png',
-            escudo_45x45='https://s.glbimg.com/es/sde/f/equipes/2013/12/16/flamengo_45x45.png',
-            escudo_60x60='https://s.glbimg.com/es/sde/f/equipes/2014/04/14/flamengo_60x60.png')
-        Clube.objects.create(
-            id=263, nome='Botafogo', abreviacao='BOT',
-            escudo_30x30='https://s.glbimg.com/es/sde/f/equipes/2013/12/16/botafogo_30x30.png',
-            escudo_45x45='https://s.glbimg.com/es/sde/f/equipes/2013/12/16/botafogo_45x45.png',
-            escudo_60x60='https://s.glbimg.com/es/sde/f/equipes/2014/04/14/botafogo_60x60.png')
 
-    @mock.patch('core.services.csv.reader')
-    def test_partidas(self, mock_read_csv):
-        csv_path = '/sample_csv/partidas.csv'
-        with open(csv_path) as csvfile:
-            expected_reader = csv.reader(csvfile)
+    def test_partidas(self):
+        """Test reading a list of Partida from a 2017 csv file."""
+        csv_path = os.path.join(SAMPLE_CSV_DIR, 'partidas.csv')
 
-        clube_casa = Clube.objects.get(pk=262)
-        clube_visitante = Clube.objects.get(pk=263)
-        expected_output = [Partida(
-            clube_casa=clube_casa,
-            clube_visitante=clube_visitante,
-            clube_casa_posicao=4,
-            clube_visitante_posicao=7,
-            aproveitamento_mandante="vdeev",
-            aproveitamento_visitante="evvee",
-            placar_oficial_mandante=0,
-            placar_oficial_visitante=0,
-            partida_data=datetime(year=2017, month=6, day=4, hour=11),
-            local='Raulino de Oliveira',
-            valida=True,
-            url_confronto='http://globoesporte.globo.com/rj/futebol/brasileirao-serie-a/jogo/04-06-2017/flamengo-botafogo',
-            rodada=4)]
+        output = list(self.csv_reader.partidas(csv_path, 2017))
 
-        expected_path = 'spam/eggs'
-        mock_read_csv.return_value = expected_reader
+        self.assertEqual(1, len(output))
+        self.assertEqual(262, output[0].clube_casa_id)
+        self.assertEqual(263, output[0].clube_visitante_id)
+        self.assertEqual('evee', output[0].aproveitamento_mandante)
+        self.assertEqual(4, output[0].rodada)
+        self.assertEqual(datetime(year=2017, month=6, day=4, hour=11),
+                         output[0].partida_data)
 
-        output = self.csv_reader.partidas(expected_path)
+    def test_partidas_without_dates(self):
+        """Test that Partida of seasons without dates fall on January 1st
+        of the season."""
+        csv_path = os.path.join(SAMPLE_CSV_DIR, 'seasons', '2014',
+                                'Partidas.csv')
 
-        mock_read_csv.assert_called_once_with(expected_path)
-        self.assertEqual(1, mock_read_csv.call_count)
-        self.assertEqual(output[0].clube_casa, expected_output[0].clube_casa)
+        output = list(self.csv_reader.partidas(csv_path, 2014))
+
+        self.assertEqual([179872, 179884], [p.id for p in output])
+        self.assertEqual(datetime(year=2014, month=1, day=1),
+                         output[0].partida_data)
+        self.assertEqual(2, output[1].placar_oficial_mandante)
+
+    def test_scouts(self):
+        """Test reading Scout from both the 2014 and the 2017 layouts."""
+        season_dir = os.path.join(SAMPLE_CSV_DIR, 'seasons')
+
+        output_2014 = list(self.csv_reader.scouts(
+            os.path.join(season_dir, '2014', 'Scouts.csv'), 2014))
+        output_2017 = list(self.csv_reader.scouts(
+            os.path.join(season_dir, '2017', 'scouts.csv'), 2017))
+
+        # rodada 0 and rows without a club are skipped
+        self.assertEqual(3, len(output_2014))
+        self.assertEqual(4, len(output_2017))
+        self.assertEqual(262, output_2014[0].clube_id)
+        self.assertEqual(7, output_2014[0].status_id)
+        self.assertEqual(1, output_2014[0].scouts_SG)
+        self.assertEqual(2, output_2017[1].scouts_DD)
+        self.assertEqual(2, output_2017[2].status_id)
+
+
+class SnapshotDirMixin():
+    """Writes the snapshots of a test to a temporary SNAPSHOT_DIR"""
+
+    def setUp(self):
+        super().setUp()
+        self.snapshot_dir = tempfile.mkdtemp()
+        snapshot_settings = self.settings(SNAPSHOT_DIR=self.snapshot_dir)
+        snapshot_settings.enable()
+        self.addCleanup(snapshot_settings.disable)
+        self.addCleanup(shutil.rmtree, self.snapshot_dir)
+
+
+class CartolaCsvImporterTests(SnapshotDirMixin, TestCase):
+    def test_import(self):
+        """Test importing every season in chunks, twice."""
+        data_dir = os.path.join(SAMPLE_CSV_DIR, 'seasons')
+        importer = CartolaCsvImporter(data_dir, chunk_size=2)
+
+        result = importer.run()
+
+        # 2017 fills in the full names of the 2014 athletes
+        self.assertEqual((2, 2), result['Atleta'])
+        self.assertEqual((4, 0), result['Partida'])
+        self.assertEqual((7, 0), result['Scout'])
+        self.assertEqual(6, Posicao.objects.count())
+        self.assertEqual(1.7, Pontuacao.objects.get(abreviacao='RB').pontuacao)
+        self.assertEqual(
+            'Felipe Alves Raymundo', Atleta.objects.get(pk=37958).nome)
+        scout = Scout.objects.get(atleta=37958, rodada=2,
+                                  temporada=2017)
+        self.assertEqual(263, scout.partida.clube_casa_id)
         self.assertEqual(
-            output[0].partida_data, expected_output[0].partida_data)
+            3, Scout.objects.filter(temporada=2014).count())
 
+        result = CartolaCsvImporter(data_dir).run(anos=[2017])
 
+        self.assertEqual((0, 0), result['Scout'])
+        self.assertEqual(7, Scout.objects.count())
 
+    def test_import_keeps_nome(self):
+        """Test that importing a season without a nome column again keeps
+        the full names of its athletes."""
+        data_dir = os.path.join(SAMPLE_CSV_DIR, 'seasons')
+        CartolaCsvImporter(data_dir).run()
+
+        result = CartolaCsvImporter(data_dir).run(anos=[2014])
+
+        self.assertEqual((0, 0), result['Atleta'])
+        self.assertEqual(
+            'Felipe Alves Raymundo', Atleta.objects.get(pk=37958).nome)
+        self.assertEqual('Felipe', Atleta.objects.get(pk=37958).apelido)
+
+    def test_import_parallel(self):
+        """Test that parsing seasons in worker processes writes the same
+        rows as the serial import."""
+        data_dir = os.path.join(SAMPLE_CSV_DIR, 'seasons')
+
+        result = CartolaCsvImporter(data_dir, chunk_size=2).run(jobs=2)
+
+        self.assertEqual((2, 2), result['Atleta'])
+        self.assertEqual((4, 0), result['Partida'])
+        self.assertEqual((7, 0), result['Scout'])
+        self.assertEqual(
+            'Felipe Alves Raymundo', Atleta.objects.get(pk=37958).nome)
+
+    def test_find_season_files(self):
+        """Test finding the files of both the data/ and the data/kaggle/
+        layouts."""
+        data_dir = os.path.join(os.path.dirname(SAMPLE_CSV_DIR), os.pardir,
+                                'data', 'kaggle')
+
+        seasons = find_season_files(data_dir)
+
+        self.assertEqual([2014, 2015, 2016, 2017], list(seasons))
+        self.assertEqual(
+            os.path.join(data_dir, '2015_scouts.csv'), seasons[2015]['scouts'])
+        self.assertEqual(set(TABLES), set(seasons[2017]))
 
 
+class BulkUpsertTests(TestCase):
+    def setUp(self):
+        Status.objects.create(id=2, nome='Dúvida')
+        Status.objects.create(id=3, nome='Suspenso')
 
+    def test_bulk_upsert(self):
+        """Test that bulk_upsert creates new rows, updates changed rows and
+        leaves unchanged rows alone, in a fixed number of queries."""
+        status_list = [
+            Status(id=2, nome='Dúvida'),
+            Status(id=3, nome='Contundido'),
+            Status(id=7, nome='Provável')]
 
+        # select, savepoint, insert, update, release savepoint
+        with self.assertNumQueries(5):
+            created, updated = bulk_upsert(Status, status_list, ('id',))
 
+        self.assertEqual((1, 1), (created, updated))
+        self.assertEqual(
+            ['Dúvida', 'Contundido', 'Provável'],
+            list(Status.objects.order_by('id').values_list('nome', flat=True)))
+
+        self.assertEqual((0, 0), bulk_upsert(Status, status_list, ('id',)))
+
+
+def fake_api_get(url):
+    """Answers CartolafcAPIClient._get with a tiny two-club season"""
+    ano = datetime.now().year
+    clubes = {
+        "262": {"id": 262, "nome": "Flamengo", "abreviacao": "FLA",
+                "escudos": {"60x60": "", "45x45": "", "30x30": ""}},
+        "263": {"id": 263, "nome": "Botafogo", "abreviacao": "BOT",
+                "escudos": {"60x60": "", "45x45": "", "30x30": ""}}}
+    if url.endswith('atletas/mercado'):
+        return {
+            "atletas": [{
+                "nome": "Diego Alves Carreira", "apelido": "Diego Alves",
+                "foto": "", "atleta_id": 37656 + i, "rodada_id": 4,
+                "clube_id": 262 + i % 2, "posicao_id": 1, "status_id": 7,
+                "pontos_num": 2.0, "preco_num": 10.0, "variacao_num": 1.0,
+                "media_num": 2.0, "jogos_num": 3, "scout": {"DD": i}}
+                for i in range(4)],
+            "clubes": clubes,
+            "posicoes": {"1": {"id": 1, "nome": "Goleiro",
+                               "abreviacao": "gol"}},
+            "status": {"7": {"id": 7, "nome": "Provável"}}}
+    rodada = int(url.rstrip('/').split('/')[-1])
+    return {
+        "rodada": rodada,
+        "clubes": clubes,
+        "partidas": [{
+            'clube_casa_id': 262,
+            'clube_visitante_id': 263,
+            'clube_casa_posicao': 4,
+            'clube_visitante_posicao': 7,
+            'aproveitamento_mandante': ['v', 'd', 'e', 'e', 'v'],
+            'aproveitamento_visitante': ['e', 'v', 'v', 'e', 'e'],
+            'placar_oficial_mandante': 0,
+            'placar_oficial_visitante': 0,
+            'partida_data': '{}-06-04 11:00:00'.format(ano),
+            'local': 'Raulino de Oliveira',
+            'valida': True,
+            'url_confronto': ''}]}
+
+
+class SyncCartolaCommandTests(SnapshotDirMixin, TestCase):
+    @mock.patch('core.services.CartolafcAPIClient._get',
+                side_effect=fake_api_get)
+    def test_sync_cartola(self, mock_get):
+        """Test that the sync_cartola command upserts every model and that
+        running it again with the same mercado is a no-op."""
+        out = StringIO()
+        call_command('sync_cartola', stdout=out)
+
+        self.assertEqual(2, Clube.objects.count())
+        self.assertEqual(4, Partida.objects.count())
+        self.assertEqual(4, Atleta.objects.count())
+        self.assertEqual(4, Scout.objects.count())
+        self.assertIn('Scout: 4 created, 0 updated', out.getvalue())
+        self.assertEqual(4, SyncState.objects.get(
+            endpoint='partidas/{}/4'.format(datetime.now().year)).rodada)
+
+        mock_get.reset_mock()
+        out = StringIO()
+        call_command('sync_cartola', '--batch-size', '2', stdout=out)
+
+        self.assertEqual('Mercado unchanged, nothing to sync\n',
+                         out.getvalue())
+        mock_get.assert_called_once_with(
+            'https://api.cartolafc.globo.com/atletas/mercado')
 
+    @mock.patch('core.services.CartolafcAPIClient._get')
+    def test_sync_cartola_incremental(self, mock_get):
+        """Test that only the rodadas after the watermark are fetched and
+        only changed responses are written."""
+        mock_get.side_effect = fake_api_get
+        call_command('sync_cartola', stdout=StringIO())
+
+        def next_rodada_get(url):
+            response = fake_api_get(url)
+            if url.endswith('atletas/mercado'):
+                for atleta in response['atletas']:
+                    atleta['rodada_id'] = 5
+                response['atletas'][0]['pontos_num'] = 9.0
+            return response
+
+        mock_get.reset_mock()
+        mock_get.side_effect = next_rodada_get
+        out = StringIO()
+        call_command('sync_cartola', stdout=out)
+
+        fetched = sorted(call[0][0] for call in mock_get.call_args_list)
+        self.assertEqual([
+            'https://api.cartolafc.globo.com/atletas/mercado',
+            'https://api.cartolafc.globo.com/partidas/1',
+            'https://api.cartolafc.globo.com/partidas/4',
+            'https://api.cartolafc.globo.com/partidas/5'], fetched)
+        self.assertNotIn('Clube:', out.getvalue())
+        self.assertIn('Partida: 1 created, 0 updated', out.getvalue())
+        self.assertIn('Scout: 4 created, 0 updated', out.getvalue())
+        self.assertEqual(5, Partida.objects.count())
 
+    @mock.patch('core.services.CartolafcAPIClient._get')
+    def test_sync_cartola_placar_changed(self, mock_get):
+        """Test that a rodada rated before its placar changed is rated
+        again."""
+        ano = datetime.now().year
+
+        def placar_get(placar, rodada_id):
+            def get(url):
+                response = fake_api_get(url)
+                if url.endswith('atletas/mercado'):
+                    for atleta in response['atletas']:
+                        atleta['rodada_id'] = rodada_id
+                else:
+                    for partida in response['partidas']:
+                        partida['partida_data'] = '{}-01-01 16:00:00'.format(
+                            ano)
+                        partida['placar_oficial_mandante'] = placar
+                return response
+            return get
+
+        mock_get.side_effect = placar_get(0, 4)
+        call_command('sync_cartola', stdout=StringIO())
+        elo = ClubeRating.objects.get(temporada=ano, rodada=4,
+                                      clube_id=262).elo
+
+        mock_get.side_effect = placar_get(4, 5)
+        call_command('sync_cartola', stdout=StringIO())
+
+        self.assertGreater(ClubeRating.objects.get(
+            temporada=ano, rodada=4, clube_id=262).elo, elo)
+        self.assertTrue(ClubeRating.objects.filter(
+            temporada=ano, rodada=5).exists())
 
+    @mock.patch('core.services.CartolafcAPIClient._get')
+    def test_sync_cartola_placar_null(self, mock_get):
+        """Test that the partidas of the open rodada, without a placar yet,
+        are written but not rated."""
+        ano = datetime.now().year
+
+        def get(url):
+            response = fake_api_get(url)
+            if 'partidas' in response:
+                for partida in response['partidas']:
+                    partida['partida_data'] = '{}-01-01 16:00:00'.format(ano)
+                    if response['rodada'] == 4:
+                        partida['placar_oficial_mandante'] = None
+                        partida['placar_oficial_visitante'] = None
+            return response
+        mock_get.side_effect = get
+
+        call_command('sync_cartola', stdout=StringIO())
+
+        self.assertIsNone(Partida.objects.get(
+            temporada=ano, rodada=4).placar_oficial_mandante)
+        self.assertEqual(4, Scout.objects.count())
+        self.assertEqual([0, 1, 2, 3], list(ClubeRating.objects.filter(
+            temporada=ano).values_list('rodada', flat=True).distinct()
+            .order_by('rodada')))
+
+    @mock.patch('core.services.CartolafcAPIClient._get',
+                side_effect=fake_api_get)
+    def test_sync_cartola_new_temporada(self, mock_get):
+        """Test that the last rodada of the temporada before does not hold
+        back the first sync of a new one."""
+        SyncState.objects.create(
+            endpoint='partidas/{}/38'.format(datetime.now().year - 1),
+            rodada=38, content_hash='')
+
+        out = StringIO()
+        call_command('sync_cartola', stdout=out)
+
+        self.assertEqual(4, Partida.objects.count())
+        self.assertIn('Scout: 4 created, 0 updated', out.getvalue())
+
+    @mock.patch('core.services.CartolafcAPIClient._get',
+                side_effect=fake_api_get)
+    def test_sync_cartola_temporada(self, mock_get):
+        """Test that partidas and scouts are written to the temporada of
+        the sync, whatever the year of the match dates."""
+        ano = datetime.now().year + 1
+        out = StringIO()
+
+        call_command('sync_cartola', '--temporada', str(ano), stdout=out)
+
+        self.assertEqual({ano}, set(Partida.objects.values_list(
+            'temporada', flat=True)))
+        self.assertIn('Scout: 4 created, 0 updated', out.getvalue())
+        self.assertEqual({ano}, set(Scout.objects.values_list(
+            'temporada', flat=True)))
+
+    @mock.patch('core.services.CartolafcAPIClient._get',
+                side_effect=fake_api_get)
+    def test_sync_cartola_missing_partida(self, mock_get):
+        """Test that scouts of a rodada whose partidas were not synced are
+        skipped."""
+        out = StringIO()
+        call_command('sync_cartola', '--rodada', '1', stdout=out)
+
+        self.assertEqual(0, Scout.objects.count())
+        self.assertIn('Scout skipped: 4', out.getvalue())
+
+
+class SeasonDatasetTests(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.data_dir = os.path.join(self.tmp_dir, 'data')
+        self.cache_dir = os.path.join(self.tmp_dir, 'cache')
+        shutil.copytree(os.path.join(SAMPLE_CSV_DIR, 'seasons'),
+                        self.data_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_load_table(self):
+        """Test converting every season into columns and concatenating
+        them."""
+        scouts = load_table('scouts', data_dir=self.data_dir,
+                            cache_dir=self.cache_dir)
+
+        self.assertEqual(7, scouts.num_rows)
+        self.assertEqual([2014] * 3 + [2017] * 4, list(scouts['temporada']))
+        self.assertEqual([1, 1, 2, 1], list(scouts['scouts_DD'][:4]))
+        self.assertEqual(-1.0, scouts['pontos_num'][-1])
+        partidas = load_table('partidas', anos=[2017],
+                              data_dir=self.data_dir, cache_dir=self.cache_dir)
+        self.assertEqual([-1, -1], list(partidas['id']))
+        self.assertEqual('Felipe Alves Raymundo', load_table(
+            'atletas', anos=[2017], data_dir=self.data_dir,
+            cache_dir=self.cache_dir)['nome'][0])
+        self.assertEqual(7, len(scouts.to_frame()))
+
+    def test_cache_rebuilt_on_change(self):
+        """Test that the cache is only rebuilt when a source file's content
+        changes."""
+        dataset = load_seasons([2017], self.data_dir, self.cache_dir)[2017]
+        self.assertEqual(4, dataset.scouts.num_rows)
+        self.assertIsInstance(dataset.scouts['rodada'], np.memmap)
+
+        scouts_path = dataset.files['scouts']
+        os.utime(scouts_path, (0, 0))
+        dataset = SeasonDataset(2017, dataset.files, self.cache_dir)
+        with mock.patch.object(SeasonDataset, 'build') as mock_build:
+            dataset.scouts
+        self.assertEqual(0, mock_build.call_count)
+
+        with open(scouts_path, 'a') as f:
+            f.write('36540,3,263,1,7,1.0,8.0,0.0,0.0,2,'
+                    '0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,1\n')
+        dataset = SeasonDataset(2017, dataset.files, self.cache_dir)
+        self.assertTrue(dataset.is_stale())
+        self.assertEqual(5, dataset.scouts.num_rows)
+        self.assertFalse(dataset.is_stale())
+
+
+def scout_table(rows):
+    """Table of scouts from (temporada, rodada, atleta_id, clube_id,
+    jogos_num, pontos_num, {scout: count}) tuples"""
+    table = Table()
+    for i, name in enumerate(('temporada', 'rodada', 'atleta_id', 'clube_id',
+                              'jogos_num', 'pontos_num')):
+        table[name] = np.array([row[i] for row in rows])
+    for name in SCOUT_COLUMNS:
+        key = name[len('scouts_'):]
+        table[name] = np.array([row[6].get(key, 0) for row in rows])
+    return table
+
+
+class ScoutDeltasTests(TestCase):
+    def test_scout_deltas(self):
+        """Test differencing cumulative scouts per athlete, across skipped
+        rodadas and club changes, leaving per round seasons alone."""
+        scouts = scout_table([
+            (2017, 4, 1, 263, 3, 2.0, {'FS': 5, 'G': 1}),
+            (2017, 1, 1, 262, 1, 3.0, {'FS': 2}),
+            (2014, 1, 1, 262, 0, 1.0, {'FS': 4}),
+            (2017, 2, 1, 262, 2, 4.0, {'FS': 3, 'G': 1}),
+            (2017, 1, 2, 262, 1, 5.0, {'FS': 1}),
+            (2017, 2, 2, 262, 1, 0.0, {'FS': 1}),
+            (2014, 2, 1, 262, 0, 0.0, {}),
+        ])
+
+        deltas = scout_deltas(scouts)
+
+        self.assertEqual([2, 2, 4, 1, 1, 0, 0], list(deltas['scouts_FS']))
+        self.assertEqual([0, 0, 0, 1, 0, 0, 0], list(deltas['scouts_G']))
+        self.assertEqual([True, True, True, True, True, False, False],
+                         list(deltas['jogou']))
+        # the input is left untouched
+        self.assertEqual(5, scouts['scouts_FS'][0])
+
+    def test_scout_deltas_2015(self):
+        """Test that the 2015 scouts csv, which counts games and scouts
+        over the season, is differenced like the mercado."""
+        scouts = scout_table([
+            (2015, 1, 1, 262, 1, 4.0, {'FS': 2, 'G': 1}),
+            (2015, 2, 1, 262, 2, 1.0, {'FS': 3, 'G': 1}),
+            (2015, 3, 1, 262, 2, 0.0, {'FS': 3, 'G': 1}),
+        ])
+
+        deltas = scout_deltas(scouts)
+
+        self.assertEqual([2, 1, 0], list(deltas['scouts_FS']))
+        self.assertEqual([1, 0, 0], list(deltas['scouts_G']))
+        self.assertEqual([True, True, False], list(deltas['jogou']))
+
+    def test_scout_deltas_empty(self):
+        deltas = scout_deltas(scout_table([]))
+        self.assertEqual(0, deltas.num_rows)
+
+
+class TemporadaTests(TestCase):
+    def setUp(self):
+        self.flamengo = Clube.objects.create(id=262, nome='Flamengo',
+                                             abreviacao='FLA')
+        self.botafogo = Clube.objects.create(id=263, nome='Botafogo',
+                                             abreviacao='BOT')
+
+    def create_partida(self, **kwargs):
+        fields = dict(
+            clube_casa=self.flamengo, clube_visitante=self.botafogo,
+            clube_casa_posicao=0, clube_visitante_posicao=0,
+            aproveitamento_mandante='', aproveitamento_visitante='',
+            placar_oficial_mandante=0, placar_oficial_visitante=0,
+            partida_data=datetime(year=2016, month=6, day=4), local='',
+            valida=True, url_confronto='', temporada=2016, rodada=1)
+        fields.update(kwargs)
+        return Partida.objects.create(**fields)
+
+    def test_partida_unique_per_rodada(self):
+        """Test that a club plays a single Partida per rodada."""
+        self.create_partida()
+        self.create_partida(temporada=2017,
+                            partida_data=datetime(year=2017, month=6, day=4))
+        vasco = Clube.objects.create(id=267, nome='Vasco', abreviacao='VAS')
+        with self.assertRaises(IntegrityError):
+            self.create_partida(clube_visitante=vasco)
+
+    def test_set_temporada_migration(self):
+        """Test that the data migration fills in temporada from the year of
+        the Partida."""
+        migration = importlib.import_module('core.migrations.0013_temporada')
+        partida = self.create_partida(temporada=0)
+        Atleta.objects.create(id=1, nome='', apelido='')
+        Posicao.objects.create(id=1, nome='Goleiro', abreviacao='gol')
+        Status.objects.create(id=7, nome='Provável')
+        Scout.objects.create(temporada=0, rodada=1, atleta_id=1,
+                             clube=self.flamengo, posicao_id=1, status_id=7,
+                             partida=partida)
+
+        migration.set_temporada(apps, None)
+
+        self.assertEqual(2016, Partida.objects.get().temporada)
+        self.assertEqual(2016, Scout.objects.get().temporada)
+
+
+class ScoringEngineTests(TestCase):
+    def test_load_pesos(self):
+        """Test reading the weights from the csv file until the Pontuacao
+        table is populated."""
+        self.assertEqual(1.7, load_pesos()['RB'])
+
+        CartolaCsvImporter(os.path.join(SAMPLE_CSV_DIR, 'seasons')
+                           ).import_common()
+        Pontuacao.objects.filter(abreviacao='RB').update(pontuacao=2.0)
+
+        self.assertEqual(2.0, load_pesos()['RB'])
+
+    def test_score(self):
+        """Test scoring per round and cumulative seasons together and
+        flagging rows that disagree with pontos_num."""
+        scouts = scout_table([
+            (2017, 2, 1, 262, 2, 8.5, {'FS': 3, 'G': 1}),
+            (2014, 1, 1, 262, 0, 2.2, {'RB': 1, 'FS': 1}),
+            (2017, 1, 1, 262, 1, 1.0, {'FS': 2}),
+            (2014, 2, 2, 262, 0, 0.0, {'CA': 1}),
+        ])
+        engine = ScoringEngine()
+
+        result = engine.check(scouts)
+
+        np.testing.assert_allclose([8.5, 2.2, 1.0, -2.0],
+                                   result['pontos_calculados'])
+        self.assertEqual([False, False, False, True],
+                         list(result['divergente']))
+        self.assertEqual(0, engine.score(scout_table([])).size)
+
+
+class EscalacaoOptimizerTests(TestCase):
+    def setUp(self):
+        random = np.random.RandomState(42)
+        self.posicao_ids = np.repeat([GOL, ZAG, ATA], [4, 7, 6])
+        self.atleta_ids = np.arange(len(self.posicao_ids)) + 100
+        self.precos = np.round(random.uniform(1, 15, 17), 2)
+        self.pontos = np.round(random.uniform(-2, 10, 17), 1)
+        self.formacoes = {'1-2-1': {GOL: 1, ZAG: 2, ATA: 1}}
+
+    def brute_force(self, cartoletas):
+        picks = [itertools.combinations(
+            np.flatnonzero(self.posicao_ids == posicao_id), k)
+            for posicao_id, k in self.formacoes['1-2-1'].items()]
+        best = None
+        for pick in itertools.product(*picks):
+            index = list(itertools.chain(*pick))
+            if self.precos[index].sum() <= cartoletas + 1e-9:
+                pontos = self.pontos[index].sum()
+                if best is None or pontos > best:
+                    best = pontos
+        return best
+
+    def test_escalar(self):
+        """Test that the optimizer finds the same points as trying every
+        squad, for several budgets."""
+        optimizer = EscalacaoOptimizer(
+            self.atleta_ids, self.posicao_ids, self.precos, self.pontos, 40,
+            self.formacoes)
+        for cartoletas in (13, 15, 20, 30, 40):
+            escalacao = optimizer.solve_formacao('1-2-1', cartoletas * 100)
+
+            self.assertAlmostEqual(self.brute_force(cartoletas),
+                                   escalacao.pontos)
+            self.assertLessEqual(escalacao.preco, cartoletas)
+            index = np.searchsorted(self.atleta_ids, escalacao.atleta_ids)
+            self.assertEqual([GOL, ZAG, ZAG, ATA],
+                             sorted(self.posicao_ids[index]))
+            self.assertAlmostEqual(self.pontos[index].sum(),
+                                   escalacao.pontos)
+
+    def test_escalar_over_budget(self):
+        self.assertIsNone(escalar(self.atleta_ids, self.posicao_ids,
+                                  self.precos, self.pontos, 2,
+                                  self.formacoes))
+
+    def test_escalar_formacoes(self):
+        """Test picking a full squad among every formation."""
+        posicao_ids = np.repeat(np.arange(1, 7), 6)
+        pontos = np.tile(np.arange(6, dtype='f8'), 6)
+
+        escalacao = escalar(np.arange(36), posicao_ids, np.ones(36), pontos,
+                            100)
+
+        # 4-3-3 and 5-3-2 both reach 52 points, the first one is kept
+        self.assertEqual('4-3-3', escalacao.formacao)
+        self.assertEqual(52.0, escalacao.pontos)
+        self.assertEqual(12, len(escalacao.atleta_ids))
+        self.assertEqual(12.0, escalacao.preco)
+
+    def test_escalar_grid(self):
+        """Test solving every (formacao, cartoletas) scenario at once, both
+        in this process and in worker processes."""
+        formacoes = dict(self.formacoes, **{'1-1-2': {GOL: 1, ZAG: 1,
+                                                      ATA: 2}})
+        orcamentos = [2, 15, 25.5, 40]
+
+        grid = escalar_grid(self.atleta_ids, self.posicao_ids, self.precos,
+                            self.pontos, orcamentos, formacoes)
+
+        self.assertEqual(8, grid.num_rows)
+        self.assertEqual((8, 4), grid['atleta_ids'].shape)
+        self.assertEqual([-1] * 4, list(grid['atleta_ids'][0]))
+        for row in range(8):
+            optimizer = EscalacaoOptimizer(
+                self.atleta_ids, self.posicao_ids, self.precos, self.pontos,
+                grid['cartoletas'][row], formacoes)
+            escalacao = optimizer.solve_formacao(grid['formacao'][row])
+            if escalacao is None:
+                self.assertTrue(np.isnan(grid['pontos'][row]))
+                continue
+            self.assertAlmostEqual(escalacao.pontos, grid['pontos'][row])
+            self.assertEqual(
+                list(escalacao.atleta_ids),
+                list(grid['atleta_ids'][row, :len(escalacao.atleta_ids)]))
+
+        parallel = escalar_grid(self.atleta_ids, self.posicao_ids,
+                                self.precos, self.pontos, orcamentos,
+                                formacoes, jobs=2)
+
+        self.assertEqual(list(grid['formacao']), list(parallel['formacao']))
+        np.testing.assert_array_equal(grid['pontos'], parallel['pontos'])
+        np.testing.assert_array_equal(grid['atleta_ids'],
+                                      parallel['atleta_ids'])
+
+    def test_non_dominated(self):
+        precos = np.array([1, 2, 2, 3, 5])
+        pontos = np.array([5.0, 1.0, 6.0, 5.5, 7.0])
+
+        self.assertEqual([0, 2, 4], list(non_dominated(precos, pontos, 1)))
+        self.assertEqual([0, 2, 3, 4],
+                         list(non_dominated(precos, pontos, 2)))
+
+
+class ProjecaoStateTests(TestCase):
+    def setUp(self):
+        self.scouts = scout_table([
+            (2014, 1, 1, 262, 0, 10.0, {'G': 1}),
+            (2014, 1, 2, 263, 0, 0.0, {}),
+            (2014, 2, 1, 262, 0, 4.0, {'FS': 1}),
+            (2014, 2, 2, 263, 0, 6.0, {'SG': 1}),
+        ])
+        self.partidas = Table((
+            ('temporada', np.array([2014, 2014, 2014])),
+            ('rodada', np.array([1, 2, 3])),
+            ('clube_casa_id', np.array([262, 263, 262])),
+            ('clube_visitante_id', np.array([263, 262, 263])),
+        ))
+        self.proxima = self.partidas.take([2])
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_features(self):
+        state = ProjecaoState(n=2).fit(self.scouts, self.partidas)
+
+        features = state.features([1, 2, 3], [262, 263, 262], self.proxima)
+
+        np.testing.assert_allclose([7.0, 6.0, np.nan],
+                                   features['media_ultimos'])
+        np.testing.assert_allclose([10.0, np.nan, np.nan],
+                                   features['media_mando'])
+        self.assertEqual([0, 1, 0], list(features['mando']))
+        # 263 conceded 14 points in 2 games, 262 6 points in 1 game
+        media = 20.0 / 3
+        np.testing.assert_allclose(
+            [(14 + JOGOS_PRIOR * media) / (2 + JOGOS_PRIOR) / media,
+             (6 + JOGOS_PRIOR * media) / (1 + JOGOS_PRIOR) / media],
+            features['fator_adversario'][:2])
+
+        pontos = state.project([1, 2, 3], [262, 263, 262], [7, 2, 7],
+                               self.proxima)
+
+        expected = ((PESO_ULTIMOS * 7.0 + (1 - PESO_ULTIMOS) * 10.0) *
+                    features['fator_adversario'][0])
+        self.assertAlmostEqual(expected, pontos[0])
+        self.assertAlmostEqual(
+            6.0 * features['fator_adversario'][1] * 0.5, pontos[1])
+        self.assertEqual(0, pontos[2])
+
+    def test_update_incrementally(self):
+        """Test that adding a rodada to a saved state gives the same
+        features as fitting every rodada again."""
+        path = os.path.join(self.tmp_dir, 'projecao.npz')
+        rodada_1 = self.scouts['rodada'] == 1
+        ProjecaoState(n=2).fit(self.scouts.take(rodada_1),
+                               self.partidas.take([0])).save(path)
+
+        state = ProjecaoState.load(path)
+        state.update(2014, 2, self.scouts.take(~rodada_1),
+                     self.partidas.take([1]))
+
+        features = state.features([1, 2], [262, 263], self.proxima)
+        expected = ProjecaoState(n=2).fit(
+            self.scouts, self.partidas).features([1, 2], [262, 263],
+                                                 self.proxima)
+        for name in expected:
+            np.testing.assert_allclose(expected[name], features[name])
+        with self.assertRaises(ValueError):
+            state.update(2014, 1, self.scouts.take(rodada_1),
+                         self.partidas.take([0]))
+
+
+class RodadaSimulatorTests(TestCase):
+    def setUp(self):
+        partidas = Table((
+            ('clube_casa_id', np.array([262, 264])),
+            ('clube_visitante_id', np.array([263, 265])),
+        ))
+        self.simulator = RodadaSimulator(
+            [1, 2, 3, 4, 5], [5.0, 3.0, 2.0, 4.0, 1.0],
+            [2.0, 1.0, 3.0, 1.0, 2.0], [262, 262, 263, 264, 266], partidas)
+
+    def test_historico(self):
+        scouts = scout_table([
+            (2014, 1, 1, 262, 0, 10.0, {'G': 1}),
+            (2014, 2, 1, 262, 0, 4.0, {'FS': 1}),
+            (2014, 1, 2, 263, 0, 2.0, {'FS': 1}),
+            (2014, 2, 2, 263, 0, 0.0, {}),
+        ])
+        scouts['posicao_id'] = np.array([5, 5, 5, 5])
+
+        result = historico(scouts)
+
+        self.assertEqual([1, 2], list(result['atleta_id']))
+        self.assertEqual([2, 1], list(result['jogos']))
+        np.testing.assert_allclose([7.0, 2.0], result['media'])
+        # the Posicao has points 10, 4 and 2, a variance of 104 / 9
+        variancia = 104.0 / 9 * SIMULACAO_JOGOS_PRIOR
+        np.testing.assert_allclose(
+            np.sqrt([(2 * 9 + variancia) / (2 + SIMULACAO_JOGOS_PRIOR),
+                     variancia / (1 + SIMULACAO_JOGOS_PRIOR)]),
+            result['desvio'])
+
+    def test_sample(self):
+        """Test that athletes of the same club and partida are correlated
+        and athletes of a club without a partida are not."""
+        samples = self.simulator.sample(50000, np.random.RandomState(0))
+
+        np.testing.assert_allclose([5.0, 3.0, 2.0, 4.0, 1.0],
+                                   samples.mean(axis=0), atol=0.05)
+        np.testing.assert_allclose([2.0, 1.0, 3.0, 1.0, 2.0],
+                                   samples.std(axis=0), rtol=0.02)
+        correlation = np.corrcoef(samples.T)
+        self.assertAlmostEqual(RHO_PARTIDA + RHO_CLUBE, correlation[0, 1],
+                               delta=0.02)
+        self.assertAlmostEqual(RHO_PARTIDA, correlation[0, 2], delta=0.02)
+        self.assertAlmostEqual(0, correlation[0, 3], delta=0.02)
+        self.assertAlmostEqual(0, correlation[0, 4], delta=0.02)
+
+    def test_simulate(self):
+        """Test scoring lineups against the same simulations, in this
+        process and in worker processes."""
+        escalacoes = [[1, 2], [3, 4, -1], [5]]
+
+        totals = self.simulator.simulate(escalacoes, n=30000, seed=1,
+                                         chunk_size=10000)
+
+        self.assertEqual((30000, 3), totals.shape)
+        np.testing.assert_allclose([8.0, 6.0, 1.0], totals.mean(axis=0),
+                                   atol=0.1)
+        parallel = self.simulator.simulate(escalacoes, n=30000, seed=1,
+                                           chunk_size=10000, jobs=2)
+        np.testing.assert_array_equal(totals, parallel)
+        np.testing.assert_allclose(
+            (totals > 7).mean(axis=0),
+            self.simulator.probabilidade(escalacoes, 7, n=30000, seed=1,
+                                         chunk_size=10000))
+
+
+class EstrategiaRegistrada(EstrategiaProjecao):
+    """Records the last rodada known to the state of every pick"""
+
+    def escalar(self, state, mercado, partidas):
+        self.vistas = getattr(self, 'vistas', []) + [
+            (state.temporada, state.rodada, int(mercado['rodada'][0]))]
+        return super().escalar(state, mercado, partidas)
+
+
+class BacktestTests(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.data_dir = os.path.join(self.tmp_dir, 'data')
+        self.cache_dir = os.path.join(self.tmp_dir, 'cache')
+        shutil.copytree(os.path.join(SAMPLE_CSV_DIR, 'seasons'),
+                        self.data_dir)
+        self.estrategia = EstrategiaRegistrada(cartoletas=20,
+                                               formacoes={'gol': {GOL: 1}})
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_backtest(self):
+        """Test replaying every rodada with only the rodadas before it."""
+        result = backtest([self.estrategia], data_dir=self.data_dir,
+                          cache_dir=self.cache_dir)
+
+        self.assertEqual([2014, 2014, 2017, 2017], list(result['temporada']))
+        self.assertEqual([1, 2, 1, 2], list(result['rodada']))
+        # 36540 did not play the 2nd rodada of 2014, and is picked for the
+        # 2nd rodada of 2017 but does not play it
+        self.assertEqual([-1.3, 4.7, 0.0], list(result['pontos'][1:]))
+        self.assertAlmostEqual(12.0, result['preco'][2])
+        self.assertEqual([(None, None, 1), (2014, 1, 2), (2014, 2, 1),
+                          (2017, 1, 2)], self.estrategia.vistas)
+
+        shutil.rmtree(self.cache_dir)
+        parallel = backtest([self.estrategia], data_dir=self.data_dir,
+                            cache_dir=self.cache_dir, jobs=2)
+
+        np.testing.assert_array_equal(result['pontos'], parallel['pontos'])
+
+    def test_backtest_status_anterior(self):
+        """Test that a rodada is picked by the status of the rodada before,
+        the one published after it is played."""
+        scouts_path = os.path.join(self.data_dir, '2017', 'scouts.csv')
+        with open(scouts_path) as f:
+            lines = f.read().splitlines(True)
+        # 36540 is suspended after the 1st rodada, and Provável after the
+        # 2nd one
+        lines[4] = lines[4].replace(',1,2,-1.0,', ',1,3,-1.0,')
+        lines[5] = lines[5].replace(',1,2,-1.0,', ',1,7,-1.0,')
+        with open(scouts_path, 'w') as f:
+            f.writelines(lines)
+
+        result = run_season(2017, self.estrategia, self.data_dir,
+                            self.cache_dir)
+
+        self.assertEqual(6.0, result['pontos'][1])
+
+    def test_backtest_sem_status(self):
+        """Test that the status made up from who played a rodada of 2014 is
+        not used to pick for it."""
+        scouts_path = os.path.join(self.data_dir, '2014', 'Scouts.csv')
+        with open(scouts_path) as f:
+            lines = f.read().splitlines(True)
+        # 37958 does not play the 2nd rodada, 36540 does
+        lines[3] = ('37958,2,262.0,0,1.0,1,0.0,8.0,19.69,0.0,179884.0,0,'
+                    '"",0,"","",0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0\n')
+        lines[5] = ('36540,2,263.0,1,1.0,2,3.0,2.5,10.5,0.5,179884.0,1,'
+                    '1.0,0,1.0,6.0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,1,0,1\n')
+        with open(scouts_path, 'w') as f:
+            f.writelines(lines)
+
+        result = run_season(2014, self.estrategia, self.data_dir,
+                            self.cache_dir)
+
+        # 37958 played the 1st rodada and has the best average
+        self.assertEqual(0.0, result['pontos'][1])
+        self.assertAlmostEqual(19.69, result['preco'][1])
+
+
+class ModeloValorizacaoTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_fit(self):
+        """Test recovering the coefficients of prices that move linearly
+        with the points, ignoring rows of athletes who did not play."""
+        random = np.random.RandomState(0)
+        pontos = random.uniform(-5, 15, 50)
+        scouts = scout_table([(2014, 1, atleta_id, 262, 0, value, {})
+                              for atleta_id, value in enumerate(pontos)])
+        scouts['media_num'] = random.uniform(0, 8, 50)
+        precos = random.uniform(2, 20, 50)
+        variacao = (0.1 + 0.2 * pontos - 0.05 * scouts['media_num'] -
+                    0.08 * precos)
+        variacao[0] = 100
+        scouts['pontos_num'][0] = 0
+        scouts['variacao_num'] = variacao
+        scouts['preco_num'] = precos + variacao
+
+        modelo = ModeloValorizacao.fit(scouts)
+
+        np.testing.assert_allclose([0.1, 0.2, -0.05, -0.08],
+                                   modelo.coeficientes, atol=1e-9)
+        np.testing.assert_allclose(
+            [0.1 + 2 - 0.25 - 0.8],
+            modelo.predict([10.0], [5.0], [10.0]))
+
+    def test_prever_mercado(self):
+        """Test predicting a whole mercado at once, cached per rodada until
+        a sync."""
+        modelo = ModeloValorizacao([0.0, 1.0, 0.0, 0.0])
+
+        result = prever_mercado(2017, 3, [1, 2], [4.0, -1.0], [3.0, 2.0],
+                                [2, 0], [10.0, 5.0], modelo)
+
+        self.assertEqual([1, 2], list(result['atleta_id']))
+        np.testing.assert_allclose([4.0, -1.0], result['variacao'])
+        cached = prever_mercado(2017, 3, [1], [0.0], [0.0], [0], [0.0])
+        self.assertEqual([1, 2], list(cached['atleta_id']))
+        other = prever_mercado(2017, 4, [1], [2.0], [0.0], [0], [0.0],
+                               modelo)
+        np.testing.assert_allclose([2.0], other['variacao'])
+
+        # the mercado of the rodada changed since
+        synced.send(sender=CartolaSync, result={})
+        changed = prever_mercado(2017, 3, [1], [3.0], [3.0], [2], [10.0],
+                                 modelo)
+        np.testing.assert_allclose([3.0], changed['variacao'])
+
+    def test_modelo(self):
+        """Test that the cached model is fitted again once a scouts csv
+        changes, and only then."""
+        data_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, data_dir)
+        shutil.copytree(os.path.join(SAMPLE_CSV_DIR, 'seasons', '2017'),
+                        os.path.join(data_dir, '2017'))
+        cache_dir = os.path.join(data_dir, 'cache')
+
+        with mock.patch.object(ModeloValorizacao, 'fit',
+                               wraps=ModeloValorizacao.fit) as mock_fit:
+            modelo(data_dir, cache_dir)
+            modelo(data_dir, cache_dir)
+            self.assertEqual(1, mock_fit.call_count)
+
+            scouts_path = os.path.join(data_dir, '2017', 'scouts.csv')
+            stat = os.stat(scouts_path)
+            os.utime(scouts_path, (stat.st_atime, stat.st_mtime + 1))
+            modelo(data_dir, cache_dir)
+            self.assertEqual(2, mock_fit.call_count)
+
+            # a sync does not change the csv files
+            synced.send(sender=CartolaSync, result={})
+            modelo(data_dir, cache_dir)
+            self.assertEqual(2, mock_fit.call_count)
+
+
+class ClubeRatingTests(TestCase):
+    def setUp(self):
+        for id, abreviacao in ((262, 'FLA'), (263, 'BOT'), (264, 'COR'),
+                               (265, 'FLU')):
+            Clube.objects.create(id=id, nome=abreviacao,
+                                 abreviacao=abreviacao)
+
+    def create_partida(self, temporada, rodada, casa, visitante, placar,
+                       partida_data=None):
+        return Partida.objects.create(
+            clube_casa_id=casa, clube_visitante_id=visitante,
+            clube_casa_posicao=0, clube_visitante_posicao=0,
+            aproveitamento_mandante='', aproveitamento_visitante='',
+            placar_oficial_mandante=placar[0],
+            placar_oficial_visitante=placar[1],
+            partida_data=partida_data or datetime(temporada, 6, rodada),
+            local='', valida=True, url_confronto='', temporada=temporada,
+            rodada=rodada)
+
+    def create_rodadas(self):
+        self.create_partida(2016, 1, 262, 263, (3, 0))
+        self.create_partida(2016, 1, 264, 265, (1, 1))
+        self.create_partida(2016, 2, 263, 264, (0, 2))
+        self.create_partida(2016, 2, 265, 262, (1, 0))
+        self.create_partida(2017, 1, 262, 264, (2, 1))
+
+    def test_atualizar_ratings(self):
+        """Test rating every rodada, the winners going up."""
+        self.create_rodadas()
+
+        self.assertEqual((20, 0), atualizar_ratings())
+
+        inicio = rating(262, 2016, 1)
+        self.assertEqual(ELO_INICIAL, inicio.elo)
+        self.assertEqual(1.0, inicio.ataque)
+        flamengo = rating(262, 2016, 2)
+        self.assertGreater(flamengo.elo, ELO_INICIAL)
+        self.assertGreater(flamengo.ataque, 1)
+        self.assertLess(flamengo.defesa, 1)
+        self.assertEqual(1, flamengo.jogos)
+        self.assertLess(rating(263, 2016, 3).elo, rating(265, 2016, 3).elo)
+        # ratings regress towards the average between temporadas
+        self.assertLess(abs(rating(262, 2017, 1).elo - ELO_INICIAL),
+                        abs(rating(262, 2016, 3).elo - ELO_INICIAL))
+        self.assertEqual((0, 0), atualizar_ratings())
+
+    def test_atualizar_ratings_incrementally(self):
+        """Test that rating a new rodada gives the same ratings as rating
+        every rodada again, and that unfinished rodadas wait."""
+        self.create_rodadas()
+        self.create_partida(2017, 2, 263, 262, (0, 0),
+                            datetime(2100, 1, 1))
+        atualizar_ratings()
+        antes = dict(ClubeRating.objects.values_list('id', 'elo'))
+        self.assertFalse(ClubeRating.objects.filter(rodada=2,
+                                                    temporada=2017).exists())
+
+        Partida.objects.filter(temporada=2017, rodada=2).update(
+            partida_data=datetime(2017, 6, 2))
+
+        # the stored rows are not read again
+        lidos = []
+
+        def upsert(model, objs, key_fields, queryset=None, **kwargs):
+            lidos.append(queryset.count())
+            return bulk_upsert(model, objs, key_fields, queryset=queryset,
+                               **kwargs)
+        with mock.patch('core.ratings.bulk_upsert', side_effect=upsert):
+            self.assertEqual((4, 0), atualizar_ratings())
+        self.assertEqual([0], lidos)
+        incremental = list(ClubeRating.objects.order_by(
+            'temporada', 'rodada', 'clube').values_list('elo', 'ataque'))
+        self.assertEqual(antes, dict(ClubeRating.objects.filter(
+            id__in=antes).values_list('id', 'elo')))
+        self.assertEqual((24, 0), atualizar_ratings(desde=(2016, 0)))
+        self.assertEqual(incremental, list(ClubeRating.objects.order_by(
+            'temporada', 'rodada', 'clube').values_list('elo', 'ataque')))
+
+
+class SerieStoreTests(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.flamengo = Clube.objects.create(id=262, nome='Flamengo',
+                                             abreviacao='FLA')
+        self.botafogo = Clube.objects.create(id=263, nome='Botafogo',
+                                             abreviacao='BOT')
+        Posicao.objects.create(id=5, nome='Atacante', abreviacao='ata')
+        Status.objects.create(id=7, nome='Provável')
+        for id in (1, 2):
+            Atleta.objects.create(id=id, nome='', apelido='')
+        self.partida = Partida.objects.create(
+            clube_casa=self.flamengo, clube_visitante=self.botafogo,
+            clube_casa_posicao=0, clube_visitante_posicao=0,
+            aproveitamento_mandante='', aproveitamento_visitante='',
+            placar_oficial_mandante=0, placar_oficial_visitante=0,
+            partida_data=datetime(2016, 6, 4), local='', valida=True,
+            url_confronto='', temporada=2016, rodada=1)
+        self.create_scout(2016, 1, 1, 10.0, 4.5)
+        self.create_scout(2016, 2, 1, 10.5, -1.0)
+        self.create_scout(2016, 2, 2, 3.0, 2.0)
+        SyncState.objects.create(endpoint='atletas/mercado', rodada=2,
+                                 content_hash='a')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def create_scout(self, temporada, rodada, atleta_id, preco, pontos):
+        return Scout.objects.create(
+            temporada=temporada, rodada=rodada, atleta_id=atleta_id,
+            clube=self.flamengo, posicao_id=5, status_id=7,
+            partida=self.partida, preco_num=preco, pontos_num=pontos)
+
+    def test_serie(self):
+        """Test the series of an athlete, skipping the rodadas it was not in
+        the mercado."""
+        store = SerieStore.open(self.tmp_dir)
+
+        serie = store.serie(1)
+        self.assertEqual([2016, 2016], serie['temporada'].tolist())
+        self.assertEqual([1, 2], serie['rodada'].tolist())
+        self.assertEqual([10.0, 10.5], serie['preco_num'].tolist())
+        self.assertEqual([-1.0], store.serie(1, ultimas=1)[
+            'pontos_num'].tolist())
+        self.assertEqual([2], store.serie(2)['rodada'].tolist())
+        self.assertEqual(0, store.serie(3).num_rows)
+
+    def test_janela(self):
+        """Test the window of many athletes, NaN where they have no row."""
+        store = SerieStore.open(self.tmp_dir)
+
+        janela = store.janela([2, 3, 1], ultimas=5)
+        pontos = janela['pontos_num']
+        self.assertEqual((3, 2), pontos.shape)
+        self.assertTrue(np.isnan(pontos[0, 0]))
+        self.assertEqual(2.0, pontos[0, 1])
+        self.assertTrue(np.isnan(pontos[1]).all())
+        self.assertEqual([4.5, -1.0], pontos[2].tolist())
+        self.assertEqual([10.5], store.janela([1], ultimas=1)[
+            'preco_num'][0].tolist())
+
+    def test_open_incrementally(self):
+        """Test that a saved store is mapped as is until a sync, and then
+        reads only the rodadas from the last stored one."""
+        SerieStore.open(self.tmp_dir)
+        self.create_scout(2016, 3, 2, 4.0, 7.0)
+        store = SerieStore.open(self.tmp_dir)
+        self.assertIsInstance(store.values['preco_num'], np.memmap)
+        self.assertEqual([2], store.serie(2)['rodada'].tolist())
+
+        synced.send(sender=CartolaSync, result={})
+        # the versao, the rows from rodada 2 and the signatures of the
+        # rows before rodadas 2 and 3
+        with self.assertNumQueries(4):
+            store = SerieStore.open(self.tmp_dir)
+        self.assertEqual([2, 3], store.serie(2)['rodada'].tolist())
+        self.assertEqual(4.5, store.serie(1)['pontos_num'][0])
+
+        store = SerieStore.open(self.tmp_dir)
+        self.assertEqual([7.0], store.serie(2, ultimas=1)[
+            'pontos_num'].tolist())
+
+    def test_open_older_price_changed(self):
+        """Test that a price rewritten in a rodada before the last stored
+        one is read again."""
+        SerieStore.open(self.tmp_dir)
+
+        Scout.objects.filter(rodada=1, atleta_id=1).update(preco_num=11.0)
+        synced.send(sender=CartolaSync, result={})
+        store = SerieStore.open(self.tmp_dir)
+
+        self.assertEqual([11.0, 10.5], store.serie(1)['preco_num'].tolist())
+
+    def test_open_after_import(self):
+        """Test that the seasons of an import are read, even the ones
+        before the last stored rodada."""
+        SerieStore.open(self.tmp_dir)
+
+        CartolaCsvImporter(os.path.join(SAMPLE_CSV_DIR, 'seasons')).run()
+        store = SerieStore.open(self.tmp_dir)
+
+        self.assertEqual([2014, 2014, 2017, 2017], store.serie(37958)[
+            'temporada'].tolist())
+        self.assertEqual([10.0, 10.5], store.serie(1)['preco_num'].tolist())
+
+
+class SimilaridadeIndexTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.flamengo = Clube.objects.create(id=262, nome='Flamengo',
+                                             abreviacao='FLA')
+        self.partida = Partida.objects.create(
+            clube_casa=self.flamengo, clube_visitante=self.flamengo,
+            clube_casa_posicao=0, clube_visitante_posicao=0,
+            aproveitamento_mandante='', aproveitamento_visitante='',
+            placar_oficial_mandante=0, placar_oficial_visitante=0,
+            partida_data=datetime(2017, 6, 4), local='', valida=True,
+            url_confronto='', temporada=2017, rodada=1)
+        Posicao.objects.create(id=4, nome='Meia', abreviacao='mei')
+        Posicao.objects.create(id=5, nome='Atacante', abreviacao='ata')
+        Status.objects.create(id=7, nome='Provável')
+        Status.objects.create(id=5, nome='Contundido')
+        for id in range(1, 7):
+            Atleta.objects.create(id=id, nome='', apelido='')
+
+    def create_scout(self, rodada, atleta_id, posicao_id, preco, jogos,
+                     status_id=7, **scouts):
+        return Scout.objects.create(
+            temporada=2017, rodada=rodada, atleta_id=atleta_id,
+            clube=self.flamengo, posicao_id=posicao_id, status_id=status_id,
+            partida=self.partida, preco_num=preco, jogos_num=jogos,
+            **scouts)
+
+    def create_rodada(self):
+        # cumulative scouts, as in the mercado
+        self.create_scout(1, 1, 5, 15.0, 2, scouts_G=2, scouts_FD=2)
+        self.create_scout(1, 2, 5, 8.0, 4, scouts_G=4, scouts_FD=4)
+        self.create_scout(1, 3, 5, 5.0, 2, scouts_G=2, scouts_FD=2,
+                          scouts_FC=6)
+        self.create_scout(1, 4, 5, 4.0, 2, scouts_FC=4, scouts_CA=2)
+        self.create_scout(1, 5, 4, 3.0, 2, scouts_G=2, scouts_FD=2)
+        self.create_scout(1, 6, 5, 3.0, 0)
+
+    def test_taxas(self):
+        """Test that rates are per game played, whatever the season
+        stores."""
+        self.create_rodada()
+        self.create_scout(2, 1, 5, 14.0, 3, status_id=5, scouts_G=4,
+                          scouts_FD=2)
+        per_round = load_scouts(2017)
+        per_round['temporada'][:] = 2016
+
+        result = taxas(load_scouts(2017))
+
+        self.assertEqual([3, 4, 2, 2, 2, 0], result['jogos'].tolist())
+        g = SCOUT_COLUMNS.index('scouts_G')
+        self.assertAlmostEqual(4 / 3.0, result['taxas'][0, g])
+        self.assertEqual(1.0, result['taxas'][1, g])
+        self.assertEqual(5, result['status_id'][0])
+        self.assertEqual(14.0, result['preco_num'][0])
+        # per round rows are added up over the rodadas played
+        result = taxas(per_round)
+        self.assertEqual([2, 1, 1, 1, 1, 0], result['jogos'].tolist())
+        self.assertEqual(3.0, result['taxas'][0, g])
+
+    def test_similares(self):
+        """Test the most similar cheaper athletes of the same Posicao."""
+        self.create_rodada()
+        index = SimilaridadeIndex(taxas(load_scouts(2017)))
+
+        similares = index.similares(1, k=2)
+        self.assertEqual([2, 3], similares['atleta_id'].tolist())
+        self.assertAlmostEqual(1.0, similares['similaridade'][0], places=5)
+        self.assertEqual([3, 4], index.similares(
+            1, k=5, preco_max=6)['atleta_id'].tolist())
+        self.assertEqual([], index.similares(
+            1, preco_max=6, status_ids=[5])['atleta_id'].tolist())
+        # athletes who have not played are not in the index
+        self.assertEqual(0, index.similares(6).num_rows)
+        self.assertEqual(0, index.similares(5).num_rows)
+
+    def test_indice(self):
+        """Test that the cached index is built again only once a new rodada
+        is ingested."""
+        self.create_rodada()
+        self.assertNotIn(5, indice().similares(1)['atleta_id'].tolist())
+        with self.assertNumQueries(1):
+            indice()
+
+        # the meia plays as atacante in the new rodada
+        self.create_scout(2, 5, 5, 3.0, 2, scouts_G=2, scouts_FD=2)
+        with self.assertNumQueries(2):
+            self.assertEqual({2, 5}, set(indice().similares(
+                1, k=2)['atleta_id'].tolist()))
+
+
+class ClubesViewTests(SnapshotDirMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        for id, abreviacao in ((262, 'FLA'), (263, 'BOT'), (264, 'COR')):
+            Clube.objects.create(id=id, nome=abreviacao,
+                                 abreviacao=abreviacao)
+        self.create_partida(2016, 264, 263)
+        self.create_partida(2017, 263, 262)
+
+    def create_partida(self, temporada, casa, visitante):
+        return Partida.objects.create(
+            clube_casa_id=casa, clube_visitante_id=visitante,
+            clube_casa_posicao=0, clube_visitante_posicao=0,
+            aproveitamento_mandante='', aproveitamento_visitante='',
+            placar_oficial_mandante=0, placar_oficial_visitante=0,
+            partida_data=datetime(temporada, 6, 4), local='', valida=True,
+            url_confronto='', temporada=temporada, rodada=1)
+
+    def test_clubes(self):
+        """Test that the clubs of the current temporada are served from the
+        database, and then from the cache after reading the versao."""
+        response = self.client.get(reverse('core:clubes'))
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(b'FLA, BOT', response.content)
+        self.assertTrue(response.has_header('ETag'))
+        self.assertTrue(response.has_header('Last-Modified'))
+
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('core:clubes'))
+        self.assertEqual(b'FLA, BOT', response.content)
+
+    def test_clubes_not_modified(self):
+        """Test that repeat clients get a 304 until a sync changes the
+        data."""
+        etag = self.client.get(reverse('core:clubes'))['ETag']
+
+        response = self.client.get(reverse('core:clubes'),
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(304, response.status_code)
+
+        self.create_partida(2017, 264, 263)
+        response = self.client.get(reverse('core:clubes'),
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(304, response.status_code)
+
+        synced.send(sender=CartolaSync, result={})
+        response = self.client.get(reverse('core:clubes'),
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(b'FLA, BOT, COR', response.content)
+
+    @mock.patch('core.services.CartolafcAPIClient._get',
+                side_effect=fake_api_get)
+    def test_sync_invalidates(self, mock_get):
+        """Test that a sync renders the view again."""
+        self.client.get(reverse('core:clubes'))
+
+        call_command('sync_cartola', stdout=StringIO())
+
+        with self.assertNumQueries(3):
+            self.client.get(reverse('core:clubes'))
+
+    def test_invalidated_by_another_process(self):
+        """Test that an import run by another process, with a cache of its
+        own, renders the view of this one again."""
+        Partida.objects.filter(temporada=2017).delete()
+        response = self.client.get(reverse('core:clubes'))
+        self.assertEqual(b'BOT, COR', response.content)
+
+        other_process = LocMemCache('other-process', {})
+        with mock.patch('core.views.cache', other_process):
+            CartolaCsvImporter(os.path.join(
+                SAMPLE_CSV_DIR, 'seasons')).run(anos=[2017])
+
+        response = self.client.get(reverse('core:clubes'),
+                                   HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(b'FLA, BOT', response.content)
+
+
+class ApiTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        versao()
+        for id, abreviacao in ((262, 'FLA'), (263, 'BOT'), (264, 'COR'),
+                               (265, 'FLU')):
+            Clube.objects.create(id=id, nome=abreviacao,
+                                 abreviacao=abreviacao)
+        Posicao.objects.create(id=1, nome='Goleiro', abreviacao='gol')
+        Posicao.objects.create(id=5, nome='Atacante', abreviacao='ata')
+        Status.objects.create(id=7, nome='Provável')
+        for id in range(1, 6):
+            Atleta.objects.create(id=id, nome='', apelido='A{}'.format(id))
+        for rodada in (1, 2):
+            partida = self.create_partida(rodada, 262, 263)
+            self.create_partida(rodada, 264, 265)
+            for atleta_id in range(1, 6):
+                Scout.objects.create(
+                    temporada=2017, rodada=rodada, atleta_id=atleta_id,
+                    clube_id=262 if atleta_id < 4 else 263,
+                    posicao_id=1 if atleta_id == 1 else 5, status_id=7,
+                    partida=partida, pontos_num=atleta_id)
+
+    def create_partida(self, rodada, casa, visitante):
+        return Partida.objects.create(
+            clube_casa_id=casa, clube_visitante_id=visitante,
+            clube_casa_posicao=0, clube_visitante_posicao=0,
+            aproveitamento_mandante='', aproveitamento_visitante='',
+            placar_oficial_mandante=0, placar_oficial_visitante=0,
+            partida_data=datetime(2017, 6, rodada), local='', valida=True,
+            url_confronto='', temporada=2017, rodada=rodada)
+
+    def get(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('application/json', response['Content-Type'])
+        return json.loads(response.content.decode('utf-8'))
+
+    def test_scouts(self):
+        """Test listing a rodada of scouts a page at a time, one query per
+        page besides the versao."""
+        url = reverse('core:api-scouts')
+        with self.assertNumQueries(2):
+            page = self.get(url, rodada=2, posicao=5, limit=2)
+        self.assertEqual([2.0, 3.0],
+                         [row['pontos_num'] for row in page['results']])
+        self.assertEqual('A2', page['results'][0]['apelido'])
+        self.assertEqual(0, page['results'][0]['scouts_G'])
+
+        results = page['results']
+        while page['next']:
+            with self.assertNumQueries(2):
+                response = self.client.get(page['next'])
+            page = json.loads(response.content.decode('utf-8'))
+            results.extend(page['results'])
+        self.assertEqual([2, 3, 4, 5],
+                         [row['atleta_id'] for row in results])
+        self.assertEqual({2}, {row['rodada'] for row in results})
+
+        self.assertEqual(6, len(self.get(url, clube=262)['results']))
+
+    def test_partidas(self):
+        """Test that the clube filter matches both sides of a Partida."""
+        page = self.get(reverse('core:api-partidas'), clube=263)
+
+        self.assertEqual([1, 2], [row['rodada'] for row in page['results']])
+        self.assertEqual('2017-06-01T00:00:00',
+                         page['results'][0]['partida_data'])
+        self.assertIsNone(page['next'])
+
+    def test_atletas(self):
+        """Test that athletes are listed once, filtered by their scouts."""
+        page = self.get(reverse('core:api-atletas'), clube=262, posicao=5)
+
+        self.assertEqual([2, 3], [row['id'] for row in page['results']])
+        self.assertEqual(5, len(self.get(reverse('core:api-atletas'),
+                                         temporada=2017)['results']))
+
+    def test_invalid_params(self):
+        """Test that non integer parameters are a bad request."""
+        response = self.client.get(reverse('core:api-scouts'),
+                                   {'rodada': 'x'})
+
+        self.assertEqual(400, response.status_code)
+        self.assertEqual({'error': 'rodada must be an integer'},
+                         json.loads(response.content.decode('utf-8')))
+
+
+class ExportSeasonTests(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        flamengo = Clube.objects.create(id=262, nome='Flamengo',
+                                        abreviacao='FLA')
+        partida = Partida.objects.create(
+            clube_casa=flamengo, clube_visitante=flamengo,
+            clube_casa_posicao=0, clube_visitante_posicao=0,
+            aproveitamento_mandante='', aproveitamento_visitante='',
+            placar_oficial_mandante=0, placar_oficial_visitante=0,
+            partida_data=datetime(2017, 6, 4), local='', valida=True,
+            url_confronto='', temporada=2017, rodada=1)
+        Posicao.objects.create(id=5, nome='Atacante', abreviacao='ata')
+        Status.objects.create(id=7, nome='Provável')
+        for atleta_id in range(1, 4):
+            Atleta.objects.create(id=atleta_id, nome='', apelido='')
+            for temporada in (2016, 2017):
+                Scout.objects.create(
+                    temporada=temporada, rodada=1, atleta_id=atleta_id,
+                    clube=flamengo, posicao_id=5, status_id=7,
+                    partida=partida, pontos_num=atleta_id, scouts_G=1)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_export_season(self):
+        """Test that the header comes first and rows follow in chunks."""
+        chunks = export_season(2017, chunk_size=2)
+
+        self.assertEqual(','.join(COLUMNS) + '\n', next(chunks))
+        chunks = list(chunks)
+        self.assertEqual(2, len(chunks))
+        rows = list(csv.DictReader(io.StringIO(
+            ','.join(COLUMNS) + '\n' + ''.join(chunks))))
+        self.assertEqual(['1', '2', '3'], [row['atleta_id'] for row in rows])
+        self.assertEqual(['1'] * 3, [row['G'] for row in rows])
+
+        lines = ''.join(export_season(2017, 'jsonl')).splitlines()
+        self.assertEqual(3, len(lines))
+        self.assertEqual(3.0, json.loads(lines[2])['pontos_num'])
+        with self.assertRaises(ValueError):
+            next(export_season(2017, 'xml'))
+
+    def test_export_view(self):
+        """Test that the endpoint streams the export."""
+        response = self.client.get(reverse(
+            'core:export', kwargs={'temporada': '2017', 'formato': 'csv'}))
+
+        self.assertTrue(response.streaming)
+        self.assertEqual('text/csv', response['Content-Type'])
+        content = b''.join(response.streaming_content).decode('utf-8')
+        self.assertEqual(4, len(content.splitlines()))
+
+    def test_export_season_command(self):
+        """Test that the exported csv is read back by the importer."""
+        path = os.path.join(self.tmp_dir, 'scouts.csv')
+        call_command('export_season', '2017', '--output', path,
+                     '--chunk-size', '2')
+
+        scouts = list(CartolaCsvReader().scouts(path, 2017))
+        self.assertEqual([1, 2, 3], [scout.atleta_id for scout in scouts])
+        self.assertEqual([1, 1, 1], [scout.scouts_G for scout in scouts])
+
+        out = StringIO()
+        call_command('export_season', '2016', '--format', 'jsonl',
+                     stdout=out)
+        self.assertEqual(3, len(out.getvalue().splitlines()))
+
+
+class SnapshotTests(SnapshotDirMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        for id, abreviacao in ((262, 'FLA'), (263, 'BOT'), (264, 'COR'),
+                               (265, 'FLU')):
+            Clube.objects.create(id=id, nome=abreviacao,
+                                 abreviacao=abreviacao)
+        Posicao.objects.create(id=1, nome='Goleiro', abreviacao='gol')
+        Posicao.objects.create(id=5, nome='Atacante', abreviacao='ata')
+        Status.objects.create(id=7, nome='Provável')
+        for id in range(1, 4):
+            Atleta.objects.create(id=id, nome='', apelido='A{}'.format(id))
+        self.create_rodada(1, (262, 263, (2, 0)), (264, 265, (1, 1)))
+        self.create_rodada(2, (263, 264, (0, 1)), (265, 262, (3, 2)))
+
+    def create_rodada(self, rodada, *partidas):
+        for casa, visitante, placar in partidas:
+            partida = Partida.objects.create(
+                clube_casa_id=casa, clube_visitante_id=visitante,
+                clube_casa_posicao=0, clube_visitante_posicao=0,
+                aproveitamento_mandante='', aproveitamento_visitante='',
+                placar_oficial_mandante=placar[0],
+                placar_oficial_visitante=placar[1],
+                partida_data=datetime(2017, 6, rodada), local='',
+                valida=True, url_confronto='', temporada=2017,
+                rodada=rodada)
+        for atleta_id, posicao_id in ((1, 1), (2, 5), (3, 5)):
+            Scout.objects.create(
+                temporada=2017, rodada=rodada, atleta_id=atleta_id,
+                clube_id=262, posicao_id=posicao_id, status_id=7,
+                partida=partida, pontos_num=atleta_id * rodada)
+
+    def get(self, rodada, nome, **extra):
+        return self.client.get(reverse('core:snapshot', kwargs={
+            'temporada': '2017', 'rodada': str(rodada), 'nome': nome}),
+            **extra)
+
+    def test_materializar(self):
+        """Test the aggregates of every rodada, served without queries."""
+        self.assertEqual(2, materializar())
+
+        with self.assertNumQueries(0):
+            response = self.get(2, 'destaques')
+        destaques = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(['1', '5'], sorted(destaques))
+        self.assertEqual([3, 2], [atleta['atleta_id']
+                                  for atleta in destaques['5']])
+        self.assertEqual('A3', destaques['5'][0]['apelido'])
+
+        pontuacao = json.loads(self.get(1, 'pontuacao').content.decode(
+            'utf-8'))
+        self.assertEqual(6.0, pontuacao[0]['pontos_casa'])
+        self.assertEqual(0, pontuacao[0]['pontos_visitante'])
+
+        forma = json.loads(self.get(2, 'forma').content.decode('utf-8'))
+        self.assertEqual(['VD', 'DD', 'EV', 'EV'],
+                         [clube['resultados'] for clube in forma])
+        self.assertEqual([3, 0, 4, 4], [clube['pontos'] for clube in forma])
+
+        self.assertEqual(404, self.get(3, 'forma').status_code)
+
+    def test_gzip(self):
+        """Test that the stored bytes are sent to clients accepting gzip."""
+        materializar()
+
+        response = self.get(1, 'forma', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual('gzip', response['Content-Encoding'])
+        with open(snapshot_path(2017, 1, 'forma'), 'rb') as f:
+            self.assertEqual(f.read(), response.content)
+
+    def test_materializar_incrementally(self):
+        """Test that only the rodadas from the last one written on are
+        written again."""
+        materializar()
+        self.create_rodada(3, (262, 264, (0, 0)))
+
+        self.assertEqual(2, materializar())
+        self.assertEqual(3, materializar(desde=(2017, 0)))
+        self.assertEqual(200, self.get(3, 'forma').status_code)
+
+
+class RankingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        flamengo = Clube.objects.create(id=262, nome='Flamengo',
+                                        abreviacao='FLA')
+        self.partida = Partida.objects.create(
+            clube_casa=flamengo, clube_visitante=flamengo,
+            clube_casa_posicao=0, clube_visitante_posicao=0,
+            aproveitamento_mandante='', aproveitamento_visitante='',
+            placar_oficial_mandante=0, placar_oficial_visitante=0,
+            partida_data=datetime(2017, 6, 4), local='', valida=True,
+            url_confronto='', temporada=2017, rodada=1)
+        Posicao.objects.create(id=1, nome='Goleiro', abreviacao='gol')
+        Posicao.objects.create(id=5, nome='Atacante', abreviacao='ata')
+        Status.objects.create(id=7, nome='Provável')
+        for id in range(1, 5):
+            Atleta.objects.create(id=id, nome='', apelido='A{}'.format(id))
+
+    def create_rodada(self, rodada, pontos, temporada=2017):
+        """Scouts of athletes 1 to 3, atacantes, and 4, a goleiro, scoring
+        'pontos', None for an athlete who did not play"""
+        for atleta_id, atleta_pontos in enumerate(pontos, 1):
+            jogou = atleta_pontos is not None
+            Scout.objects.create(
+                temporada=temporada, rodada=rodada, atleta_id=atleta_id,
+                clube_id=262, posicao_id=1 if atleta_id == 4 else 5,
+                status_id=7, partida=self.partida,
+                pontos_num=atleta_pontos or 0, preco_num=atleta_id * 2,
+                jogos_num=rodada if jogou else rodada - 1,
+                scouts_FS=rodada if jogou else rodada - 1)
+
+    def valores(self, rodada, criterio, posicao_id=5, temporada=2017):
+        return [(row.atleta_id, row.valor) for row in ranking(
+            temporada, rodada, posicao_id, criterio)]
+
+    def test_atualizar_rankings(self):
+        """Test the rankings of every Posicao and criterio."""
+        self.create_rodada(1, (4.0, 8.0, None, 5.0))
+        self.create_rodada(2, (6.0, 0.0, 3.0, 1.0))
+
+        self.assertEqual((18, 0), atualizar_rankings(k=2))
+
+        self.assertEqual([(2, 8.0), (1, 4.0)], self.valores(1, 'pontos'))
+        self.assertEqual([(4, 5.0)], self.valores(1, 'pontos',
+                                                  posicao_id=1))
+        self.assertEqual([(1, 6.0), (3, 3.0)], self.valores(2, 'pontos'))
+        self.assertEqual([(1, 5.0), (2, 4.0)], self.valores(2, 'media'))
+        self.assertEqual([(1, 2.5), (2, 1.0)],
+                         self.valores(2, 'pontos_por_cartoleta'))
+        with self.assertNumQueries(1):
+            self.assertEqual('A1', ranking(2017, 2, 5, 'media')[0].atleta
+                             .apelido)
+
+    def test_atualizar_rankings_incrementally(self):
+        """Test that a new rodada ranks the same as ranking every rodada
+        again, and that only the rodadas from the last one ranked are
+        written."""
+        self.create_rodada(1, (4.0, 8.0, None, 5.0))
+        atualizar_rankings(k=2)
+        self.create_rodada(2, (6.0, 0.0, 3.0, 1.0))
+        self.create_rodada(1, (1.0, 2.0, 3.0, 4.0), temporada=2018)
+
+        # the unchanged rankings of the last rodada ranked are not written
+        self.assertEqual((18, 0), atualizar_rankings(k=2))
+        incremental = list(Ranking.objects.order_by(
+            'temporada', 'rodada', 'posicao', 'criterio',
+            'colocacao').values_list('atleta_id', 'valor'))
+        atualizar_rankings(desde=(2017, 0), k=2)
+        self.assertEqual(incremental, list(Ranking.objects.order_by(
+            'temporada', 'rodada', 'posicao', 'criterio',
+            'colocacao').values_list('atleta_id', 'valor')))
+        self.assertEqual([(3, 3.0), (2, 2.0)],
+                         self.valores(1, 'pontos', temporada=2018))
+
+    def test_atualizar_rankings_totais(self):
+        """Test that a sync goes on from the stored totals, reading only
+        the rodadas from the last one ranked on."""
+        self.create_rodada(1, (4.0, 8.0, None, 5.0))
+        self.create_rodada(2, (6.0, 0.0, 3.0, 1.0))
+        atualizar_rankings(k=2)
+        # kept up to the rodada before the last one ranked
+        self.assertEqual([1], list(RankingTotal.objects.values_list(
+            'rodada', flat=True).distinct()))
+        self.create_rodada(3, (2.0, None, 7.0, 0.5))
+
+        with mock.patch('core.rankings.load_scouts',
+                        wraps=load_scouts) as mock_load:
+            atualizar_rankings(k=2)
+        mock_load.assert_called_once_with(2017, 2)
+        incremental = list(Ranking.objects.order_by(
+            'temporada', 'rodada', 'posicao', 'criterio',
+            'colocacao').values_list('atleta_id', 'valor'))
+        self.assertEqual((0, 0), atualizar_rankings(desde=(2017, 0), k=2))
+        self.assertEqual(incremental, list(Ranking.objects.order_by(
+            'temporada', 'rodada', 'posicao', 'criterio',
+            'colocacao').values_list('atleta_id', 'valor')))
+        self.assertEqual([(1, 4.0)], self.valores(3, 'media'))
+
+    def test_atualizar_rankings_fewer_athletes(self):
+        """Test that the places of a rodada ranked again with fewer
+        athletes are deleted."""
+        self.create_rodada(1, (4.0, 8.0, None, 5.0))
+        atualizar_rankings(k=2)
+        Scout.objects.filter(atleta_id=1).update(pontos_num=0, jogos_num=0,
+                                                 scouts_FS=0)
+
+        # athlete 2 takes the first pontos_por_cartoleta place of a tie
+        self.assertEqual((0, 1), atualizar_rankings(k=2))
+        self.assertEqual(6, Ranking.objects.count())
+        self.assertEqual([(2, 8.0)], self.valores(1, 'pontos'))
+        self.assertEqual([(2, 8.0)], self.valores(1, 'media'))
+
+    def test_rankings_view(self):
+        """Test that a ranking is served as JSON."""
+        self.create_rodada(1, (4.0, 8.0, None, 5.0))
+        atualizar_rankings()
+
+        response = self.client.get(reverse('core:rankings', kwargs={
+            'temporada': '2017', 'rodada': '1', 'posicao_id': '5',
+            'criterio': 'pontos'}))
+
+        self.assertEqual([{'colocacao': 1, 'atleta_id': 2, 'apelido': 'A2',
+                           'valor': 8.0},
+                          {'colocacao': 2, 'atleta_id': 1, 'apelido': 'A1',
+                           'valor': 4.0}],
+                         json.loads(response.content.decode('utf-8')))
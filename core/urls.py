@@ -1,9 +1,21 @@
 from django.conf.urls import url
 
-from core import views
+from core import api, views
 
 app_name = 'core'
 urlpatterns = [
     url(r'^$', views.index, name='index'),
     url(r'^clubes/$', views.clubes, name='clubes'),
+    url(r'^api/scouts/$', api.scouts, name='api-scouts'),
+    url(r'^api/partidas/$', api.partidas, name='api-partidas'),
+    url(r'^api/atletas/$', api.atletas, name='api-atletas'),
+    url(r'^export/scouts_(?P<temporada>\d{4})\.(?P<formato>csv|jsonl)$',
+        views.export, name='export'),
+    url(r'^snapshots/(?P<temporada>\d{4})/(?P<rodada>\d+)/'
+        r'(?P<nome>destaques|pontuacao|forma)\.json$',
+        views.snapshot, name='snapshot'),
+    url(r'^rankings/(?P<temporada>\d{4})/(?P<rodada>\d+)/'
+        r'(?P<posicao_id>\d+)/'
+        r'(?P<criterio>pontos|media|pontos_por_cartoleta)\.json$',
+        views.rankings, name='rankings'),
 ]
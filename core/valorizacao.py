@@ -0,0 +1,105 @@
+import hashlib
+import os
+
+import numpy as np
+from django.core.cache import cache
+
+from core.datasets import CACHE_DIR, DATA_DIR, Table, load_table
+from core.deltas import scout_deltas
+from core.importers import find_season_files
+from core.views import versao
+
+CACHE_KEY = 'valorizacao:{}:{}:{}'
+MODELO_CACHE_KEY = 'valorizacao:modelo:{}'
+# a rodada's mercado is fixed while it is open, a day outlives any rodada
+CACHE_TIMEOUT = 24 * 60 * 60
+
+
+def design_matrix(pontos, medias, precos):
+    """Features of the price change of every athlete: the points of the
+    rodada, the average including them and the price before the rodada"""
+    pontos = np.asarray(pontos, dtype='f8')
+    return np.column_stack((np.ones(len(pontos)), pontos,
+                            np.asarray(medias, dtype='f8'),
+                            np.asarray(precos, dtype='f8')))
+
+
+class ModeloValorizacao():
+    """Linear model of variacao_num, fitted by least squares.
+
+    Prices go up with the points of the rodada, relative to the average
+    of the athlete and to how much was paid for it"""
+
+    def __init__(self, coeficientes):
+        self.coeficientes = np.asarray(coeficientes, dtype='f8')
+
+    @classmethod
+    def fit(cls, scouts):
+        """Fits the rows of the Table 'scouts', such as
+        load_table('scouts'), of the athletes who played"""
+        scouts = scout_deltas(scouts)
+        jogou = scouts['jogou']
+        variacao = np.asarray(scouts['variacao_num'])[jogou]
+        precos = np.asarray(scouts['preco_num'])[jogou] - variacao
+        x = design_matrix(np.asarray(scouts['pontos_num'])[jogou],
+                          np.asarray(scouts['media_num'])[jogou], precos)
+        coeficientes = np.linalg.lstsq(x, variacao, rcond=-1)[0]
+        return cls(coeficientes)
+
+    def predict(self, pontos, medias, precos):
+        """Expected variacao_num of every athlete scoring 'pontos' in the
+        rodada, given its average and current price"""
+        return design_matrix(pontos, medias, precos).dot(self.coeficientes)
+
+
+def _fontes(data_dir):
+    """Fingerprint of the path, size and mtime of the scouts csv of every
+    season under 'data_dir'"""
+    sha1 = hashlib.sha1()
+    for ano, files in find_season_files(data_dir).items():
+        if 'scouts' in files:
+            stat = os.stat(files['scouts'])
+            sha1.update('{}:{}:{}:{}'.format(
+                ano, files['scouts'], stat.st_size,
+                stat.st_mtime).encode('utf-8'))
+    return sha1.hexdigest()
+
+
+def modelo(data_dir=DATA_DIR, cache_dir=CACHE_DIR):
+    """The ModeloValorizacao of every season in 'data_dir', kept in the
+    cache and fitted again once a scouts csv is added or changed"""
+    key = MODELO_CACHE_KEY.format(_fontes(data_dir))
+    coeficientes = cache.get(key)
+    if coeficientes is None:
+        coeficientes = ModeloValorizacao.fit(
+            load_table('scouts', data_dir=data_dir,
+                       cache_dir=cache_dir)).coeficientes
+        cache.set(key, coeficientes, None)
+    return ModeloValorizacao(coeficientes)
+
+
+def prever_mercado(temporada, rodada, atleta_ids, pontos, medias, jogos,
+                   precos, modelo_valorizacao=None):
+    """Table of the expected 'variacao' of every athlete of the mercado of
+    a rodada, in one batched prediction.
+
+    'pontos' are the points expected in the rodada, for instance from
+    ProjecaoState.project, and 'medias', 'jogos' and 'precos' the current
+    media_num, jogos_num and preco_num. The result is cached per
+    (temporada, rodada) and versao(), so later calls for the same rodada
+    return it without recomputing until a sync or an import writes new
+    data"""
+    key = CACHE_KEY.format(temporada, rodada, versao().isoformat())
+    result = cache.get(key)
+    if result is None:
+        modelo_valorizacao = modelo_valorizacao or modelo()
+        pontos = np.asarray(pontos, dtype='f8')
+        jogos = np.asarray(jogos)
+        # the model is fitted to the average after the rodada
+        medias = (np.asarray(medias) * jogos + pontos) / (jogos + 1)
+        result = Table((
+            ('atleta_id', np.asarray(atleta_ids)),
+            ('variacao', modelo_valorizacao.predict(pontos, medias, precos)),
+        ))
+        cache.set(key, result, CACHE_TIMEOUT)
+    return result
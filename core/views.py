@@ -1,13 +1,135 @@
-from django.http import HttpResponse
+import gzip
+import hashlib
+import json
+from functools import partial, wraps
 
-from core.services import CartolafcAPIClient
+from django.core.cache import cache
+from django.db.models import Max, Q
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.views.decorators.http import condition
+
+from core.exports import export_season
+from core.rankings import ranking
+from core.models import Clube, Partida, SyncState
+from core.snapshots import snapshot_path
+
+# SyncState row touched on every synced signal, by the process that wrote
+VERSAO_ENDPOINT = 'versao'
+CACHE_KEY = 'views:{}:{}:{}'
+# content is keyed by versao, a day only bounds the memory of stale keys
+CACHE_TIMEOUT = 24 * 60 * 60
+CONTENT_TYPES = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+
+
+def versao():
+    """Time of the last write to the data the views serve, the last
+    SyncState update.
+
+    Read from the database on every call, so a sync or an import run by
+    another process than the web workers is seen by all of them"""
+    value = SyncState.objects.aggregate(Max('updated_at'))['updated_at__max']
+    if value is None:
+        value = SyncState.objects.get_or_create(
+            endpoint=VERSAO_ENDPOINT)[0].updated_at
+    return value
+
+
+def invalidar(sender=None, **kwargs):
+    """Receiver of core.signals.synced, so every cached view is rendered
+    again from the new data"""
+    state = SyncState.objects.get_or_create(endpoint=VERSAO_ENDPOINT)[0]
+    state.save(update_fields=['updated_at'])
+
+
+def cached_view(view=None, content_type=None):
+    """Serves the text returned by 'view' from the cache, rendered once
+    per versao() and request path, with ETag and Last-Modified headers,
+    so repeated requests answer 304 Not Modified.
+
+    Used as @cached_view or, to set the 'content_type' of the responses,
+    as @cached_view(content_type=...)"""
+    if view is None:
+        return partial(cached_view, content_type=content_type)
+
+    def request_versao(request):
+        # one query per request, for the ETag, Last-Modified and body
+        if not hasattr(request, '_versao'):
+            request._versao = versao()
+        return request._versao
+
+    def content(request, *args, **kwargs):
+        key = CACHE_KEY.format(view.__name__,
+                               request_versao(request).isoformat(),
+                               request.get_full_path())
+        cached = cache.get(key)
+        if cached is None:
+            body = view(request, *args, **kwargs)
+            cached = (hashlib.sha1(body.encode('utf-8')).hexdigest(), body)
+            cache.set(key, cached, CACHE_TIMEOUT)
+        return cached
+
+    @wraps(view)
+    @condition(etag_func=lambda *args, **kwargs: content(*args, **kwargs)[0],
+               last_modified_func=lambda request, *args, **kwargs:
+               request_versao(request))
+    def wrapper(request, *args, **kwargs):
+        return HttpResponse(content(request, *args, **kwargs)[1],
+                            content_type=content_type)
+    return wrapper
 
 
 def index(request):
     return HttpResponse('Index')
 
 
+@cached_view
 def clubes(request):
-    client = CartolafcAPIClient()
-    clube_list = client.clubes()
-    return HttpResponse(', '.join([clube.abreviacao for clube in clube_list]))
+    clube_list = Clube.objects.order_by('id').values_list('abreviacao',
+                                                          flat=True)
+    temporada = Partida.objects.aggregate(Max('temporada'))['temporada__max']
+    if temporada is not None:
+        # the clubs of the current temporada, like the API's
+        partidas = Partida.objects.filter(temporada=temporada)
+        clube_list = clube_list.filter(
+            Q(id__in=partidas.values_list('clube_casa_id')) |
+            Q(id__in=partidas.values_list('clube_visitante_id')))
+    return ', '.join(clube_list)
+
+
+def export(request, temporada, formato):
+    """The scouts of a season, streamed as they are read"""
+    response = StreamingHttpResponse(
+        export_season(int(temporada), formato),
+        content_type=CONTENT_TYPES[formato])
+    response['Content-Disposition'] = (
+        'attachment; filename="scouts_{}.{}"'.format(temporada, formato))
+    return response
+
+
+def snapshot(request, temporada, rodada, nome):
+    """The snapshot 'nome' of a rodada as written by the last sync, sent
+    as stored to clients accepting gzip"""
+    try:
+        with open(snapshot_path(temporada, rodada, nome), 'rb') as f:
+            content = f.read()
+    except (IOError, OSError):
+        raise Http404('No {} snapshot of rodada {} of {}'.format(
+            nome, rodada, temporada))
+    if 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', ''):
+        response = HttpResponse(content, content_type='application/json')
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response = HttpResponse(gzip.decompress(content),
+                                content_type='application/json')
+    response['Vary'] = 'Accept-Encoding'
+    return response
+
+
+@cached_view(content_type='application/json')
+def rankings(request, temporada, rodada, posicao_id, criterio):
+    """The top athletes of a Posicao after a rodada by 'criterio'"""
+    return json.dumps([
+        {'colocacao': row.colocacao, 'atleta_id': row.atleta_id,
+         'apelido': row.atleta.apelido, 'valor': row.valor}
+        for row in ranking(temporada, rodada, posicao_id, criterio)],
+        separators=(',', ':'))